@@ -4,13 +4,8 @@ Revision ID: 001
 Revises:
 Create Date: 2026-01-16
 
-Это пример начальной миграции. После пересоздания базы данных:
-1. Удалите суффикс .example из имени файла
-2. Запустите: alembic upgrade head
-
-Если вы хотите автогенерировать миграцию:
-1. Удалите этот файл
-2. Запустите: alembic revision --autogenerate -m "initial schema"
+Начальная схема. Следующие ревизии повторяют изменения модели по порядку,
+после пересоздания базы данных достаточно: alembic upgrade head
 """
 from typing import Sequence, Union
 
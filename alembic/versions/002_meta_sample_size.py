@@ -0,0 +1,28 @@
+"""add sample size and confidence interval to meta_by_spec
+
+Revision ID: 002
+Revises: 001
+Create Date: 2026-10-19
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '002'
+down_revision: Union[str, None] = '001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Размер выборки RIO и полуширина доверительного интервала meta"""
+    op.add_column('meta_by_spec', sa.Column('sample_size', sa.Integer(), nullable=True))
+    op.add_column('meta_by_spec', sa.Column('ci_half_width', sa.Float(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('meta_by_spec', 'ci_half_width')
+    op.drop_column('meta_by_spec', 'sample_size')
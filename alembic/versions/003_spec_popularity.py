@@ -0,0 +1,40 @@
+"""add spec_popularity table
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-19
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '003'
+down_revision: Union[str, None] = '002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Популярность спеков по нефильтрованному leaderboard"""
+    op.create_table(
+        'spec_popularity',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('class_name', sa.String(length=30), nullable=False),
+            sa.Column('spec', sa.String(length=30), nullable=False),
+        sa.Column('spec_type', sa.String(length=30), nullable=False),
+        sa.Column('encounter_id', sa.Integer(), nullable=False),
+        sa.Column('key', sa.String(length=10), nullable=False),
+        sa.Column('players', sa.Integer(), nullable=False),
+        sa.Column('share', sa.Float(), nullable=False),
+        sa.Column('rank', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('class_name', 'spec', 'encounter_id', 'key',
+                            name='uix_popularity_class_spec_encounter_key')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('spec_popularity')
@@ -0,0 +1,46 @@
+"""add raid difficulty and average hps to meta_by_spec
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-10-19
+
+Существующие строки получают difficulty = 0 (M+).
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '004'
+down_revision: Union[str, None] = '003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Сложность рейда входит в уникальный ключ, HPS хранится рядом с DPS"""
+    op.add_column('meta_by_spec', sa.Column('difficulty', sa.SmallInteger(), server_default='0', nullable=False))
+    op.add_column('meta_by_spec', sa.Column('average_hps', sa.Float(), nullable=True))
+    op.drop_constraint('uix_class_spec_encounter_key', 'meta_by_spec', type_='unique')
+    op.create_unique_constraint(
+        'uix_class_spec_encounter_key_difficulty', 'meta_by_spec',
+        ['class_name', 'spec', 'encounter_id', 'key', 'difficulty']
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint('uix_class_spec_encounter_key_difficulty', 'meta_by_spec', type_='unique')
+    # Строки разных сложностей не помещаются в старый ключ - остается наибольшая сложность
+    op.execute(
+        "DELETE FROM meta_by_spec m WHERE EXISTS ("
+        "SELECT 1 FROM meta_by_spec o WHERE o.class_name = m.class_name AND o.spec = m.spec "
+        "AND o.encounter_id = m.encounter_id AND o.key = m.key AND o.difficulty > m.difficulty)"
+    )
+    op.create_unique_constraint(
+        'uix_class_spec_encounter_key', 'meta_by_spec',
+        ['class_name', 'spec', 'encounter_id', 'key']
+    )
+    op.drop_column('meta_by_spec', 'average_hps')
+    op.drop_column('meta_by_spec', 'difficulty')
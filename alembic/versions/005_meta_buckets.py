@@ -0,0 +1,42 @@
+"""add meta_buckets table
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-19
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '005'
+down_revision: Union[str, None] = '004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Гистограммы по уровню ключа и item level"""
+    op.create_table(
+        'meta_buckets',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('class_name', sa.String(length=30), nullable=False),
+            sa.Column('spec', sa.String(length=30), nullable=False),
+        sa.Column('spec_type', sa.String(length=30), nullable=False),
+        sa.Column('encounter_id', sa.Integer(), nullable=False),
+        sa.Column('key', sa.String(length=10), nullable=False),
+        sa.Column('difficulty', sa.SmallInteger(), server_default='0', nullable=False),
+        sa.Column('bucket_type', sa.String(length=10), nullable=False),
+        sa.Column('bucket', sa.SmallInteger(), nullable=False),
+        sa.Column('players', sa.Integer(), nullable=False),
+        sa.Column('average_amount', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('class_name', 'spec', 'encounter_id', 'key', 'difficulty', 'bucket_type', 'bucket',
+                            name='uix_bucket_class_spec_encounter_key_difficulty_bucket')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('meta_buckets')
@@ -0,0 +1,43 @@
+"""add meta_running_stats table
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-19
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '006'
+down_revision: Union[str, None] = '005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Дневные достаточные статистики инкрементального сбора M+"""
+    op.create_table(
+        'meta_running_stats',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('class_name', sa.String(length=30), nullable=False),
+            sa.Column('spec', sa.String(length=30), nullable=False),
+        sa.Column('spec_type', sa.String(length=30), nullable=False),
+        sa.Column('encounter_id', sa.Integer(), nullable=False),
+        sa.Column('key', sa.String(length=10), nullable=False),
+        sa.Column('metric', sa.String(length=10), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('total', sa.Float(), nullable=False),
+        sa.Column('total_sq', sa.Float(), nullable=False),
+        sa.Column('max_key_level', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('class_name', 'spec', 'encounter_id', 'key', 'metric', 'day',
+                            name='uix_running_class_spec_encounter_key_metric_day')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('meta_running_stats')
@@ -0,0 +1,39 @@
+"""add region to meta_by_spec
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-19
+
+Существующие строки - глобальная мета (region = 'all').
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '007'
+down_revision: Union[str, None] = '006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Регион входит в уникальный ключ meta_by_spec"""
+    op.add_column('meta_by_spec', sa.Column('region', sa.String(length=4), server_default='all', nullable=False))
+    op.drop_constraint('uix_class_spec_encounter_key_difficulty', 'meta_by_spec', type_='unique')
+    op.create_unique_constraint(
+        'uix_class_spec_encounter_key_difficulty_region', 'meta_by_spec',
+        ['class_name', 'spec', 'encounter_id', 'key', 'difficulty', 'region']
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint('uix_class_spec_encounter_key_difficulty_region', 'meta_by_spec', type_='unique')
+    op.execute("DELETE FROM meta_by_spec WHERE region <> 'all'")
+    op.create_unique_constraint(
+        'uix_class_spec_encounter_key_difficulty', 'meta_by_spec',
+        ['class_name', 'spec', 'encounter_id', 'key', 'difficulty']
+    )
+    op.drop_column('meta_by_spec', 'region')
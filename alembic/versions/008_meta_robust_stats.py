@@ -0,0 +1,36 @@
+"""add robust statistics to meta_by_spec
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-19
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '008'
+down_revision: Union[str, None] = '007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Усеченное среднее, медиана, перцентили и стандартное отклонение"""
+    op.add_column('meta_by_spec', sa.Column('trimmed_mean', sa.Float(), nullable=True))
+    op.add_column('meta_by_spec', sa.Column('median', sa.Float(), nullable=True))
+    op.add_column('meta_by_spec', sa.Column('p25', sa.Float(), nullable=True))
+    op.add_column('meta_by_spec', sa.Column('p75', sa.Float(), nullable=True))
+    op.add_column('meta_by_spec', sa.Column('p90', sa.Float(), nullable=True))
+    op.add_column('meta_by_spec', sa.Column('std', sa.Float(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('meta_by_spec', 'std')
+    op.drop_column('meta_by_spec', 'p90')
+    op.drop_column('meta_by_spec', 'p75')
+    op.drop_column('meta_by_spec', 'p25')
+    op.drop_column('meta_by_spec', 'median')
+    op.drop_column('meta_by_spec', 'trimmed_mean')
@@ -0,0 +1,31 @@
+"""add confidence to meta_by_spec
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-10-19
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '009'
+down_revision: Union[str, None] = '008'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Точность meta и индекс для фильтра по качеству выборки"""
+    op.add_column('meta_by_spec', sa.Column('confidence', sa.Float(), nullable=True))
+    op.create_index(
+        'ix_meta_by_spec_lookup_quality', 'meta_by_spec',
+        ['encounter_id', 'spec_type', 'key', 'region', 'sample_size', 'confidence']
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_meta_by_spec_lookup_quality', table_name='meta_by_spec')
+    op.drop_column('meta_by_spec', 'confidence')
@@ -0,0 +1,41 @@
+"""add loadout_popularity table
+
+Revision ID: 010
+Revises: 009
+Create Date: 2026-10-19
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '010'
+down_revision: Union[str, None] = '009'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Популярность талантов и предметов по спекам"""
+    op.create_table(
+        'loadout_popularity',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('class_name', sa.String(length=30), nullable=False),
+            sa.Column('spec', sa.String(length=30), nullable=False),
+        sa.Column('encounter_id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=10), nullable=False),
+        sa.Column('entity_id', sa.Integer(), nullable=False),
+        sa.Column('players', sa.Integer(), nullable=False),
+        sa.Column('sample_players', sa.Integer(), nullable=False),
+        sa.Column('share', sa.Float(), nullable=False),
+        sa.Column('rank', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('class_name', 'spec', 'encounter_id', 'kind', 'entity_id',
+                            name='uix_loadout_class_spec_encounter_kind_entity')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('loadout_popularity')
@@ -0,0 +1,39 @@
+"""add report_compositions table
+
+Revision ID: 011
+Revises: 010
+Create Date: 2026-10-19
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '011'
+down_revision: Union[str, None] = '010'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Кеш составов групп по боям отчетов WarcraftLogs"""
+    op.create_table(
+        'report_compositions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('report_code', sa.String(length=32), nullable=False),
+        sa.Column('fight_id', sa.Integer(), nullable=False),
+        sa.Column('encounter_id', sa.Integer(), nullable=False),
+        sa.Column('key_level', sa.Integer(), nullable=False),
+        sa.Column('composition', sa.String(length=400), nullable=False),
+        sa.Column('source', sa.String(length=10), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('report_code', 'fight_id', name='uix_report_composition_code_fight')
+    )
+    op.create_index('ix_report_compositions_encounter_key', 'report_compositions', ['encounter_id', 'key_level'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_report_compositions_encounter_key', table_name='report_compositions')
+    op.drop_table('report_compositions')
@@ -0,0 +1,26 @@
+"""add source to meta_by_spec
+
+Revision ID: 012
+Revises: 011
+Create Date: 2026-10-19
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '012'
+down_revision: Union[str, None] = '011'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Источник meta: raiderio, local или playerscore"""
+    op.add_column('meta_by_spec', sa.Column('source', sa.String(length=16), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('meta_by_spec', 'source')
@@ -0,0 +1,59 @@
+"""add players and player_best_keys tables
+
+Revision ID: 013
+Revises: 012
+Create Date: 2026-10-19
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '013'
+down_revision: Union[str, None] = '012'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Индекс игроков leaderboard M+ и их лучшие ключи по подземельям"""
+    op.create_table(
+        'players',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('region', sa.String(length=4), nullable=False),
+        sa.Column('realm_slug', sa.String(length=64), nullable=False),
+        sa.Column('name', sa.String(length=64), nullable=False),
+        sa.Column('class_name', sa.String(length=30), nullable=False),
+        sa.Column('spec', sa.String(length=30), nullable=False),
+        sa.Column('spec_type', sa.String(length=30), nullable=False),
+        sa.Column('max_key_level', sa.Integer(), nullable=True),
+        sa.Column('rating', sa.Float(), nullable=True),
+        sa.Column('rating_source', sa.String(length=16), nullable=True),
+        sa.Column('last_seen', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('region', 'realm_slug', 'name', name='uix_player_region_realm_name')
+    )
+    op.create_index('ix_players_spec_rating', 'players', ['class_name', 'spec', 'rating'])
+    op.create_index('ix_players_spec_region_rating', 'players', ['class_name', 'spec', 'region', 'rating'])
+    op.create_table(
+        'player_best_keys',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('region', sa.String(length=4), nullable=False),
+        sa.Column('realm_slug', sa.String(length=64), nullable=False),
+        sa.Column('name', sa.String(length=64), nullable=False),
+        sa.Column('encounter_id', sa.Integer(), nullable=False),
+        sa.Column('key_level', sa.Integer(), nullable=False),
+        sa.Column('duration_ms', sa.Integer(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('region', 'realm_slug', 'name', 'encounter_id', name='uix_player_best_key_player_encounter')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('player_best_keys')
+    op.drop_index('ix_players_spec_region_rating', table_name='players')
+    op.drop_index('ix_players_spec_rating', table_name='players')
+    op.drop_table('players')
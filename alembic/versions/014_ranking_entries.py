@@ -0,0 +1,53 @@
+"""add partitioned ranking_entries table
+
+Revision ID: 014
+Revises: 013
+Create Date: 2026-10-19
+
+Секции ranking_entries_<run_id> создает и удаляет агрегатор.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '014'
+down_revision: Union[str, None] = '013'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Записи leaderboard по прогонам (секционирование LIST по run_id)"""
+    op.create_table(
+        'ranking_entries',
+        sa.Column('run_id', sa.String(length=32), nullable=False),
+        sa.Column('id', sa.BigInteger(), sa.Identity(), nullable=False),
+        sa.Column('encounter_id', sa.Integer(), nullable=False),
+        sa.Column('key', sa.String(length=10), nullable=False),
+        sa.Column('difficulty', sa.SmallInteger(), server_default='0', nullable=False),
+        sa.Column('class_name', sa.String(length=30), nullable=False),
+        sa.Column('spec', sa.String(length=30), nullable=False),
+        sa.Column('spec_type', sa.String(length=30), nullable=False),
+        sa.Column('metric', sa.String(length=12), nullable=False),
+        sa.Column('region', sa.String(length=4), nullable=True),
+        sa.Column('realm_slug', sa.String(length=64), nullable=True),
+        sa.Column('name', sa.String(length=64), nullable=True),
+        sa.Column('amount', sa.Float(), nullable=True),
+        sa.Column('key_level', sa.SmallInteger(), nullable=False),
+        sa.Column('rio', sa.Float(), nullable=True),
+        sa.Column('rio_source', sa.String(length=16), nullable=True),
+        sa.PrimaryKeyConstraint('run_id', 'id'),
+        postgresql_partition_by='LIST (run_id)'
+    )
+    op.create_index(
+        'ix_ranking_entries_leaderboard', 'ranking_entries',
+        ['run_id', 'encounter_id', 'key', 'difficulty', 'class_name', 'spec']
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_ranking_entries_leaderboard', table_name='ranking_entries')
+    op.drop_table('ranking_entries')
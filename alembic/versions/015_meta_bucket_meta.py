@@ -0,0 +1,30 @@
+"""add meta value to meta_buckets
+
+Revision ID: 015
+Revises: 014
+Create Date: 2026-10-19
+
+Корзины, собранные до этой ревизии, не содержат meta: диапазон ключей M+ заполнится после следующего прогона.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '015'
+down_revision: Union[str, None] = '014'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Рейтинг (или очки забега) игроков в корзинах уровня ключа M+"""
+    op.add_column('meta_buckets', sa.Column('meta_players', sa.Integer(), nullable=True))
+    op.add_column('meta_buckets', sa.Column('average_meta', sa.Float(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('meta_buckets', 'average_meta')
+    op.drop_column('meta_buckets', 'meta_players')
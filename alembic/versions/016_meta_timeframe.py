@@ -0,0 +1,58 @@
+"""separate incremental window meta and regional running stats
+
+Revision ID: 016
+Revises: 015
+Create Date: 2026-10-19
+
+Строки meta_by_spec, записанные инкрементальным прогоном до этой ревизии, неотличимы
+от строк полного прогона и остаются с timeframe='season' до следующего полного прогона.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '016'
+down_revision: Union[str, None] = '015'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Период меты в уникальном ключе meta_by_spec, регион и значения дня в meta_running_stats"""
+    op.add_column('meta_by_spec', sa.Column('timeframe', sa.String(length=10), server_default='season', nullable=False))
+    op.drop_constraint('uix_class_spec_encounter_key_difficulty_region', 'meta_by_spec', type_='unique')
+    op.create_unique_constraint(
+        'uix_class_spec_encounter_key_difficulty_region_timeframe', 'meta_by_spec',
+        ['class_name', 'spec', 'encounter_id', 'key', 'difficulty', 'region', 'timeframe']
+    )
+
+    op.add_column('meta_running_stats', sa.Column('region', sa.String(length=4), server_default='all', nullable=False))
+    op.add_column('meta_running_stats', sa.Column('samples', postgresql.ARRAY(sa.Float()), nullable=True))
+    op.drop_constraint('uix_running_class_spec_encounter_key_metric_day', 'meta_running_stats', type_='unique')
+    op.create_unique_constraint(
+        'uix_running_class_spec_encounter_key_metric_region_day', 'meta_running_stats',
+        ['class_name', 'spec', 'encounter_id', 'key', 'metric', 'region', 'day']
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint('uix_running_class_spec_encounter_key_metric_region_day', 'meta_running_stats', type_='unique')
+    op.execute("DELETE FROM meta_running_stats WHERE region <> 'all'")
+    op.create_unique_constraint(
+        'uix_running_class_spec_encounter_key_metric_day', 'meta_running_stats',
+        ['class_name', 'spec', 'encounter_id', 'key', 'metric', 'day']
+    )
+    op.drop_column('meta_running_stats', 'samples')
+    op.drop_column('meta_running_stats', 'region')
+
+    op.drop_constraint('uix_class_spec_encounter_key_difficulty_region_timeframe', 'meta_by_spec', type_='unique')
+    op.execute("DELETE FROM meta_by_spec WHERE timeframe <> 'season'")
+    op.create_unique_constraint(
+        'uix_class_spec_encounter_key_difficulty_region', 'meta_by_spec',
+        ['class_name', 'spec', 'encounter_id', 'key', 'difficulty', 'region']
+    )
+    op.drop_column('meta_by_spec', 'timeframe')
@@ -0,0 +1,53 @@
+"""add source to the meta_by_spec unique key
+
+Revision ID: 017
+Revises: 016
+Create Date: 2026-10-19
+
+Строки без source (записанные до ревизии 012) получают источник, которым тогда
+считалась meta: рейтинг Raider.IO для M+, HPS для хилов и DPS для остальных в рейде.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '017'
+down_revision: Union[str, None] = '016'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Источник meta в уникальном ключе meta_by_spec (рейтинг, очки забегов и DPS не перезаписывают друг друга)"""
+    op.execute(
+        "UPDATE meta_by_spec SET source = CASE "
+        "WHEN key <> 'raid' THEN 'raiderio' "
+        "WHEN spec_type = 'healer' THEN 'hps' "
+        "ELSE 'dps' END "
+        "WHERE source IS NULL"
+    )
+    op.alter_column('meta_by_spec', 'source', existing_type=sa.String(length=16), nullable=False)
+    op.drop_constraint('uix_class_spec_encounter_key_difficulty_region_timeframe', 'meta_by_spec', type_='unique')
+    op.create_unique_constraint(
+        'uix_meta_by_spec_natural_key', 'meta_by_spec',
+        ['class_name', 'spec', 'encounter_id', 'key', 'difficulty', 'region', 'timeframe', 'source']
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint('uix_meta_by_spec_natural_key', 'meta_by_spec', type_='unique')
+    # Старый ключ допускает одну строку на спек: остается строка, вставленная последней
+    op.execute(
+        "DELETE FROM meta_by_spec a USING meta_by_spec b "
+        "WHERE a.class_name = b.class_name AND a.spec = b.spec AND a.encounter_id = b.encounter_id "
+        "AND a.key = b.key AND a.difficulty = b.difficulty AND a.region = b.region "
+        "AND a.timeframe = b.timeframe AND a.id < b.id"
+    )
+    op.create_unique_constraint(
+        'uix_class_spec_encounter_key_difficulty_region_timeframe', 'meta_by_spec',
+        ['class_name', 'spec', 'encounter_id', 'key', 'difficulty', 'region', 'timeframe']
+    )
+    op.alter_column('meta_by_spec', 'source', existing_type=sa.String(length=16), nullable=True)
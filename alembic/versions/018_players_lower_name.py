@@ -0,0 +1,29 @@
+"""add functional index on lower(name) to players
+
+Revision ID: 018
+Revises: 017
+Create Date: 2026-10-19
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '018'
+down_revision: Union[str, None] = '017'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Поиск игрока без учета регистра имени: region, realm_slug, lower(name)"""
+    op.create_index(
+        'ix_players_region_realm_lower_name', 'players',
+        ['region', 'realm_slug', sa.text('lower(name)')]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_players_region_realm_lower_name', table_name='players')
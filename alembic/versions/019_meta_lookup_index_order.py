@@ -0,0 +1,34 @@
+"""reorder ix_meta_by_spec_lookup_quality columns
+
+Revision ID: 019
+Revises: 018
+Create Date: 2026-10-19
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '019'
+down_revision: Union[str, None] = '018'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Индекс выборки API без encounter в начале: агрегат по всем подземельям тоже использует индекс"""
+    op.drop_index('ix_meta_by_spec_lookup_quality', table_name='meta_by_spec')
+    op.create_index(
+        'ix_meta_by_spec_lookup_quality', 'meta_by_spec',
+        ['spec_type', 'key', 'region', 'encounter_id', 'sample_size', 'confidence']
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_meta_by_spec_lookup_quality', table_name='meta_by_spec')
+    op.create_index(
+        'ix_meta_by_spec_lookup_quality', 'meta_by_spec',
+        ['encounter_id', 'spec_type', 'key', 'region', 'sample_size', 'confidence']
+    )
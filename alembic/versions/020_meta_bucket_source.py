@@ -0,0 +1,53 @@
+"""add source to meta_buckets
+
+Revision ID: 020
+Revises: 019
+Create Date: 2026-10-19
+
+Корзины без source получают источник, как строки meta_by_spec в ревизии 017:
+рейтинг Raider.IO для M+, HPS для хилов и DPS для остальных в рейде.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '020'
+down_revision: Union[str, None] = '019'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Источник meta корзины в уникальном ключе meta_buckets (гистограммы разных источников не смешиваются)"""
+    op.add_column('meta_buckets', sa.Column('source', sa.String(length=16), nullable=True))
+    op.execute(
+        "UPDATE meta_buckets SET source = CASE "
+        "WHEN key <> 'raid' THEN 'raiderio' "
+        "WHEN spec_type = 'healer' THEN 'hps' "
+        "ELSE 'dps' END"
+    )
+    op.alter_column('meta_buckets', 'source', existing_type=sa.String(length=16), nullable=False)
+    op.drop_constraint('uix_bucket_class_spec_encounter_key_difficulty_bucket', 'meta_buckets', type_='unique')
+    op.create_unique_constraint(
+        'uix_meta_bucket_natural_key', 'meta_buckets',
+        ['class_name', 'spec', 'encounter_id', 'key', 'difficulty', 'source', 'bucket_type', 'bucket']
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint('uix_meta_bucket_natural_key', 'meta_buckets', type_='unique')
+    # Старый ключ допускает одну корзину на спек: остается корзина, вставленная последней
+    op.execute(
+        "DELETE FROM meta_buckets a USING meta_buckets b "
+        "WHERE a.class_name = b.class_name AND a.spec = b.spec AND a.encounter_id = b.encounter_id "
+        "AND a.key = b.key AND a.difficulty = b.difficulty AND a.bucket_type = b.bucket_type "
+        "AND a.bucket = b.bucket AND a.id < b.id"
+    )
+    op.create_unique_constraint(
+        'uix_bucket_class_spec_encounter_key_difficulty_bucket', 'meta_buckets',
+        ['class_name', 'spec', 'encounter_id', 'key', 'difficulty', 'bucket_type', 'bucket']
+    )
+    op.drop_column('meta_buckets', 'source')
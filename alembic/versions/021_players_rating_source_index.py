@@ -0,0 +1,32 @@
+"""add rating_source to the players rank indexes
+
+Revision ID: 021
+Revises: 020
+Create Date: 2026-10-19
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '021'
+down_revision: Union[str, None] = '020'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Ранг игрока считается среди рейтингов одного источника: rating_source - перед rating в индексах ранга"""
+    op.drop_index('ix_players_spec_region_rating', table_name='players')
+    op.drop_index('ix_players_spec_rating', table_name='players')
+    op.create_index('ix_players_spec_rating', 'players', ['class_name', 'spec', 'rating_source', 'rating'])
+    op.create_index('ix_players_spec_region_rating', 'players', ['class_name', 'spec', 'region', 'rating_source', 'rating'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_players_spec_region_rating', table_name='players')
+    op.drop_index('ix_players_spec_rating', table_name='players')
+    op.create_index('ix_players_spec_rating', 'players', ['class_name', 'spec', 'rating'])
+    op.create_index('ix_players_spec_region_rating', 'players', ['class_name', 'spec', 'region', 'rating'])
@@ -8,9 +8,11 @@ import base64
 import httpx
 import asyncio
 import logging
-from typing import Optional, Dict, Any
+from typing import Optional, List, Dict, Any, Union
 from dotenv import load_dotenv
 
+from app.agregator.ttl_cache import TTLCache, MISSING, Uncached
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
@@ -22,11 +24,15 @@ BLIZZARD_CLIENT_SECRET = os.getenv("BLIZZARD_CLIENT_SECRET")
 # Blizzard API endpoints
 BLIZZARD_TOKEN_URL = "https://oauth.battle.net/token"
 BLIZZARD_API_BASE = "https://us.api.blizzard.com"  # Можно менять регион: us, eu, kr, tw
+BLIZZARD_REGION_API = "https://{region}.api.blizzard.com"
 
-# Кеш для access token
-_blizzard_token_cache: Optional[Dict[str, Any]] = None
+# Кеш для access token (срок записи - из ответа OAuth)
+_blizzard_token_cache = TTLCache(maxsize=1, ttl=86400 - 3600)
 _blizzard_token_lock = asyncio.Lock()
 
+# Кеш иконок Journal: (вид, ID, locale) -> URL; "не найдено" перепроверяется через час
+_icon_cache = TTLCache(maxsize=1024, ttl=7 * 86400, negative_ttl=3600)
+
 
 async def get_blizzard_access_token() -> str:
     """
@@ -34,13 +40,12 @@ async def get_blizzard_access_token() -> str:
 
     Документация: https://develop.battle.net/documentation/guides/using-oauth
     """
-    global _blizzard_token_cache
-
     async with _blizzard_token_lock:
         # Проверяем кеш
-        if _blizzard_token_cache and _blizzard_token_cache.get("expires_at", 0) > asyncio.get_event_loop().time():
+        token = _blizzard_token_cache.get(BLIZZARD_TOKEN_URL)
+        if token is not MISSING:
             logger.debug("Используется закешированный Blizzard access token")
-            return _blizzard_token_cache["token"]
+            return token
 
         logger.info("Получение нового access token от Blizzard API...")
 
@@ -68,13 +73,10 @@ async def get_blizzard_access_token() -> str:
 
                 # Кешируем токен (обычно живет 24 часа)
                 expires_in = data.get("expires_in", 86400)
-                _blizzard_token_cache = {
-                    "token": data["access_token"],
-                    "expires_at": asyncio.get_event_loop().time() + expires_in - 3600
-                }
+                _blizzard_token_cache.set(BLIZZARD_TOKEN_URL, data["access_token"], ttl=expires_in - 3600)
 
                 logger.info(f"✅ Blizzard access token получен, истекает через {expires_in // 3600} часов")
-                return _blizzard_token_cache["token"]
+                return data["access_token"]
 
         except httpx.HTTPStatusError as e:
             logger.error(f"❌ HTTP ошибка при получении Blizzard токена: {e.response.status_code} - {e.response.text}")
@@ -88,6 +90,20 @@ async def get_blizzard_access_token() -> str:
 
 
 async def get_journal_encounter_icon(journal_id: int, locale: str = "en_US") -> Optional[str]:
+    """URL иконки encounter (с кешированием, см. _fetch_journal_encounter_icon)"""
+    return await _icon_cache.get_or_load(
+        ("encounter", journal_id, locale), lambda: _fetch_journal_encounter_icon(journal_id, locale)
+    )
+
+
+async def get_journal_instance_icon(instance_id: int, locale: str = "en_US") -> Optional[str]:
+    """URL иконки подземелья (с кешированием, см. _fetch_journal_instance_icon)"""
+    return await _icon_cache.get_or_load(
+        ("instance", instance_id, locale), lambda: _fetch_journal_instance_icon(instance_id, locale)
+    )
+
+
+async def _fetch_journal_encounter_icon(journal_id: int, locale: str = "en_US") -> Union[Optional[str], Uncached]:
     """
     Получение URL иконки encounter из Blizzard Journal API
 
@@ -96,7 +112,8 @@ async def get_journal_encounter_icon(journal_id: int, locale: str = "en_US") ->
         locale: Локализация (en_US, ru_RU, etc.)
 
     Returns:
-        URL иконки или None если не найдена
+        URL иконки, None если не найдена (кешируется),
+        Uncached(None) при временной ошибке (не кешируется)
 
     API Docs: https://develop.battle.net/documentation/world-of-warcraft/game-data-apis
     Endpoint: /data/wow/journal-encounter/{journalEncounterId}
@@ -154,15 +171,16 @@ async def get_journal_encounter_icon(journal_id: int, locale: str = "en_US") ->
     except httpx.HTTPStatusError as e:
         if e.response.status_code == 404:
             logger.warning(f"⚠️  Journal encounter не найден: journal_id={journal_id}")
-        else:
-            logger.error(f"❌ HTTP ошибка при получении иконки для journal_id={journal_id}: {e.response.status_code}")
-        return None
+            return None
+        logger.error(f"❌ HTTP ошибка при получении иконки для journal_id={journal_id}: {e.response.status_code}")
+        # Временная ошибка Blizzard API не кешируется как "не найдено"
+        return Uncached()
     except Exception as e:
         logger.error(f"❌ Ошибка при получении иконки для journal_id={journal_id}: {e}", exc_info=True)
-        return None
+        return Uncached()
 
 
-async def get_journal_instance_icon(instance_id: int, locale: str = "en_US") -> Optional[str]:
+async def _fetch_journal_instance_icon(instance_id: int, locale: str = "en_US") -> Union[Optional[str], Uncached]:
     """
     Получение URL иконки подземелья (instance) из Blizzard Journal API
 
@@ -171,7 +189,7 @@ async def get_journal_instance_icon(instance_id: int, locale: str = "en_US") ->
         locale: Локализация
 
     Returns:
-        URL иконки или None
+        URL иконки, None если не найдена или Uncached(None) при временной ошибке
 
     Endpoint: /data/wow/journal-instance/{journalInstanceId}
     """
@@ -238,12 +256,44 @@ async def get_journal_instance_icon(instance_id: int, locale: str = "en_US") ->
     except httpx.HTTPStatusError as e:
         if e.response.status_code == 404:
             logger.warning(f"⚠️  Journal instance не найден: instance_id={instance_id}")
-        else:
-            logger.error(f"❌ HTTP ошибка при получении иконки для instance_id={instance_id}: {e.response.status_code}")
-        return None
+            return None
+        logger.error(f"❌ HTTP ошибка при получении иконки для instance_id={instance_id}: {e.response.status_code}")
+        # Временная ошибка Blizzard API не кешируется как "не найдено"
+        return Uncached()
     except Exception as e:
         logger.error(f"❌ Ошибка при получении иконки для instance_id={instance_id}: {e}", exc_info=True)
-        return None
+        return Uncached()
+
+
+async def get_realm_index(region: str) -> List[Dict[str, Any]]:
+    """
+    Список реалмов региона из Realm API
+
+    Запрос без locale: name каждого реалма - словарь локаль -> имя,
+    поэтому в каталог попадают и локализованные имена (ru_RU, ko_KR, zh_TW).
+
+    Endpoint: /data/wow/realm/index (namespace dynamic-{region})
+
+    Returns:
+        [{"id": 1303, "slug": "tarren-mill", "name": {"en_US": "Tarren Mill", ...}}, ...]
+    """
+    token = await get_blizzard_access_token()
+    url = f"{BLIZZARD_REGION_API.format(region=region)}/data/wow/realm/index"
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        r = await client.get(
+            url,
+            headers={"Authorization": f"Bearer {token}"},
+            params={"namespace": f"dynamic-{region}"}
+        )
+        r.raise_for_status()
+        realms = r.json().get("realms", [])
+        logger.info(f"✅ Realm index {region}: {len(realms)} реалмов")
+        return realms
+
+
+def has_credentials() -> bool:
+    return bool(BLIZZARD_CLIENT_ID and BLIZZARD_CLIENT_SECRET)
 
 
 async def test_blizzard_api():
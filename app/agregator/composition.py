@@ -0,0 +1,136 @@
+"""
+Составы групп M+ (tank / healer / dps) по report code и fight ID
+
+Каждый забег M+ - группа из 5 игроков, и один и тот же report/fight встречается
+на leaderboard разных спеков. Записи всех уже полученных leaderboard группируются
+по (report code, fight ID): если все 5 участников нашлись на leaderboard, состав
+известен без дополнительных запросов. Для остальных боев состав берется из
+playerDetails отчета - один запрос на report code, каждый бой один раз
+(известные бои хранятся в таблице report_compositions).
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.agregator.constant import SPEC_ROLE_METRIC
+
+GROUP_SIZE = 5
+ROLE_ORDER = ("tank", "healer", "dps")
+
+# Разделители строки состава: роли через "|", участники роли через ","
+ROLE_SEPARATOR = "|"
+MEMBER_SEPARATOR = ","
+
+
+def composition_key(members: Iterable[Tuple[str, str, str]]) -> str:
+    """
+    Каноническая строка состава
+
+    Args:
+        members: [(role, class_name, spec), ...]
+
+    Returns:
+        "Warrior:Protection|Priest:Discipline|Mage:Fire,Rogue:Outlaw,Shaman:Enhancement"
+    """
+    by_role: Dict[str, List[str]] = {role: [] for role in ROLE_ORDER}
+    for role, class_name, spec in members:
+        by_role.setdefault(role, []).append(f"{class_name}:{spec}")
+    return ROLE_SEPARATOR.join(MEMBER_SEPARATOR.join(sorted(by_role[role])) for role in ROLE_ORDER)
+
+
+def parse_composition(composition: str) -> Dict[str, List[str]]:
+    """Строка состава -> {"tank": [...], "healer": [...], "dps": [...]}"""
+    parts = composition.split(ROLE_SEPARATOR)
+    return {
+        role: [member for member in (parts[i].split(MEMBER_SEPARATOR) if i < len(parts) else []) if member]
+        for i, role in enumerate(ROLE_ORDER)
+    }
+
+
+class FightGroup:
+    """Участники одного боя, найденные на leaderboard спеков"""
+
+    __slots__ = ("encounter_id", "key_level", "members")
+
+    def __init__(self, encounter_id: int, key_level: int):
+        self.encounter_id = encounter_id
+        self.key_level = key_level
+        self.members: Dict[str, Tuple[str, str]] = {}  # имя игрока -> (class, spec)
+
+    @property
+    def is_complete(self) -> bool:
+        return len(self.members) >= GROUP_SIZE
+
+    def composition(self) -> str:
+        return composition_key(
+            (SPEC_ROLE_METRIC.get(spec, ("dps",))[0], class_name, spec)
+            for class_name, spec in self.members.values()
+        )
+
+
+class CompositionCollector:
+    """Группировка записей leaderboard M+ по (report code, fight ID)"""
+
+    def __init__(self):
+        self.fights: Dict[Tuple[str, int], FightGroup] = {}
+
+    def add(self, encounter_id: int, record: Any) -> None:
+        """record - RankingRecord с report_code, fight_id, name, class_name, spec, bracket"""
+        if not record.report_code or not record.fight_id or not record.name:
+            return
+        if not record.class_name or not record.spec:
+            return
+        key = (record.report_code, record.fight_id)
+        group = self.fights.get(key)
+        if group is None:
+            group = self.fights[key] = FightGroup(encounter_id, record.bracket)
+        group.members[record.name] = (record.class_name, record.spec)
+
+    def merge(self, other: "CompositionCollector") -> None:
+        """
+        Добавить бои другого шарда прогона
+
+        Участники одного боя могут найтись на leaderboard разных шардов -
+        состав боя собирается из всех.
+        """
+        for key, theirs in other.fights.items():
+            group = self.fights.get(key)
+            if group is None:
+                self.fights[key] = theirs
+            else:
+                group.members.update(theirs.members)
+
+    def __len__(self) -> int:
+        return len(self.fights)
+
+    def complete(self) -> Dict[Tuple[str, int], FightGroup]:
+        return {key: group for key, group in self.fights.items() if group.is_complete}
+
+    def incomplete(self) -> Dict[Tuple[str, int], FightGroup]:
+        return {key: group for key, group in self.fights.items() if not group.is_complete}
+
+
+def composition_from_player_details(details: Optional[Dict[str, Any]]) -> Optional[str]:
+    """
+    Состав из ответа playerDetails отчета WarcraftLogs
+
+    playerDetails: {"playerDetails": {"tanks": [...], "healers": [...], "dps": [...]}},
+    у игрока type - класс, specs[0].spec - спек.
+    """
+    if not details:
+        return None
+    details = details.get("data", details)
+    details = details.get("playerDetails", details)
+
+    members = []
+    for role, field in (("tank", "tanks"), ("healer", "healers"), ("dps", "dps")):
+        for player in details.get(field) or []:
+            specs = player.get("specs") or []
+            spec = specs[0].get("spec") if specs and isinstance(specs[0], dict) else None
+            class_name = player.get("type")
+            if not class_name or not spec:
+                return None
+            members.append((role, class_name, spec))
+
+    if len(members) != GROUP_SIZE:
+        return None
+    return composition_key(members)
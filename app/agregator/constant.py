@@ -10,6 +10,24 @@ TOKEN_URL = "https://www.warcraftlogs.com/oauth/token"
 API_URL = "https://www.warcraftlogs.com/api/v2/client"
 RIO_URL = "https://raider.io/api/v1/characters/profile"
 
+# Rate limiting внешних API
+WCL_MAX_CONCURRENCY = int(os.getenv("WCL_MAX_CONCURRENCY", "3"))  # Одновременных запросов к WarcraftLogs
+RIO_MAX_CONCURRENCY = int(os.getenv("RIO_MAX_CONCURRENCY", "3"))  # Одновременных запросов к RaiderIO (строгий лимит)
+RIO_MIN_INTERVAL = float(os.getenv("RIO_MIN_INTERVAL", "0.6"))  # Минимум секунд между запросами к RaiderIO
+
+# Пулы учетных данных: у каждого клиента WarcraftLogs и ключа Raider.IO свои лимиты
+# (WCL_MAX_CONCURRENCY, поинты в час, RIO_MAX_CONCURRENCY и RIO_MIN_INTERVAL - на одни учетные данные).
+# WCL_CLIENTS - дополнительные клиенты WarcraftLogs "id:secret,id:secret" к CLIENT_ID/CLIENT_SECRET,
+# RIO_API_KEYS - ключи API Raider.IO через запятую (пусто - анонимный доступ)
+WCL_CLIENTS = [(CLIENT_ID, CLIENT_SECRET)] if CLIENT_ID and CLIENT_SECRET else []
+WCL_CLIENTS += [
+    tuple(pair.strip().split(":", 1)) for pair in os.getenv("WCL_CLIENTS", "").split(",") if ":" in pair
+]
+RIO_API_KEYS = [key.strip() for key in os.getenv("RIO_API_KEYS", "").split(",") if key.strip()]
+# Как часто перечитывать rateLimitData клиентов WarcraftLogs в ходе прогона (секунды);
+# без поинтов у всех клиентов задачи ждут сброса часового счетчика
+WCL_RATE_LIMIT_REFRESH_SECONDS = float(os.getenv("WCL_RATE_LIMIT_REFRESH_SECONDS", "300"))
+
 WOW_CLASS_SPECS = {
     "DeathKnight": ["Blood", "Frost", "Unholy"],
     "DemonHunter": ["Havoc", "Vengeance"],
@@ -78,6 +96,19 @@ ENCOUNTERS = {
     62662: "The Dawnbreaker"
 }
 
+# Таймеры подземелий M+ текущего сезона (мс) для локального расчета рейтинга (mplus_score)
+# Обновлять вместе с ENCOUNTERS при смене сезона
+MPLUS_TIMERS_MS = {
+    62660: 30 * 60_000,           # Ara-Kara, City of Echoes
+    12830: 31 * 60_000,           # Eco-Dome Al'dani
+    62287: 31 * 60_000,           # Halls of Atonement
+    62773: 33 * 60_000,           # Operation: Floodgate
+    62649: 32 * 60_000 + 30_000,  # Priory of the Sacred Flame
+    112442: 30 * 60_000,          # Tazavesh: So'leah's Gambit
+    112441: 35 * 60_000,          # Tazavesh: Streets of Wonder
+    62662: 31 * 60_000,           # The Dawnbreaker
+}
+
 RAID = {
     2902: "Ulgrax the Devourer",
     2917: "The Bloodbound Horror",
@@ -88,3 +119,132 @@ RAID = {
     2921: "The Silken Court",
     2922: "Queen Ansurek"
 }
+
+# Leader election агрегатора через PostgreSQL advisory lock
+# AGGREGATOR_LOCK_MODE: "exit" - второй экземпляр сразу завершается, "wait" - ждет освобождения lock
+AGGREGATOR_LOCK_NAME = os.getenv("AGGREGATOR_LOCK_NAME", "wow_meta_aggregator")
+AGGREGATOR_LOCK_MODE = os.getenv("AGGREGATOR_LOCK_MODE", "exit").lower()
+AGGREGATOR_LOCK_WAIT_TIMEOUT = float(os.getenv("AGGREGATOR_LOCK_WAIT_TIMEOUT", "0"))  # 0 = ждать бесконечно
+AGGREGATOR_LOCK_POLL_INTERVAL = float(os.getenv("AGGREGATOR_LOCK_POLL_INTERVAL", "5"))
+AGGREGATOR_LOCK_HEARTBEAT_INTERVAL = float(os.getenv("AGGREGATOR_LOCK_HEARTBEAT_INTERVAL", "30"))
+
+# Токен для защищенных admin эндпоинтов API (точечное обновление меты)
+# Если не задан - admin эндпоинты отключены
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")
+
+# История стоимости прогонов (для --plan оценки без сетевых запросов)
+AGGREGATOR_COST_HISTORY_PATH = os.getenv("AGGREGATOR_COST_HISTORY_PATH", "aggregator_costs.json")
+
+# Адаптивная выборка игроков для среднего RIO спека
+# Игроки опрашиваются в случайном порядке, выборка останавливается когда
+# доверительный интервал среднего уже RIO_SAMPLING_TOLERANCE от среднего
+RIO_SAMPLING_ENABLED = os.getenv("RIO_SAMPLING_ENABLED", "false").lower() == "true"
+RIO_SAMPLING_TOLERANCE = float(os.getenv("RIO_SAMPLING_TOLERANCE", "0.02"))  # ±2% от среднего
+RIO_SAMPLING_MIN_SAMPLES = int(os.getenv("RIO_SAMPLING_MIN_SAMPLES", "15"))
+RIO_SAMPLING_BATCH_SIZE = int(os.getenv("RIO_SAMPLING_BATCH_SIZE", "6"))
+META_CONFIDENCE_LEVEL = float(os.getenv("META_CONFIDENCE_LEVEL", "0.95"))
+if not 0 < META_CONFIDENCE_LEVEL < 1:
+    raise ValueError(f"META_CONFIDENCE_LEVEL должен быть в интервале (0, 1): {META_CONFIDENCE_LEVEL}")
+
+# Устойчивые статистики меты: доля значений, отбрасываемая с каждого края для усеченного среднего,
+# и статистика для значения meta ("mean", "trimmed_mean" или "median")
+META_TRIM_FRACTION = float(os.getenv("META_TRIM_FRACTION", "0.1"))
+META_STATISTICS = ("mean", "trimmed_mean", "median")
+META_STATISTIC = os.getenv("META_STATISTIC", "mean")
+if META_STATISTIC not in META_STATISTICS:
+    raise ValueError(f"Неизвестная статистика меты META_STATISTIC={META_STATISTIC} (ожидается {', '.join(META_STATISTICS)})")
+
+# Глубина пагинации characterRankings (страниц по 100 игроков) для каждого типа контента
+WCL_PAGES_MPLUS_LOW = int(os.getenv("WCL_PAGES_MPLUS_LOW", "1"))
+WCL_PAGES_MPLUS_HIGH = int(os.getenv("WCL_PAGES_MPLUS_HIGH", "1"))
+WCL_PAGES_RAID = int(os.getenv("WCL_PAGES_RAID", "1"))
+WCL_PAGES_POPULARITY = int(os.getenv("WCL_PAGES_POPULARITY", "5"))  # Нефильтрованный leaderboard популярности
+
+# Сложности рейда (WarcraftLogs difficulty ID)
+RAID_DIFFICULTIES = {
+    "heroic": 4,
+    "mythic": 5,
+}
+# Какие сложности собирать (через запятую): heroic,mythic
+RAID_DIFFICULTIES_ENABLED = [
+    name.strip() for name in os.getenv("RAID_DIFFICULTIES_ENABLED", "heroic,mythic").split(",")
+    if name.strip() in RAID_DIFFICULTIES
+]
+# Спеков одной роли в одном запросе рейда (группа роли больше - делится на несколько запросов)
+RAID_GROUP_MAX_SPECS = int(os.getenv("RAID_GROUP_MAX_SPECS", "13"))
+
+# Ширина корзины item level для гистограмм рейда
+ILVL_BUCKET_WIDTH = int(os.getenv("ILVL_BUCKET_WIDTH", "3"))
+
+# Инкрементальный сбор M+: только рейтинги за сегодня (timeframe: Today),
+# мета считается по достаточным статистикам за последние INCREMENTAL_WINDOW_DAYS дней
+INCREMENTAL_WINDOW_DAYS = int(os.getenv("INCREMENTAL_WINDOW_DAYS", "14"))
+# Период меты: "season" - полный прогон, "recent" - окно инкрементального сбора
+# (хранятся раздельно, инкрементальный прогон не перезаписывает мету сезона)
+TIMEFRAME_SEASON = "season"
+TIMEFRAME_RECENT = "recent"
+TIMEFRAMES = (TIMEFRAME_SEASON, TIMEFRAME_RECENT)
+# Партиция рейтингов WarcraftLogs (патч); не задана - партиция по умолчанию
+WCL_PARTITION = int(os.getenv("WCL_PARTITION")) if os.getenv("WCL_PARTITION") else None
+
+# Регионы для региональной меты (как в normalize_region); "all" - все регионы вместе
+REGIONS = ("eu", "us", "kr", "tw")
+REGION_ALL = "all"
+
+# Популярность талантов и предметов (characterRankings с includeCombatantInfo, тяжелые ответы)
+LOADOUT_ENABLED = os.getenv("LOADOUT_ENABLED", "false").lower() == "true"
+LOADOUT_TOP_K = int(os.getenv("LOADOUT_TOP_K", "20"))  # Сколько талантов / предметов хранить на спек и encounter
+WCL_PAGES_LOADOUT = int(os.getenv("WCL_PAGES_LOADOUT", "1"))
+
+# Составы групп M+ по report code / fight ID (после сбора меты)
+COMPOSITION_ENABLED = os.getenv("COMPOSITION_ENABLED", "false").lower() == "true"
+# Максимум отчетов, запрашиваемых за один прогон (бои без полного состава на leaderboard)
+COMPOSITION_MAX_REPORTS = int(os.getenv("COMPOSITION_MAX_REPORTS", "200"))
+
+# Источник меты M+ по диапазону ключей: "rio" - средний рейтинг игроков leaderboard по dps
+# (Raider.IO или локальный расчет, см. RIO_SOURCE), "playerscore" - среднее очков забегов
+# из leaderboard по metric: playerscore (один запрос WCL на leaderboard, без запросов рейтинга)
+MPLUS_META_SOURCE = {
+    "low": os.getenv("META_SOURCE_LOW_KEYS", "rio").lower(),
+    "high": os.getenv("META_SOURCE_HIGH_KEYS", "rio").lower(),
+}
+
+# Источник рейтинга игроков для меты M+: "raiderio" - запросы к Raider.IO,
+# "local" - расчет по забегам из уже скачанных leaderboard WarcraftLogs (mplus_score)
+RIO_SOURCE = os.getenv("RIO_SOURCE", "raiderio").lower()
+
+# Источники meta (meta_by_spec.source) в порядке приоритета для ответа API:
+# рейтинг Raider.IO, локальный рейтинг, очки забегов, DPS, HPS
+META_SOURCES = ("raiderio", "local", "playerscore", "dps", "hps")
+
+# Индекс игроков leaderboard (таблицы players и player_best_keys, без сетевых запросов)
+PLAYER_INDEX_ENABLED = os.getenv("PLAYER_INDEX_ENABLED", "true").lower() == "true"
+
+# Снимки сырых ответов WCL / Raider.IO для повтора прогона без сети (--replay <run_id>)
+SNAPSHOT_ENABLED = os.getenv("SNAPSHOT_ENABLED", "false").lower() == "true"
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_SEGMENT_BYTES = int(os.getenv("SNAPSHOT_SEGMENT_BYTES", str(256 * 1024 * 1024)))
+
+# Сырые записи leaderboard в таблице ranking_entries (секция на прогон) и мета из них в SQL.
+# Только полные прогоны: инкрементальный видит рейтинги за один день
+RANKING_FACTS_ENABLED = os.getenv("RANKING_FACTS_ENABLED", "false").lower() == "true"
+RANKING_FACTS_KEEP_RUNS = int(os.getenv("RANKING_FACTS_KEEP_RUNS", "8"))  # Сколько последних полных прогонов хранить
+
+# Общий кеш RIO score и лимит запросов к Raider.IO для нескольких процессов (пусто - в памяти процесса)
+RIO_REDIS_URL = os.getenv("RIO_REDIS_URL", "")
+RIO_RATE_BURST = int(os.getenv("RIO_RATE_BURST", "1"))  # Запросов подряд без ожидания (емкость token bucket)
+
+# Срок RIO score в кеше (в памяти процесса и в Redis) и предел записей кеша процесса (LRU)
+RIO_CACHE_TTL = int(os.getenv("RIO_CACHE_TTL", str(6 * 3600)))  # Секунд для найденного score
+RIO_CACHE_MISS_TTL = int(os.getenv("RIO_CACHE_MISS_TTL", "3600"))  # Секунд для игрока без RIO
+RIO_CACHE_MAXSIZE = int(os.getenv("RIO_CACHE_MAXSIZE", "200000"))
+
+# Каталог реалмов Blizzard (Realm API): slug реалма по имени сервера WCL,
+# игроки с неизвестных реалмов не запрашиваются в Raider.IO. Обновляется, если старше REALM_CATALOG_MAX_AGE_DAYS
+REALM_CATALOG_ENABLED = os.getenv("REALM_CATALOG_ENABLED", "true").lower() == "true"
+REALM_CATALOG_PATH = os.getenv("REALM_CATALOG_PATH", "realm_catalog.json")
+REALM_CATALOG_MAX_AGE_DAYS = int(os.getenv("REALM_CATALOG_MAX_AGE_DAYS", "7"))
+
+# Многопроцессный сбор: задачи прогона делятся на шарды по процессам, лимиты API - между шардами,
+# в БД пишет только основной процесс. 1 - сбор в одном процессе (по умолчанию; --workers переопределяет)
+AGGREGATOR_WORKERS = int(os.getenv("AGGREGATOR_WORKERS", "1"))
@@ -0,0 +1,320 @@
+"""
+Пулы учетных данных WarcraftLogs и Raider.IO
+
+С одним CLIENT_ID прогон ограничен поинтами WarcraftLogs в час и
+WCL_MAX_CONCURRENCY, с анонимным Raider.IO - интервалом RIO_MIN_INTERVAL.
+В пуле у каждого клиента WCL (WCL_CLIENTS) и ключа Raider.IO (RIO_API_KEYS) свои:
+- семафор одновременных запросов;
+- токен OAuth и учет поинтов (rateLimitData клиента плюс оценка поинтов
+  задач, выданных после него) - для WCL;
+- интервал между запросами и пауза после 429 - для RIO.
+
+Задача WCL выдается клиенту с наибольшим остатком поинтов за час, запрос RIO -
+ключу, интервал которого освобождается раньше. Лимиты каждого клиента
+соблюдаются, а пропускная способность растет с размером пула.
+
+rateLimitData клиентов WCL перечитывается в ходе прогона (не реже
+refresh_interval и когда остатка не хватает на задачу). Если поинтов нет ни у
+одного клиента, задача ждет сброса часового счетчика, а не уходит в 429.
+"""
+
+import hashlib
+import logging
+import math
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Пауза ключа Raider.IO после ответа 429 (секунды)
+RIO_THROTTLE_BACKOFF = 10.0
+
+
+class WclCredential:
+    """
+    Клиент OAuth WarcraftLogs: семафор запросов и учет поинтов за час
+
+    limit_share - доля часового остатка клиента, доступная процессу: клиент,
+    общий для N шардов, дает каждому 1/N остатка по rateLimitData (его
+    pointsSpentThisHour - общий для всех процессов).
+    """
+
+    def __init__(
+        self,
+        client_id: Optional[str],
+        client_secret: Optional[str],
+        concurrency: int,
+        name: str,
+        clock: Callable[[], float] = time.monotonic,
+        limit_share: float = 1.0,
+    ):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.name = name
+        self.limit_share = limit_share
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self._clock = clock
+        self.limit_per_hour: Optional[float] = None
+        self.points_spent = 0.0       # pointsSpentThisHour из последнего rateLimitData
+        self.points_estimated = 0.0   # Оценка поинтов задач, завершенных после rateLimitData
+        self.reserved = 0.0           # Оценка поинтов задач, которые выполняются сейчас
+        self.reset_at: Optional[float] = None
+        self.jobs = 0
+        self.requests = 0
+
+    def update_rate_limit(self, data: Dict[str, Any]) -> None:
+        """Состояние по rateLimitData клиента (limitPerHour, pointsSpentThisHour, pointsResetIn)"""
+        if data.get("limitPerHour"):
+            self.limit_per_hour = float(data["limitPerHour"])
+        self.points_spent = float(data.get("pointsSpentThisHour") or 0)
+        self.points_estimated = 0.0
+        if data.get("pointsResetIn") is not None:
+            self.reset_at = self._clock() + float(data["pointsResetIn"])
+
+    def remaining(self) -> float:
+        """Оценка остатка поинтов за час (inf - лимит клиента еще не известен)"""
+        if self.reset_at is not None and self._clock() >= self.reset_at:
+            # Часовой счетчик WCL сбросился
+            self.points_spent = 0.0
+            self.points_estimated = 0.0
+            self.reset_at += 3600 * (math.floor((self._clock() - self.reset_at) / 3600) + 1)
+        if self.limit_per_hour is None:
+            return math.inf
+        share = (self.limit_per_hour - self.points_spent) * self.limit_share
+        return share - self.points_estimated - self.reserved
+
+    def hourly_limit(self) -> Optional[float]:
+        """Часовой лимит поинтов, доступный процессу (None - еще не известен)"""
+        if self.limit_per_hour is None:
+            return None
+        return self.limit_per_hour * self.limit_share
+
+    def seconds_to_reset(self) -> Optional[float]:
+        """Секунд до сброса часового счетчика (None - pointsResetIn еще не известен)"""
+        if self.reset_at is None:
+            return None
+        return max(0.0, self.reset_at - self._clock())
+
+
+class WclPool:
+    """
+    Клиенты WarcraftLogs прогона
+
+    refresh - корутина, перечитывающая rateLimitData клиентов пула
+    (update_rate_limit); без нее остаток поинтов только оценивается.
+    """
+
+    def __init__(
+        self,
+        credentials: List[WclCredential],
+        refresh: Optional[Callable[[], Awaitable[Any]]] = None,
+        refresh_interval: float = 300.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Awaitable[Any]] = asyncio.sleep,
+    ):
+        if not credentials:
+            raise ValueError("Пул WarcraftLogs должен содержать хотя бы одного клиента")
+        self.credentials = credentials
+        self._by_token: Dict[str, WclCredential] = {}
+        self._refresh = refresh
+        self.refresh_interval = refresh_interval
+        self._clock = clock
+        self._sleep = sleep
+        self._refresh_lock = asyncio.Lock()
+        self.refreshed_at = clock()
+        self.waits = 0
+
+    @classmethod
+    def from_clients(
+        cls,
+        clients: Iterable[Tuple[Optional[str], Optional[str]]],
+        concurrency: int,
+        limit_share: float = 1.0,
+        **kwargs: Any,
+    ) -> "WclPool":
+        """
+        Пул из пар (client_id, client_secret); повторы client_id отбрасываются
+
+        limit_share - доля часового лимита каждого клиента (WclCredential)
+        """
+        credentials: List[WclCredential] = []
+        seen = set()
+        for client_id, client_secret in clients:
+            if client_id in seen:
+                continue
+            seen.add(client_id)
+            credentials.append(WclCredential(
+                client_id, client_secret, concurrency, f"wcl#{len(credentials) + 1}",
+                clock=kwargs.get("clock", time.monotonic), limit_share=limit_share,
+            ))
+        return cls(credentials, **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.credentials)
+
+    @property
+    def primary(self) -> WclCredential:
+        return self.credentials[0]
+
+    def bind_token(self, credential: WclCredential, token: str) -> None:
+        """Запомнить токен клиента: запросы с этим токеном идут под семафором клиента"""
+        self._by_token[token] = credential
+
+    def for_token(self, token: str) -> WclCredential:
+        """Клиент токена (неизвестный токен - первый клиент пула)"""
+        return self._by_token.get(token, self.primary)
+
+    def pick(self) -> WclCredential:
+        """Клиент с наибольшим остатком поинтов (при равенстве - с меньшей текущей нагрузкой)"""
+        return max(self.credentials, key=lambda c: (c.remaining(), -c.reserved, -c.jobs))
+
+    @staticmethod
+    def _enough(credential: WclCredential, points: float) -> bool:
+        """
+        Хватает ли клиенту поинтов на задачу
+
+        Резерв выполняющихся задач не учитывается: он освободится по их
+        завершении, и ждать из-за него сброса часового счетчика незачем.
+        """
+        return credential.remaining() + credential.reserved >= points
+
+    async def refresh(self, force: bool = False) -> None:
+        """
+        Перечитать rateLimitData клиентов, если с прошлого раза прошло refresh_interval
+
+        force - без учета интервала (остатка не хватает на задачу). Одновременные
+        вызовы ждут один запрос, а не повторяют его.
+        """
+        if self._refresh is None:
+            return
+        started = self._clock()
+        async with self._refresh_lock:
+            if self.refreshed_at > started:
+                # Пока ждали блокировку, данные уже перечитал другой вызов
+                return
+            if not force and started - self.refreshed_at < self.refresh_interval:
+                return
+            try:
+                await self._refresh()
+            finally:
+                self.refreshed_at = self._clock()
+
+    async def acquire(self, points: float) -> WclCredential:
+        """
+        Клиент, у которого хватает поинтов на задачу стоимостью points
+
+        Остатка не хватает ни у одного клиента - rateLimitData перечитывается,
+        а если и по нему поинтов нет - задача ждет ближайшего сброса часового
+        счетчика. Без известного pointsResetIn выдается лучший клиент.
+        """
+        await self.refresh()
+        credential = self.pick()
+        if self._enough(credential, points):
+            return credential
+        await self.refresh(force=True)
+        while True:
+            credential = self.pick()
+            if self._enough(credential, points):
+                return credential
+            resets = [c.seconds_to_reset() for c in self.credentials if c.reset_at is not None]
+            if not resets or points > max(c.hourly_limit() or 0 for c in self.credentials):
+                # Сброс не известен или задача дороже часового лимита - ожидание не поможет
+                return credential
+            wait = min(resets)
+            self.waits += 1
+            logger.warning(
+                f"⏳ Поинты WarcraftLogs исчерпаны у всех клиентов пула "
+                f"(остаток {credential.remaining():.0f} < {points:.0f}), ждем сброса {wait:.0f} сек"
+            )
+            # Небольшой запас: счетчик на стороне WCL сбрасывается не раньше pointsResetIn
+            await self._sleep(wait + 1.0)
+            await self.refresh(force=True)
+
+    @asynccontextmanager
+    async def lease(self, points: float) -> AsyncIterator[WclCredential]:
+        """
+        Клиент для задачи с оценкой стоимости points
+
+        Оценка резервируется на время задачи, поэтому одновременно выданные
+        задачи распределяются по клиентам, а не достаются одному. Если
+        поинтов не хватает, выдача ждет сброса лимита (acquire).
+        """
+        credential = await self.acquire(points)
+        credential.reserved += points
+        credential.jobs += 1
+        try:
+            yield credential
+        finally:
+            credential.reserved -= points
+            credential.points_estimated += points
+
+    def rate_limit(self) -> Optional[Dict[str, Any]]:
+        """Суммарный rateLimitData пула (None - ни для одного клиента он не получен)"""
+        known = [c for c in self.credentials if c.limit_per_hour is not None]
+        if not known:
+            return None
+        return {
+            "limitPerHour": sum(c.limit_per_hour for c in known),
+            "pointsSpentThisHour": sum(c.points_spent for c in known),
+        }
+
+
+class RioCredential:
+    """Ключ API Raider.IO (None - анонимный доступ): семафор и интервал между запросами"""
+
+    def __init__(self, api_key: Optional[str], concurrency: int, min_interval: float, name: str):
+        self.api_key = api_key
+        self.name = name
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.min_interval = min_interval
+        self.next_at = 0.0  # Время event loop, с которого разрешен следующий запрос
+        self.requests = 0
+        self.throttled = 0
+
+    @property
+    def bucket(self) -> str:
+        """Имя лимита ключа в общем token bucket (сам ключ в Redis не пишется)"""
+        if not self.api_key:
+            return ""
+        return hashlib.sha1(self.api_key.encode()).hexdigest()[:12]
+
+    def params(self) -> Dict[str, str]:
+        return {"access_key": self.api_key} if self.api_key else {}
+
+    def reserve_slot(self, now: float) -> float:
+        """Занять следующий интервал ключа; возвращает ожидание в секундах"""
+        start = max(now, self.next_at)
+        self.next_at = start + self.min_interval
+        return start - now
+
+    def throttle(self, now: float, seconds: float = RIO_THROTTLE_BACKOFF) -> None:
+        """Ответ 429: ключ не используется seconds секунд"""
+        self.next_at = max(self.next_at, now + seconds)
+        self.throttled += 1
+
+
+class RioPool:
+    """Ключи Raider.IO прогона"""
+
+    def __init__(self, credentials: List[RioCredential]):
+        if not credentials:
+            raise ValueError("Пул Raider.IO должен содержать хотя бы один ключ")
+        self.credentials = credentials
+
+    @classmethod
+    def from_keys(cls, keys: Iterable[str], concurrency: int, min_interval: float) -> "RioPool":
+        """Пул из ключей API (без ключей - один анонимный доступ)"""
+        unique = list(dict.fromkeys(keys)) or [None]
+        return cls([
+            RioCredential(key, concurrency, min_interval, f"rio#{i + 1}" if key else "rio:anonymous")
+            for i, key in enumerate(unique)
+        ])
+
+    def __len__(self) -> int:
+        return len(self.credentials)
+
+    def pick(self) -> RioCredential:
+        """Ключ, интервал которого освобождается раньше (при равенстве - с меньшим числом запросов)"""
+        return min(self.credentials, key=lambda c: (c.next_at, c.requests))
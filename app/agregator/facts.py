@@ -0,0 +1,245 @@
+"""
+Сырые записи leaderboard прогона (таблица ranking_entries) и мета из них в SQL
+
+Каждая запись leaderboard прогона - одна строка ranking_entries: encounter,
+ключ/сложность, спек, регион, игрок, amount (DPS / HPS / очки забега),
+уровень ключа (item level для рейда) и рейтинг игрока, если он запрашивался.
+Таблица секционирована по run_id (LIST), каждый прогон - отдельная секция,
+старые секции удаляются целиком.
+
+Значения meta_by_spec (строка "all", регионы, перцентили, усеченное среднее,
+доверительный интервал) считаются одним INSERT ... SELECT внутри PostgreSQL
+по строкам прогона, поэтому новая статистика - это изменение DERIVE_META_SQL,
+а не новый сбор данных.
+"""
+
+import re
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.agregator.constant import SPEC_ROLE_METRIC
+
+PARTITION_PREFIX = "ranking_entries_"
+# Суффикс run_id точечного обновления: его секции не считаются прогонами в RANKING_FACTS_KEEP_RUNS
+PARTIAL_RUN_SUFFIX = "_partial"
+_RUN_ID = re.compile(r"^[0-9A-Za-z_]{1,32}$")
+
+Player = Tuple[str, str, str]  # (region, realm_slug, name)
+
+
+def partition_name(run_id: str) -> str:
+    """Имя секции прогона (run_id подставляется в DDL, поэтому проверяется)"""
+    if not _RUN_ID.match(run_id):
+        raise ValueError(f"Недопустимый run_id для секции ranking_entries: {run_id!r}")
+    return PARTITION_PREFIX + run_id.lower()
+
+
+def partitions_to_drop(partitions: List[str], keep: int) -> List[str]:
+    """
+    Секции, которые удаляются при хранении keep последних полных прогонов
+
+    Секции точечных обновлений (PARTIAL_RUN_SUFFIX) не вытесняют полные прогоны:
+    они удаляются вместе с полными прогонами, которые старше их.
+
+    Args:
+        partitions: Имена секций, отсортированные по времени прогона (LIST_PARTITIONS_SQL)
+    """
+    if keep <= 0:
+        return list(partitions)
+    full = [name for name in partitions if not name.endswith(PARTIAL_RUN_SUFFIX)]
+    if len(full) <= keep:
+        return []
+    oldest_kept = full[-keep]
+    return [name for name in partitions if name < oldest_kept]
+
+
+class LeaderboardFacts:
+    """Записи одного leaderboard (encounter, ключ/сложность, спек, метрика amount)"""
+
+    __slots__ = ("encounter_id", "key", "difficulty", "class_name", "spec", "spec_type", "metric",
+                 "rating_source", "_entries", "_ratings")
+
+    def __init__(self, encounter_id: int, key: str, difficulty: int, class_name: str, spec: str, metric: str):
+        self.encounter_id = encounter_id
+        self.key = key
+        self.difficulty = difficulty
+        self.class_name = class_name
+        self.spec = spec
+        self.spec_type = SPEC_ROLE_METRIC.get(spec, ("dps",))[0]
+        self.metric = metric  # "dps", "hps" или "playerscore" - что лежит в amount
+        self.rating_source: Optional[str] = None  # "raiderio" или "local"
+        self._entries: List[Tuple[Optional[str], Optional[Player], Optional[float], int]] = []
+        self._ratings: Dict[Player, float] = {}
+
+    def add(self, region: Optional[str], player: Optional[Player], amount: Optional[float], key_level: int) -> None:
+        """Запись leaderboard (player=None - скрытый, анонимный или без сервера)"""
+        self._entries.append((region, player, amount if amount and amount > 0 else None, key_level or 0))
+
+    def set_rating(self, player: Player, rating: float) -> None:
+        self._ratings[player] = rating
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._ratings.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def rows(self, run_id: str) -> Iterator[Dict[str, Any]]:
+        for region, player, amount, key_level in self._entries:
+            rating = self._ratings.get(player) if player is not None else None
+            yield {
+                "run_id": run_id,
+                "encounter_id": self.encounter_id,
+                "key": self.key,
+                "difficulty": self.difficulty,
+                "class_name": self.class_name,
+                "spec": self.spec,
+                "spec_type": self.spec_type,
+                "metric": self.metric,
+                "region": region,
+                "realm_slug": player[1] if player is not None else None,
+                "name": player[2] if player is not None else None,
+                "amount": amount,
+                "key_level": key_level,
+                "rio": rating,
+                "rio_source": self.rating_source if rating is not None else None,
+            }
+
+
+class RankingFacts:
+    """Все leaderboard одного прогона"""
+
+    def __init__(self, run_id: str):
+        partition_name(run_id)
+        self.run_id = run_id
+        self.leaderboards: List[LeaderboardFacts] = []
+
+    def leaderboard(self, encounter_id: int, key: str, difficulty: int, class_name: str, spec: str, metric: str) -> LeaderboardFacts:
+        facts = LeaderboardFacts(encounter_id, key, difficulty, class_name, spec, metric)
+        self.leaderboards.append(facts)
+        return facts
+
+    def merge(self, other: "RankingFacts") -> None:
+        """Добавить leaderboard другого шарда того же прогона"""
+        if other.run_id != self.run_id:
+            raise ValueError(f"Записи другого прогона: {other.run_id} != {self.run_id}")
+        self.leaderboards.extend(other.leaderboards)
+
+    def __len__(self) -> int:
+        return sum(len(facts) for facts in self.leaderboards)
+
+    def rows(self) -> Iterator[Dict[str, Any]]:
+        for facts in self.leaderboards:
+            yield from facts.rows(self.run_id)
+
+
+# Мета leaderboard прогона из ranking_entries:
+# - значение - рейтинг игроков, если он есть у leaderboard, иначе amount метрики
+#   leaderboard (HPS для хилов в рейде, очки забега для playerscore, DPS в рейде);
+#   у leaderboard M+ по DPS без рейтингов меты нет - DPS другая шкала, чем рейтинг;
+# - GROUPING SETS дает строку "all" и строку каждого региона одним проходом;
+# - усеченное среднее - по номерам строк в отсортированных окнах (как в robust_stats);
+# - meta и average_dps усекаются до целого, как при расчете в Python;
+# - ranking_entries пишет только полный прогон: строки timeframe="season".
+# Параметры: run_id, trim, statistic ("mean" / "trimmed_mean" / "median"), z.
+DERIVE_META_SQL = """
+WITH leaderboards AS (
+    SELECT encounter_id, key, difficulty, class_name, spec,
+           bool_or(rio IS NOT NULL) AS has_rio,
+           CASE WHEN bool_or(metric = 'hps') THEN 'hps'
+                WHEN bool_or(metric = 'playerscore') THEN 'playerscore'
+                ELSE 'dps' END AS meta_metric,
+           max(rio_source) AS rio_source
+    FROM ranking_entries
+    WHERE run_id = :run_id
+    GROUP BY encounter_id, key, difficulty, class_name, spec
+),
+entries AS (
+    SELECT e.encounter_id, e.key, e.difficulty, e.class_name, e.spec, e.spec_type, e.region,
+           e.metric, e.amount, e.key_level,
+           CASE WHEN lb.has_rio THEN e.rio
+                WHEN lb.key IN ('low', 'high') AND lb.meta_metric = 'dps' THEN NULL
+                WHEN e.metric = lb.meta_metric THEN e.amount END AS value,
+           CASE WHEN lb.has_rio THEN lb.rio_source ELSE lb.meta_metric END AS source
+    FROM ranking_entries e
+    JOIN leaderboards lb USING (encounter_id, key, difficulty, class_name, spec)
+    WHERE e.run_id = :run_id
+),
+ranked AS (
+    SELECT entries.*,
+           row_number() OVER (PARTITION BY encounter_id, key, difficulty, class_name, spec, value IS NULL
+                              ORDER BY value) AS rn_all,
+           count(value) OVER (PARTITION BY encounter_id, key, difficulty, class_name, spec) AS n_all,
+           row_number() OVER (PARTITION BY encounter_id, key, difficulty, class_name, spec, region, value IS NULL
+                              ORDER BY value) AS rn_region,
+           count(value) OVER (PARTITION BY encounter_id, key, difficulty, class_name, spec, region) AS n_region
+    FROM entries
+),
+stats AS (
+    SELECT encounter_id, key, difficulty, class_name, spec,
+           CASE WHEN GROUPING(region) = 1 THEN 'all' ELSE region END AS region,
+           min(spec_type) AS spec_type,
+           min(source) AS source,
+           count(value) AS sample_size,
+           avg(value) AS mean,
+           stddev_samp(value) AS std,
+           percentile_cont(ARRAY[0.25, 0.5, 0.75, 0.9]::float8[]) WITHIN GROUP (ORDER BY value) AS pct,
+           CASE WHEN GROUPING(region) = 1
+                THEN avg(value) FILTER (WHERE rn_all > floor(n_all * CAST(:trim AS float8)) AND rn_all <= n_all - floor(n_all * CAST(:trim AS float8)))
+                ELSE avg(value) FILTER (WHERE rn_region > floor(n_region * CAST(:trim AS float8)) AND rn_region <= n_region - floor(n_region * CAST(:trim AS float8)))
+           END AS trimmed_mean,
+           avg(amount) FILTER (WHERE metric = 'dps') AS average_dps,
+           avg(amount) FILTER (WHERE metric = 'hps') AS average_hps,
+           CASE WHEN key = 'high' THEN NULLIF(max(key_level), 0) END AS max_key_level
+    FROM ranked
+    GROUP BY GROUPING SETS (
+        (encounter_id, key, difficulty, class_name, spec),
+        (encounter_id, key, difficulty, class_name, spec, region)
+    )
+    HAVING count(value) > 0 AND (GROUPING(region) = 1 OR region IS NOT NULL)
+),
+meta AS (
+    SELECT stats.*,
+           trunc(CASE CAST(:statistic AS text)
+                     WHEN 'median' THEN coalesce(pct[2], mean)
+                     WHEN 'trimmed_mean' THEN coalesce(trimmed_mean, mean)
+                     ELSE mean END) AS meta,
+           CASE WHEN sample_size > 1 THEN CAST(:z AS float8) * std / sqrt(sample_size) END AS ci_half_width
+    FROM stats
+)
+INSERT INTO meta_by_spec (
+    class_name, spec, meta, spec_type, encounter_id, key, average_dps, max_key_level, difficulty,
+    average_hps, sample_size, ci_half_width, confidence,
+    trimmed_mean, median, p25, p75, p90, std, region, source, timeframe
+)
+SELECT class_name, spec, meta, spec_type, encounter_id, key, trunc(average_dps), max_key_level, difficulty,
+       trunc(average_hps), sample_size, ci_half_width,
+       CASE WHEN meta > 0 AND ci_half_width IS NOT NULL THEN greatest(0.0, 1.0 - ci_half_width / meta) END,
+       trimmed_mean, pct[2], pct[1], pct[3], pct[4], std, region, source, 'season'
+FROM meta
+ON CONFLICT (class_name, spec, encounter_id, key, difficulty, region, timeframe, source) DO UPDATE SET
+    meta = EXCLUDED.meta,
+    spec_type = EXCLUDED.spec_type,
+    average_dps = EXCLUDED.average_dps,
+    max_key_level = EXCLUDED.max_key_level,
+    average_hps = EXCLUDED.average_hps,
+    sample_size = EXCLUDED.sample_size,
+    ci_half_width = EXCLUDED.ci_half_width,
+    confidence = EXCLUDED.confidence,
+    trimmed_mean = EXCLUDED.trimmed_mean,
+    median = EXCLUDED.median,
+    p25 = EXCLUDED.p25,
+    p75 = EXCLUDED.p75,
+    p90 = EXCLUDED.p90,
+    std = EXCLUDED.std
+"""
+
+# Секции ranking_entries по имени (имена секций сортируются по времени прогона)
+LIST_PARTITIONS_SQL = """
+SELECT child.relname
+FROM pg_inherits
+JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+WHERE parent.relname = 'ranking_entries'
+ORDER BY child.relname
+"""
@@ -0,0 +1,72 @@
+"""
+Гистограммы throughput по уровню ключа (M+) и item level (рейд)
+
+Заполняются в том же проходе по rankings, что и среднее DPS, и сохраняются
+в таблицу meta_buckets. По ним API отдает мету для диапазона ключей/ilvl
+без дополнительных запросов к WarcraftLogs.
+
+Для M+ мета - рейтинг игроков, а не DPS, поэтому в корзинах уровня ключа
+рядом с DPS копится значение meta (рейтинг или очки забега) - add_meta.
+"""
+
+from typing import Dict, List, Any, Optional
+
+BUCKET_KEY_LEVEL = "key"
+BUCKET_ITEM_LEVEL = "ilvl"
+
+
+class BucketHistogram:
+    """Количество и сумма throughput (и значения meta) по корзинам фиксированной ширины"""
+
+    __slots__ = ("bucket_type", "width", "_buckets")
+
+    def __init__(self, bucket_type: str, width: int = 1):
+        self.bucket_type = bucket_type
+        self.width = width
+        # нижняя граница корзины -> [count, sum, meta_count, meta_sum]
+        self._buckets: Dict[int, List[float]] = {}
+
+    def _entry(self, value: float) -> List[float]:
+        bucket = int(value) // self.width * self.width
+        entry = self._buckets.get(bucket)
+        if entry is None:
+            entry = self._buckets[bucket] = [0, 0.0, 0, 0.0]
+        return entry
+
+    def add(self, value: Optional[float], amount: Optional[float]) -> None:
+        if not value or not amount or amount <= 0:
+            return
+        entry = self._entry(value)
+        entry[0] += 1
+        entry[1] += amount
+
+    def add_meta(self, value: Optional[float], meta: Optional[float]) -> None:
+        """Значение meta игрока (рейтинг, очки забега) в корзину его уровня ключа"""
+        if not value or not meta or meta <= 0:
+            return
+        entry = self._entry(value)
+        entry[2] += 1
+        entry[3] += meta
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def rows(self) -> List[Dict[str, Any]]:
+        """
+        [{bucket_type, bucket, players, average_amount, meta_players, average_meta}, ...] по возрастанию корзины
+
+        Корзины без throughput (только meta) не возвращаются; average_meta - None,
+        если в корзине нет значений meta.
+        """
+        return [
+            {
+                "bucket_type": self.bucket_type,
+                "bucket": bucket,
+                "players": int(count),
+                "average_amount": total / count,
+                "meta_players": int(meta_count),
+                "average_meta": meta_total / meta_count if meta_count else None,
+            }
+            for bucket, (count, total, meta_count, meta_total) in sorted(self._buckets.items())
+            if count
+        ]
@@ -0,0 +1,164 @@
+"""
+Leader election агрегатора через PostgreSQL advisory lock
+
+Только один экземпляр агрегатора может выполнять сбор данных одновременно:
+- lock берется на уровне сессии на отдельном соединении и держится весь прогон
+- heartbeat периодически проверяет, что соединение живо и lock все еще наш
+- второй экземпляр либо сразу завершается ("exit"), либо ждет ("wait")
+"""
+
+import asyncio
+import hashlib
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.agregator.constant import (
+    AGGREGATOR_LOCK_NAME, AGGREGATOR_LOCK_MODE, AGGREGATOR_LOCK_WAIT_TIMEOUT,
+    AGGREGATOR_LOCK_POLL_INTERVAL, AGGREGATOR_LOCK_HEARTBEAT_INTERVAL
+)
+from app.db.db import engine
+
+logger = logging.getLogger(__name__)
+
+
+def lock_key_from_name(name: str) -> int:
+    """
+    Стабильный bigint ключ для pg_advisory_lock из строкового имени
+
+    Python hash() рандомизирован между процессами, поэтому используем blake2b.
+    """
+    digest = hashlib.blake2b(name.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+class LeaderLock:
+    """Удерживаемый advisory lock с heartbeat"""
+
+    def __init__(self, conn: AsyncConnection, key: int, name: str):
+        self.conn = conn
+        self.key = key
+        self.name = name
+        self.lost = False
+        self._heartbeat_task: Optional[asyncio.Task] = None
+
+    @property
+    def is_held(self) -> bool:
+        return not self.lost
+
+    def start_heartbeat(self, interval: float) -> None:
+        self._heartbeat_task = asyncio.create_task(self._heartbeat(interval))
+
+    async def _heartbeat(self, interval: float) -> None:
+        """Периодическая проверка что соединение живо и lock принадлежит нам"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                result = await self.conn.execute(
+                    text(
+                        "SELECT count(*) FROM pg_locks "
+                        "WHERE locktype = 'advisory' AND granted "
+                        "AND pid = pg_backend_pid() AND objsubid = 1 "
+                        "AND ((classid::bigint << 32) | objid::bigint) = :key"
+                    ),
+                    {"key": self.key},
+                )
+                held = result.scalar_one() > 0
+                await self.conn.commit()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Heartbeat advisory lock '{self.name}' не прошел: {e}")
+                self.lost = True
+                return
+
+            if not held:
+                logger.error(f"❌ Advisory lock '{self.name}' потерян")
+                self.lost = True
+                return
+
+            logger.debug(f"💓 Heartbeat: advisory lock '{self.name}' удерживается")
+
+    async def stop_heartbeat(self) -> None:
+        if self._heartbeat_task is None:
+            return
+        self._heartbeat_task.cancel()
+        try:
+            await self._heartbeat_task
+        except asyncio.CancelledError:
+            pass
+        self._heartbeat_task = None
+
+
+async def _try_lock(conn: AsyncConnection, key: int) -> bool:
+    result = await conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": key})
+    acquired = bool(result.scalar_one())
+    # Session-level lock переживает commit, а соединение не висит idle in transaction
+    await conn.commit()
+    return acquired
+
+
+@asynccontextmanager
+async def aggregator_leader_lock(
+    name: str = AGGREGATOR_LOCK_NAME,
+    mode: str = AGGREGATOR_LOCK_MODE,
+    wait_timeout: float = AGGREGATOR_LOCK_WAIT_TIMEOUT,
+    poll_interval: float = AGGREGATOR_LOCK_POLL_INTERVAL,
+    heartbeat_interval: float = AGGREGATOR_LOCK_HEARTBEAT_INTERVAL,
+) -> AsyncIterator[Optional[LeaderLock]]:
+    """
+    Захват advisory lock на весь прогон агрегатора
+
+    Args:
+        name: Имя lock (из него считается bigint ключ)
+        mode: "exit" - не ждать, "wait" - ждать освобождения lock
+        wait_timeout: Максимальное время ожидания в режиме "wait" (0 = бесконечно)
+        poll_interval: Интервал повторных попыток в режиме "wait"
+        heartbeat_interval: Интервал heartbeat проверки
+
+    Yields:
+        LeaderLock если lock захвачен, иначе None
+    """
+    if mode not in ("exit", "wait"):
+        raise ValueError(f"Неизвестный режим lock: {mode} (ожидается 'exit' или 'wait')")
+
+    key = lock_key_from_name(name)
+
+    async with engine.connect() as conn:
+        acquired = await _try_lock(conn, key)
+
+        if not acquired and mode == "wait":
+            logger.info(f"⏳ Advisory lock '{name}' занят другим экземпляром, ожидаем...")
+            loop = asyncio.get_event_loop()
+            deadline = loop.time() + wait_timeout if wait_timeout > 0 else None
+            while not acquired:
+                if deadline is not None and loop.time() >= deadline:
+                    logger.warning(f"⚠️ Не дождались advisory lock '{name}' за {wait_timeout:.0f} сек")
+                    break
+                await asyncio.sleep(poll_interval)
+                acquired = await _try_lock(conn, key)
+
+        if not acquired:
+            logger.warning(f"⚠️ Агрегатор уже запущен (advisory lock '{name}' занят), выходим")
+            yield None
+            return
+
+        logger.info(f"🔒 Advisory lock '{name}' захвачен (key={key})")
+        leader = LeaderLock(conn, key, name)
+        leader.start_heartbeat(heartbeat_interval)
+
+        try:
+            yield leader
+        finally:
+            await leader.stop_heartbeat()
+            if not leader.lost:
+                try:
+                    await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
+                    await conn.commit()
+                    logger.info(f"🔓 Advisory lock '{name}' освобожден")
+                except Exception as e:
+                    # Lock все равно освободится при закрытии соединения
+                    logger.warning(f"⚠️ Ошибка освобождения advisory lock '{name}': {e}")
@@ -0,0 +1,85 @@
+"""
+Популярность талантов и предметов спека (characterRankings с includeCombatantInfo)
+
+Записи с talents/gear в разы тяжелее обычных rankings, поэтому из каждой
+записи при потоковом разборе сразу берутся только ID талантов и предметов
+(array('I')), а счетчики - это плоские буферы ID, которые в конце
+сворачиваются в частоты одним вызовом np.unique. Сохраняются только top-K.
+"""
+
+from array import array
+from typing import Any, Dict, List
+
+import numpy as np
+
+LOADOUT_TALENT = "talent"
+LOADOUT_ITEM = "item"
+LOADOUT_KINDS = (LOADOUT_TALENT, LOADOUT_ITEM)
+
+
+class LoadoutRecord:
+    """ID талантов и предметов одного игрока (каждый ID не больше одного раза)"""
+
+    __slots__ = ("talents", "items")
+
+    def __init__(self, talents: array, items: array):
+        self.talents = talents
+        self.items = items
+
+    @classmethod
+    def from_item(cls, item: Dict[str, Any]) -> "LoadoutRecord":
+        talent_ids = {
+            talent.get("talentID") for talent in item.get("talents") or []
+            if isinstance(talent, dict)
+        }
+        # id=0 - пустой слот экипировки
+        item_ids = {
+            gear.get("id") for gear in item.get("gear") or []
+            if isinstance(gear, dict)
+        }
+        return cls(
+            array("I", sorted(i for i in talent_ids if isinstance(i, int) and i > 0)),
+            array("I", sorted(i for i in item_ids if isinstance(i, int) and i > 0)),
+        )
+
+
+class LoadoutCounter:
+    """Частоты ID талантов и предметов по игрокам одного leaderboard"""
+
+    __slots__ = ("players", "_ids")
+
+    def __init__(self):
+        self.players = 0
+        self._ids = {kind: array("I") for kind in LOADOUT_KINDS}
+
+    def add(self, record: LoadoutRecord) -> None:
+        if not record.talents and not record.items:
+            return
+        self.players += 1
+        self._ids[LOADOUT_TALENT].extend(record.talents)
+        self._ids[LOADOUT_ITEM].extend(record.items)
+
+    def top(self, kind: str, k: int) -> List[Dict[str, Any]]:
+        """
+        Top-K ID по числу игроков
+
+        Returns:
+            [{kind, entity_id, players, share, rank}, ...] по убыванию players
+        """
+        ids = np.frombuffer(self._ids[kind], dtype=np.uint32) if len(self._ids[kind]) else np.empty(0, dtype=np.uint32)
+        if ids.size == 0 or self.players == 0:
+            return []
+
+        values, counts = np.unique(ids, return_counts=True)
+        # Стабильная сортировка: при равных частотах меньший ID выше
+        order = np.argsort(-counts, kind="stable")[:k]
+        return [
+            {
+                "kind": kind,
+                "entity_id": int(values[i]),
+                "players": int(counts[i]),
+                "share": float(counts[i]) / self.players,
+                "rank": rank,
+            }
+            for rank, i in enumerate(order, start=1)
+        ]
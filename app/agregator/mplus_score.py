@@ -0,0 +1,163 @@
+"""
+Локальный расчет рейтинга M+ по забегам из leaderboard WarcraftLogs
+
+Лучшие забеги игроков (уровень ключа и длительность) уже есть в leaderboard
+спеков по всем подземельям, которые скачивает агрегатор. Во время потокового
+разбора забеги складываются в компактные буферы, а после того как все
+leaderboard прогона получены, рейтинг считается сразу для всех игроков
+векторно: очки каждого забега, лучший забег игрока на подземелье
+(np.maximum.at) и сумма по подземельям.
+
+ScoreEngine.rating() имеет ту же сигнатуру, что и fetch_rio_with_retry,
+и используется вместо запросов к Raider.IO (RIO_SOURCE=local).
+
+Формула очков забега повторяет опубликованную формулу Blizzard приближенно:
+база за уровень ключа, бонус за каждый порог аффиксов и до ±15 очков за время
+относительно таймера (забег дольше таймера на 40% и больше не дает очков).
+Рейтинг игроков, которых нет в leaderboard какого-то подземелья, получается
+ниже реального - это подземелье не учитывается.
+"""
+
+import asyncio
+import logging
+from array import array
+from typing import Any, Dict, Optional, Set, Tuple
+
+import numpy as np
+
+from app.agregator.constant import MPLUS_TIMERS_MS
+
+logger = logging.getLogger(__name__)
+
+BASE_SCORE = 125.0
+SCORE_PER_LEVEL = 15.0
+AFFIX_LEVELS = (4, 7, 10, 12)
+AFFIX_BONUS = 15.0
+TIME_BONUS = 15.0
+TIME_WINDOW = 0.4  # Доля таймера, на которой бонус / штраф за время максимален
+
+PlayerKey = Tuple[str, str, str]  # (region, realm, name)
+JobKey = Tuple[int, str, str, str]  # (encounter_id, class_name, spec_name, key_type)
+
+
+def score_job_key(encounter_id: int, class_name: str, spec_name: str, key_type: str) -> JobKey:
+    """Ключ leaderboard M+ для ScoreEngine.job_done"""
+    return encounter_id, class_name, spec_name, key_type
+
+
+def run_scores(key_levels: np.ndarray, durations_ms: np.ndarray, time_limits_ms: np.ndarray) -> np.ndarray:
+    """
+    Очки забегов (векторно)
+
+    Args:
+        key_levels: Уровни ключей
+        durations_ms: Длительности забегов (мс)
+        time_limits_ms: Таймеры подземелий для каждого забега (мс)
+    """
+    levels = key_levels.astype(np.float64)
+    base = BASE_SCORE + SCORE_PER_LEVEL * levels
+    base += AFFIX_BONUS * (levels[:, None] >= np.array(AFFIX_LEVELS)).sum(axis=1)
+
+    # > 0 - быстрее таймера, < 0 - дольше; насыщение на ±TIME_WINDOW
+    remaining = 1.0 - durations_ms / time_limits_ms
+    base += TIME_BONUS * np.clip(remaining / TIME_WINDOW, -1.0, 1.0)
+
+    return np.where((remaining > -TIME_WINDOW) & (levels >= 2), base, 0.0)
+
+
+class ScoreEngine:
+    """
+    Рейтинги игроков по забегам всех leaderboard M+ прогона
+
+    expected_jobs - число leaderboard, после получения которых рейтинги
+    считаются; каждый leaderboard сообщает об этом через job_done(), даже
+    если запрос не удался. rating() ждет, пока все leaderboard получены.
+    Повторный job_done() той же задачи не учитывается: задача отмечается
+    сразу после получения leaderboard и еще раз по завершении (на случай
+    ошибки до получения).
+    """
+
+    def __init__(self, expected_jobs: int, timers_ms: Optional[Dict[int, int]] = None):
+        timers_ms = timers_ms or MPLUS_TIMERS_MS
+        self._dungeons = {encounter_id: index for index, encounter_id in enumerate(timers_ms)}
+        self._timers = np.array(list(timers_ms.values()), dtype=np.float64)
+
+        self._players: Dict[PlayerKey, int] = {}
+        self._player_idx = array("I")
+        self._dungeon_idx = array("H")
+        self._levels = array("H")
+        self._durations = array("I")
+
+        self._pending = expected_jobs
+        self._done: Set[JobKey] = set()
+        self._ready = asyncio.Event()
+        self._ratings: Optional[np.ndarray] = None
+        if self._pending <= 0:
+            self._finalize()
+
+    def add(self, player: PlayerKey, encounter_id: int, key_level: int, duration_ms: int) -> None:
+        dungeon = self._dungeons.get(encounter_id)
+        if dungeon is None or key_level <= 0 or duration_ms <= 0:
+            return
+        region, realm, name = player
+        key = (region, realm, name.lower())
+        index = self._players.get(key)
+        if index is None:
+            index = self._players[key] = len(self._players)
+        self._player_idx.append(index)
+        self._dungeon_idx.append(dungeon)
+        self._levels.append(key_level)
+        self._durations.append(duration_ms)
+
+    def job_done(self, job: JobKey) -> None:
+        if job in self._done:
+            return
+        self._done.add(job)
+        self._pending -= 1
+        if self._pending == 0:
+            self._finalize()
+
+    @property
+    def runs(self) -> int:
+        return len(self._player_idx)
+
+    def compute(self) -> np.ndarray:
+        """Рейтинги всех игроков (индекс - порядок первого появления игрока)"""
+        best = np.zeros((len(self._players), len(self._timers)))
+        if self.runs:
+            players = np.frombuffer(self._player_idx, dtype=np.uint32)
+            dungeons = np.frombuffer(self._dungeon_idx, dtype=np.uint16)
+            scores = run_scores(
+                np.frombuffer(self._levels, dtype=np.uint16),
+                np.frombuffer(self._durations, dtype=np.uint32).astype(np.float64),
+                self._timers[dungeons],
+            )
+            # Один и тот же игрок встречается в leaderboard нескольких спеков и диапазонов ключей
+            np.maximum.at(best, (players, dungeons), scores)
+        return best.sum(axis=1)
+
+    def _finalize(self) -> None:
+        self._ratings = self.compute()
+        logger.info(f"🧮 Локальный рейтинг M+: {len(self._players)} игроков по {self.runs} забегам")
+        # Буферы забегов больше не нужны
+        self._player_idx = array("I")
+        self._dungeon_idx = array("H")
+        self._levels = array("H")
+        self._durations = array("I")
+        self._ready.set()
+
+    def get(self, player: PlayerKey) -> Optional[float]:
+        """Рейтинг игрока после расчета (None - нет забегов или расчет еще не выполнен)"""
+        if self._ratings is None:
+            return None
+        region, realm, name = player
+        index = self._players.get((region, realm, name.lower()))
+        if index is None:
+            return None
+        value = float(self._ratings[index])
+        return value if value > 0 else None
+
+    async def rating(self, client: Any, region: str, realm: str, name: str) -> Optional[float]:
+        """Рейтинг игрока (сигнатура fetch_rio_with_retry; client не используется)"""
+        await self._ready.wait()
+        return self.get((region, realm, name))
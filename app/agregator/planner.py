@@ -0,0 +1,237 @@
+"""
+Dry-run планировщик прогона агрегатора (--plan)
+
+Оценивает стоимость прогона БЕЗ сетевых запросов:
+- список задач строится так же, как в test_leaderboard (build_jobs)
+- стоимость WCL запроса в поинтах берется из истории прошлых прогонов
+- количество RIO запросов - из числа игроков на leaderboard и доли попаданий в кеш
+- время - из настроенных rate limits (конкурентность WCL, интервал RIO) на каждого
+  клиента пулов WCL_CLIENTS / RIO_API_KEYS
+
+История пишется в JSON файл в конце каждого прогона (record_run_costs).
+"""
+
+import json
+import logging
+import math
+import os
+import time
+from typing import Optional, List, Dict, Any
+
+from app.agregator.constant import (
+    WCL_MAX_CONCURRENCY, RIO_MAX_CONCURRENCY, RIO_MIN_INTERVAL, RIO_SOURCE,
+    AGGREGATOR_COST_HISTORY_PATH, WCL_CLIENTS, RIO_API_KEYS
+)
+
+logger = logging.getLogger(__name__)
+
+# Значения по умолчанию, пока нет истории прогонов
+DEFAULT_WCL_POINTS_PER_REQUEST = 2.0
+DEFAULT_WCL_SECONDS_PER_REQUEST = 1.5
+DEFAULT_WCL_POINTS_PER_HOUR = 3600
+DEFAULT_RIO_PLAYERS_PER_LEADERBOARD = 60.0
+DEFAULT_RIO_CACHE_HIT_RATE = 0.3
+
+# Сколько прошлых прогонов хранить в истории
+MAX_HISTORY_RUNS = 20
+
+
+def job_kind(job: Dict[str, Any]) -> str:
+    """Тип запроса задачи: mplus_low, mplus_high, raid_group, popularity_low/high или loadout"""
+    if job.get("popularity"):
+        return f"popularity_{job['key_type']}"
+    if job.get("loadout"):
+        return "loadout"
+    if job.get("raid_group"):
+        return "raid_group"
+    return f"mplus_{job['key_type']}"
+
+
+def load_cost_history(path: str = AGGREGATOR_COST_HISTORY_PATH) -> List[Dict[str, Any]]:
+    """Загрузка истории стоимости прогонов (пустой список, если файла нет)"""
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data.get("runs", [])
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️ Не удалось прочитать историю стоимости {path}: {e}")
+        return []
+
+
+def record_run_costs(
+    jobs: List[Dict[str, Any]],
+    stats_delta: Dict[str, Any],
+    points_spent: Optional[float],
+    limit_per_hour: Optional[int],
+    wall_seconds: float,
+    path: str = AGGREGATOR_COST_HISTORY_PATH,
+) -> None:
+    """
+    Запись стоимости завершенного прогона в историю
+
+    Args:
+        jobs: Выполненные задачи
+        stats_delta: Прирост счетчиков _stats за прогон
+        points_spent: Потрачено поинтов WCL (None, если не удалось измерить)
+        limit_per_hour: Лимит поинтов WCL в час (сумма по клиентам пула)
+        wall_seconds: Фактическое время прогона
+    """
+    kinds: Dict[str, int] = {}
+    for job in jobs:
+        kind = job_kind(job)
+        kinds[kind] = kinds.get(kind, 0) + 1
+
+    run = {
+        "finished_at": time.time(),
+        "jobs": len(jobs),
+        "jobs_by_kind": kinds,
+        "wcl_requests": stats_delta.get("wcl_requests", 0),
+        "wcl_request_seconds": stats_delta.get("wcl_request_seconds", 0.0),
+        "wcl_points_spent": points_spent,
+        "wcl_limit_per_hour": limit_per_hour,
+        "mplus_leaderboards": stats_delta.get("mplus_leaderboards", 0),
+        "unique_players_for_rio": stats_delta.get("unique_players_for_rio", 0),
+        "rio_requests_sent": stats_delta.get("rio_requests_sent", 0),
+        "rio_cache_hits": stats_delta.get("rio_cache_hits", 0),
+        "wall_seconds": wall_seconds,
+    }
+
+    runs = load_cost_history(path)
+    runs.append(run)
+    runs = runs[-MAX_HISTORY_RUNS:]
+
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"runs": runs}, f, indent=2, ensure_ascii=False)
+        logger.info(f"📝 Стоимость прогона записана в {path}")
+    except OSError as e:
+        logger.warning(f"⚠️ Не удалось записать историю стоимости {path}: {e}")
+
+
+def _ratio(numerator: float, denominator: float, default: float) -> float:
+    return numerator / denominator if denominator > 0 else default
+
+
+def cost_model(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Усредненные по истории параметры стоимости (взвешенно по числу запросов)"""
+    measured = [r for r in runs if r.get("wcl_points_spent") is not None and r.get("wcl_requests")]
+    points = sum(r["wcl_points_spent"] for r in measured)
+    points_requests = sum(r["wcl_requests"] for r in measured)
+
+    wcl_requests = sum(r.get("wcl_requests", 0) for r in runs)
+    wcl_seconds = sum(r.get("wcl_request_seconds", 0.0) for r in runs)
+
+    # Прогоны с локальным рейтингом (RIO_SOURCE=local) не опрашивают Raider.IO
+    leaderboards = sum(
+        r.get("mplus_leaderboards", 0) for r in runs
+        if r.get("rio_requests_sent", 0) or r.get("rio_cache_hits", 0)
+    )
+    rio_sent = sum(r.get("rio_requests_sent", 0) for r in runs)
+    rio_hits = sum(r.get("rio_cache_hits", 0) for r in runs)
+    # Фактически опрошенные игроки (с адаптивной выборкой меньше, чем игроков на leaderboard)
+    players = rio_sent + rio_hits
+
+    limits = [r["wcl_limit_per_hour"] for r in runs if r.get("wcl_limit_per_hour")]
+
+    return {
+        "history_runs": len(runs),
+        "wcl_points_per_request": _ratio(points, points_requests, DEFAULT_WCL_POINTS_PER_REQUEST),
+        "wcl_seconds_per_request": _ratio(wcl_seconds, wcl_requests, DEFAULT_WCL_SECONDS_PER_REQUEST),
+        "wcl_points_per_hour": limits[-1] if limits else DEFAULT_WCL_POINTS_PER_HOUR * max(1, len(WCL_CLIENTS)),
+        "rio_players_per_leaderboard": _ratio(players, leaderboards, DEFAULT_RIO_PLAYERS_PER_LEADERBOARD),
+        "rio_cache_hit_rate": _ratio(rio_hits, rio_hits + rio_sent, DEFAULT_RIO_CACHE_HIT_RATE),
+    }
+
+
+def plan_run(jobs: List[Dict[str, Any]], runs: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Оценка стоимости прогона для списка задач
+
+    Args:
+        jobs: Задачи из build_jobs
+        runs: История прогонов (по умолчанию читается из файла)
+
+    Returns:
+        Словарь с количеством запросов, поинтами WCL и ожидаемым временем
+    """
+    if runs is None:
+        runs = load_cost_history()
+    model = cost_model(runs)
+
+    jobs_by_kind: Dict[str, int] = {}
+    for job in jobs:
+        kind = job_kind(job)
+        jobs_by_kind[kind] = jobs_by_kind.get(kind, 0) + 1
+
+    # Верхняя оценка: пагинация останавливается раньше, если hasMorePages=false
+    wcl_requests = sum(job.get("pages", 1) for job in jobs)
+    wcl_points = wcl_requests * model["wcl_points_per_request"]
+
+    # RIO запрашивается только для M+ leaderboard по dps (мета по playerscore обходится без него)
+    mplus_leaderboards = sum(
+        1 for job in jobs
+        if job_kind(job).startswith("mplus_") and job.get("metric", "dps") != "playerscore"
+    )
+    rio_lookups = mplus_leaderboards * model["rio_players_per_leaderboard"]
+    rio_requests = rio_lookups * (1.0 - model["rio_cache_hit_rate"]) if RIO_SOURCE != "local" else 0.0
+
+    # WCL: запросы идут параллельно в пределах семафора каждого клиента пула
+    wcl_clients = max(1, len(WCL_CLIENTS))
+    wcl_seconds = wcl_requests * model["wcl_seconds_per_request"] / max(1, WCL_MAX_CONCURRENCY * wcl_clients)
+    # Часовой лимит поинтов: если не влезаем - ждем сброса
+    wcl_hours = wcl_points / model["wcl_points_per_hour"] if model["wcl_points_per_hour"] else 0.0
+    wcl_seconds += max(0, math.ceil(wcl_hours) - 1) * 3600
+
+    # RIO: интервал между запросами ключа - узкое место, конкурентность его не обходит (ключи пула - параллельно)
+    rio_keys = max(1, len(RIO_API_KEYS))
+    rio_seconds = rio_requests * RIO_MIN_INTERVAL / rio_keys
+
+    # RIO запросы идут параллельно с WCL, поэтому время - максимум из двух потоков
+    wall_seconds = max(wcl_seconds, rio_seconds)
+
+    return {
+        "jobs": len(jobs),
+        "jobs_by_kind": jobs_by_kind,
+        "wcl_requests": wcl_requests,
+        "wcl_points": wcl_points,
+        "wcl_points_per_hour": model["wcl_points_per_hour"],
+        "rio_lookups": rio_lookups,
+        "rio_requests": rio_requests,
+        "wcl_seconds": wcl_seconds,
+        "rio_seconds": rio_seconds,
+        "wall_seconds": wall_seconds,
+        "model": model,
+        "limits": {
+            "wcl_max_concurrency": WCL_MAX_CONCURRENCY,
+            "rio_max_concurrency": RIO_MAX_CONCURRENCY,
+            "rio_min_interval": RIO_MIN_INTERVAL,
+            "wcl_clients": wcl_clients,
+            "rio_keys": rio_keys,
+        },
+    }
+
+
+def log_plan(plan: Dict[str, Any]) -> None:
+    """Вывод плана прогона в лог"""
+    model = plan["model"]
+    source = f"история {model['history_runs']} прогонов" if model["history_runs"] else "значения по умолчанию"
+
+    logger.info("=" * 80)
+    logger.info(f"ПЛАН ПРОГОНА (без сетевых запросов, {source})")
+    logger.info("=" * 80)
+    logger.info(f"Задач: {plan['jobs']} ({', '.join(f'{k}={v}' for k, v in sorted(plan['jobs_by_kind'].items()))})")
+    logger.info(
+        f"WarcraftLogs: {plan['wcl_requests']} запросов, ~{plan['wcl_points']:.0f} поинтов "
+        f"({model['wcl_points_per_request']:.2f}/запрос, лимит {plan['wcl_points_per_hour']}/час)"
+    )
+    logger.info(
+        f"Raider.IO: ~{plan['rio_lookups']:.0f} игроков, ~{plan['rio_requests']:.0f} запросов "
+        f"(кеш {model['rio_cache_hit_rate']:.0%}, {model['rio_players_per_leaderboard']:.1f} игроков/leaderboard)"
+    )
+    logger.info(
+        f"⏱️  Ожидаемое время: ~{plan['wall_seconds'] / 60:.1f} мин "
+        f"(WCL {plan['wcl_seconds'] / 60:.1f} мин, RIO {plan['rio_seconds'] / 60:.1f} мин)"
+    )
+    logger.info("=" * 80)
@@ -0,0 +1,103 @@
+"""
+Индекс игроков leaderboard (таблицы players и player_best_keys)
+
+Во время сбора каждая видимая запись M+ leaderboard сворачивается в
+PlayerEntry: последний класс/спек, лучший ключ на каждое подземелье и
+рейтинг, если он был получен для меты. После прогона индекс записывается
+в БД пачками (upsert), без дополнительных сетевых запросов.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.agregator.constant import SPEC_ROLE_METRIC
+
+PlayerKey = Tuple[str, str, str]  # (region, realm_slug, name)
+
+
+class PlayerEntry:
+    """Один игрок за прогон"""
+
+    __slots__ = ("class_name", "spec", "best_keys", "rating", "rating_source")
+
+    def __init__(self, class_name: str, spec: str):
+        self.class_name = class_name
+        self.spec = spec
+        self.best_keys: Dict[int, Tuple[int, int]] = {}  # encounter_id -> (key_level, duration_ms)
+        self.rating: Optional[float] = None
+        self.rating_source: Optional[str] = None
+
+
+def is_better_run(key_level: int, duration_ms: int, best: Optional[Tuple[int, int]]) -> bool:
+    """Выше ключ, а при равном ключе - быстрее"""
+    if best is None:
+        return True
+    best_level, best_duration = best
+    return key_level > best_level or (key_level == best_level and 0 < duration_ms < best_duration)
+
+
+class PlayerIndex:
+    """Игроки всех leaderboard прогона"""
+
+    def __init__(self):
+        self.players: Dict[PlayerKey, PlayerEntry] = {}
+
+    def add(self, player: PlayerKey, class_name: str, spec: str, encounter_id: int, key_level: int, duration_ms: int) -> None:
+        entry = self.players.get(player)
+        if entry is None:
+            entry = self.players[player] = PlayerEntry(class_name, spec)
+        else:
+            entry.class_name, entry.spec = class_name, spec
+        if key_level > 0 and is_better_run(key_level, duration_ms, entry.best_keys.get(encounter_id)):
+            entry.best_keys[encounter_id] = (key_level, duration_ms)
+
+    def merge(self, other: "PlayerIndex") -> None:
+        """Добавить индекс другого шарда прогона (лучшие ключи - по каждому подземелью)"""
+        for player, theirs in other.players.items():
+            entry = self.players.get(player)
+            if entry is None:
+                self.players[player] = theirs
+                continue
+            for encounter_id, (key_level, duration_ms) in theirs.best_keys.items():
+                if is_better_run(key_level, duration_ms, entry.best_keys.get(encounter_id)):
+                    entry.best_keys[encounter_id] = (key_level, duration_ms)
+            if theirs.rating is not None:
+                entry.rating, entry.rating_source = theirs.rating, theirs.rating_source
+
+    def set_rating(self, player: PlayerKey, rating: float, source: str) -> None:
+        entry = self.players.get(player)
+        if entry is not None:
+            entry.rating = rating
+            entry.rating_source = source
+
+    def __len__(self) -> int:
+        return len(self.players)
+
+    def rows(self, seen_at: datetime) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Строки для players и player_best_keys"""
+        players = []
+        best_keys = []
+        for (region, realm_slug, name), entry in self.players.items():
+            players.append({
+                "region": region,
+                "realm_slug": realm_slug,
+                "name": name,
+                "class_name": entry.class_name,
+                "spec": entry.spec,
+                "spec_type": SPEC_ROLE_METRIC.get(entry.spec, ("dps",))[0],
+                "max_key_level": max((level for level, _ in entry.best_keys.values()), default=None),
+                "rating": entry.rating,
+                "rating_source": entry.rating_source,
+                "last_seen": seen_at,
+            })
+            for encounter_id, (key_level, duration_ms) in entry.best_keys.items():
+                best_keys.append({
+                    "region": region,
+                    "realm_slug": realm_slug,
+                    "name": name,
+                    "encounter_id": encounter_id,
+                    "key_level": key_level,
+                    "duration_ms": duration_ms or None,
+                    "updated_at": seen_at,
+                })
+        return players, best_keys
@@ -0,0 +1,62 @@
+"""
+Популярность спеков по нефильтрованному leaderboard
+
+Один запрос characterRankings без className/specName на подземелье и bracket
+(вместо отдельного запроса на каждый из 39 спеков). Игроки считаются по
+class/spec за один проход, доля и место считаются внутри роли (tank/healer/dps).
+"""
+
+from collections import Counter
+from typing import Iterable, List, Dict, Any
+
+from app.agregator.constant import WOW_CLASS_SPECS, SPEC_ROLE_METRIC
+from app.agregator.rankings_stream import RankingRecord
+
+
+class PopularityCounter:
+    """Счетчик игроков по (class, spec) для одного leaderboard"""
+
+    def __init__(self):
+        self.counts: Counter = Counter()
+        self.unknown = 0
+
+    def add_rankings(self, rankings: Iterable[RankingRecord]) -> None:
+        for item in rankings:
+            class_name = item.class_name
+            spec_name = item.spec
+            if class_name in WOW_CLASS_SPECS and spec_name in WOW_CLASS_SPECS[class_name]:
+                self.counts[(class_name, spec_name)] += 1
+            else:
+                self.unknown += 1
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def results(self) -> List[Dict[str, Any]]:
+        """
+        Популярность всех спеков (включая спеки без игроков)
+
+        Returns:
+            [{class_name, spec, spec_type, players, share, rank}, ...]
+        """
+        by_role: Dict[str, List[Dict[str, Any]]] = {}
+        for class_name, specs in WOW_CLASS_SPECS.items():
+            for spec_name in specs:
+                spec_type = SPEC_ROLE_METRIC[spec_name][0]
+                by_role.setdefault(spec_type, []).append({
+                    "class_name": class_name,
+                    "spec": spec_name,
+                    "spec_type": spec_type,
+                    "players": self.counts.get((class_name, spec_name), 0),
+                })
+
+        results = []
+        for rows in by_role.values():
+            role_total = sum(row["players"] for row in rows)
+            rows.sort(key=lambda row: row["players"], reverse=True)
+            for rank, row in enumerate(rows, start=1):
+                row["share"] = row["players"] / role_total if role_total else 0.0
+                row["rank"] = rank
+                results.append(row)
+        return results
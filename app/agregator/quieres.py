@@ -3,6 +3,7 @@ query(
   $encounterID: Int!,
   $className: String!,
   $specName: String!,
+  $page: Int = 1,
 ) {
   worldData {
     encounter(id: $encounterID) {
@@ -12,6 +13,7 @@ query(
         specName: $specName
         metric: playerscore
         includeCombatantInfo: true,
+        page: $page
       )
     }
   }
@@ -23,6 +25,10 @@ query(
   $encounterID: Int!,
   $className: String!,
   $specName: String!,
+  $page: Int = 1,
+  $timeframe: RankingTimeframeType = Historical,
+  $partition: Int,
+  $metric: CharacterRankingMetricType = dps,
 ) {
   worldData {
     encounter(id: $encounterID) {
@@ -30,24 +36,31 @@ query(
       characterRankings(
         className: $className
         specName: $specName
-        metric: dps
+        metric: $metric
         leaderboard: LogsOnly
+        page: $page
+        timeframe: $timeframe
+        partition: $partition
         bracket: 11
       )
     }
   }
 }
 """
+# Популярность: один нефильтрованный leaderboard на подземелье и bracket.
+# playerscore вместо dps, чтобы танки и хилы не проваливались в рейтинге
 QUERY_FOR_POPULARITY_LOW_KEYS = """
 query(
   $encounterID: Int!,
+  $page: Int = 1,
 ) {
   worldData {
     encounter(id: $encounterID) {
       name
       characterRankings(
-        metric: dps
+        metric: playerscore
         bracket: 11
+        page: $page
       )
     }
   }
@@ -57,12 +70,14 @@ query(
 QUERY_FOR_POPULARITY_HIGH_KEYS = """
 query(
   $encounterID: Int!,
+  $page: Int = 1,
 ) {
   worldData {
     encounter(id: $encounterID) {
       name
       characterRankings(
-        metric: dps
+        metric: playerscore
+        page: $page
       )
     }
   }
@@ -74,6 +89,10 @@ query(
   $encounterID: Int!,
   $className: String!,
   $specName: String!,
+  $page: Int = 1,
+  $timeframe: RankingTimeframeType = Historical,
+  $partition: Int,
+  $metric: CharacterRankingMetricType = dps,
 ) {
   worldData {
     encounter(id: $encounterID) {
@@ -81,57 +100,17 @@ query(
       characterRankings(
         className: $className
         specName: $specName
-        metric: dps
+        metric: $metric
         leaderboard: LogsOnly
+        page: $page
+        timeframe: $timeframe
+        partition: $partition
       )
     }
   }
 }
 """
 
-QUERY_FOR_RAID_DPS ="""
-query(
-  $encounterID: Int!,
-  $className: String!,
-  $specName: String!,
-) {
-  worldData {
-    encounter(id: $encounterID) {
-      name
-      characterRankings(
-        className: $className
-        specName: $specName
-        metric: dps
-        leaderboard: LogsOnly
-        difficulty: 5
-      )
-    }
-  }
-}
-"""
-
-QUERY_FOR_RAID_HPS ="""
-query(
-  $encounterID: Int!,
-  $className: String!,
-  $specName: String!,
-) {
-  worldData {
-    encounter(id: $encounterID) {
-      name
-      characterRankings(
-        className: $className
-        specName: $specName
-        metric: hps
-        leaderboard: LogsOnly
-        difficulty: 5
-      )
-    }
-  }
-}
-"""
-
-
 q_balance = '''
 query {
   rateLimitData {
@@ -154,4 +133,65 @@ query(
     }
   }
 }
-"""
\ No newline at end of file
+"""
+
+def build_raid_group_query(aliases: list) -> str:
+    """
+    Один запрос на босса и группу спеков с алиасами characterRankings
+
+    Args:
+        aliases: [(alias, class_name, spec_name, difficulty, metric), ...]
+            alias - уникальное имя поля ответа (например "s0_d5_dps")
+            difficulty - 4 (heroic) или 5 (mythic)
+            metric - "dps" или "hps"
+
+    Группа - спеки одной роли разных классов, page общий для всех алиасов.
+    """
+    fields = "\n".join(
+        f"""      {alias}: characterRankings(
+        className: "{class_name}"
+        specName: "{spec_name}"
+        metric: {metric}
+        leaderboard: LogsOnly
+        difficulty: {difficulty}
+        page: $page
+      )"""
+        for alias, class_name, spec_name, difficulty, metric in aliases
+    )
+    return f"""
+query(
+  $encounterID: Int!,
+  $page: Int = 1,
+) {{
+  worldData {{
+    encounter(id: $encounterID) {{
+      name
+{fields}
+    }}
+  }}
+}}
+"""
+
+
+def build_report_fights_query(fight_ids: list) -> str:
+    """
+    Участники нескольких боев одного отчета одним запросом
+
+    playerDetails с несколькими fightIDs сливает игроков всех боев, поэтому
+    каждый бой - отдельный алиас f{fightID}.
+    """
+    fields = "\n".join(
+        f"      f{fight_id}: playerDetails(fightIDs: [{int(fight_id)}])"
+        for fight_id in fight_ids
+    )
+    return f"""
+query(
+  $code: String!,
+) {{
+  reportData {{
+    report(code: $code) {{
+{fields}
+    }}
+  }}
+}}
+"""
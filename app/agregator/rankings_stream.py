@@ -0,0 +1,161 @@
+"""
+Потоковый разбор ответа characterRankings в компактные записи
+
+Ответ WarcraftLogs содержит для каждого игрока report, guild, talents и прочие
+поля, из которых агрегатор использует только amount, bracketData, hidden,
+имя, сервер, регион, class/spec, report code / fight ID, длительность и очки
+забега. Вместо r.json() для всей страницы ответ читается по частям: элементы
+массива rankings декодируются по одному, сразу превращаются в RankingRecord,
+а исходный dict отбрасывается.
+В памяти одновременно держится только текущий элемент и хвост буфера.
+"""
+
+import json
+import re
+import sys
+from typing import Any, Callable, Dict, Iterator, Optional
+
+_RANKINGS_MARKER = re.compile(r'"rankings"\s*:\s*\[')
+_HAS_MORE_PAGES = re.compile(r'"hasMorePages"\s*:\s*(true|false)')
+_WHITESPACE_AND_COMMAS = " \t\r\n,"
+
+_decoder = json.JSONDecoder()
+
+
+def _intern(value: Any) -> Optional[str]:
+    """Повторяющиеся строки (регион, класс, спек, сервер) храним в одном экземпляре"""
+    return sys.intern(value) if isinstance(value, str) and value else None
+
+
+class RankingRecord:
+    """Одна запись characterRankings - только поля, нужные агрегатору"""
+
+    __slots__ = (
+        "amount", "bracket", "hidden", "name", "server_name", "server_region", "class_name", "spec",
+        "report_code", "fight_id", "duration", "score",
+    )
+
+    def __init__(
+        self,
+        amount: float,
+        bracket: int,
+        hidden: bool,
+        name: Optional[str],
+        server_name: Optional[str],
+        server_region: Optional[str],
+        class_name: Optional[str],
+        spec: Optional[str],
+        report_code: Optional[str] = None,
+        fight_id: Optional[int] = None,
+        duration: int = 0,
+        score: float = 0.0,
+    ):
+        self.amount = amount
+        self.bracket = bracket
+        self.hidden = hidden
+        self.name = name
+        self.server_name = server_name
+        self.server_region = server_region
+        self.class_name = class_name
+        self.spec = spec
+        self.report_code = report_code
+        self.fight_id = fight_id
+        self.duration = duration
+        self.score = score
+
+    @classmethod
+    def from_item(cls, item: Dict[str, Any]) -> "RankingRecord":
+        server = item.get("server") or {}
+        report = item.get("report") or {}
+        return cls(
+            amount=item.get("amount") or 0.0,
+            bracket=item.get("bracketData") or 0,
+            hidden=bool(item.get("hidden", False)),
+            name=item.get("name") or None,
+            server_name=_intern(server.get("name")),
+            server_region=_intern(server.get("region")),
+            class_name=_intern(item.get("class")),
+            spec=_intern(item.get("spec")),
+            report_code=report.get("code") or None,
+            fight_id=report.get("fightID") or None,
+            duration=item.get("duration") or 0,
+            score=item.get("score") or 0.0,
+        )
+
+
+class RankingsStreamDecoder:
+    """
+    Инкрементальный разбор одного ответа characterRankings
+
+    feed() принимает очередной кусок текста ответа и возвращает записи,
+    которые удалось декодировать целиком. finish() вызывается после
+    последнего куска.
+
+    Если массив rankings в ответе не найден (ошибка GraphQL, пустой encounter),
+    found=False, а весь ответ доступен через payload() для обычной обработки.
+
+    factory сворачивает декодированный элемент в запись (по умолчанию RankingRecord).
+    """
+
+    def __init__(self, factory: Optional[Callable[[Dict[str, Any]], Any]] = None):
+        self._factory = factory or RankingRecord.from_item
+        self._buffer = ""
+        self._state = "seek"  # seek -> array -> tail
+        self._head = ""  # Текст до массива rankings (page, hasMorePages, count)
+        self._tail = ""  # Текст после массива rankings
+        self.found = False
+
+    def feed(self, chunk: str) -> Iterator[Any]:
+        self._buffer += chunk
+
+        if self._state == "seek":
+            match = _RANKINGS_MARKER.search(self._buffer)
+            if match is None:
+                return
+            self.found = True
+            self._head = self._buffer[:match.start()]
+            self._buffer = self._buffer[match.end():]
+            self._state = "array"
+
+        if self._state == "array":
+            yield from self._decode_elements()
+
+        if self._state == "tail":
+            self._tail += self._buffer
+            self._buffer = ""
+
+    def _decode_elements(self) -> Iterator[Any]:
+        buffer = self._buffer
+        pos = 0
+        length = len(buffer)
+        while True:
+            while pos < length and buffer[pos] in _WHITESPACE_AND_COMMAS:
+                pos += 1
+            if pos >= length:
+                break
+            if buffer[pos] == "]":
+                pos += 1
+                self._state = "tail"
+                break
+            try:
+                item, end = _decoder.raw_decode(buffer, pos)
+            except ValueError:
+                # Элемент еще не пришел целиком - ждем следующий кусок
+                break
+            pos = end
+            if isinstance(item, dict):
+                yield self._factory(item)
+        self._buffer = buffer[pos:]
+
+    def finish(self) -> None:
+        if self._state == "array":
+            raise ValueError("Ответ characterRankings оборвался внутри массива rankings")
+
+    @property
+    def has_more_pages(self) -> bool:
+        match = _HAS_MORE_PAGES.search(self._head) or _HAS_MORE_PAGES.search(self._tail)
+        return bool(match) and match.group(1) == "true"
+
+    def payload(self) -> Any:
+        """Весь ответ как JSON (только если массив rankings не найден)"""
+        return json.loads(self._buffer) if self._buffer.strip() else None
@@ -0,0 +1,120 @@
+"""
+Каталог реалмов: имя сервера WarcraftLogs -> канонический slug Blizzard
+
+normalize_realm угадывает slug регулярными выражениями, и неверная догадка
+стоит запроса к Raider.IO, который заканчивается 400 "Could not find requested
+character". Каталог строится из Realm API Blizzard (realm index каждого
+региона, имена на всех локалях) и хранится в REALM_CATALOG_PATH:
+- точное имя сервера -> slug за O(1);
+- иначе свернутое имя (casefold, без диакритики, пробелов и знаков) -> slug,
+  так совпадают "Pozzo dell'Eternità" / "Pozzo dell Eternita" / "pozzo-delleternita";
+- реалм, которого нет в каталоге региона, - None: игрок отбрасывается до
+  запроса к Raider.IO.
+Регионы без данных в каталоге разрешаются через normalize_realm.
+"""
+
+import json
+import logging
+import os
+import re
+import unicodedata
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Все, кроме букв и цифр любой письменности (в том числе комбинируемые диакритические знаки после NFKD)
+_NOT_ALNUM = re.compile(r"[\W_]+")
+
+
+def fold_realm_name(name: str) -> str:
+    """Ключ сравнения имен реалма: 'Pozzo dell'Eternità' -> 'pozzodelleternita', 'Гордунни' -> 'гордунни'"""
+    return _NOT_ALNUM.sub("", unicodedata.normalize("NFKD", name.casefold()))
+
+
+def realm_names(realm: Dict[str, Any]) -> List[str]:
+    """Имена реалма из realm index (name - строка или словарь локаль -> имя)"""
+    name = realm.get("name")
+    if isinstance(name, dict):
+        return [value for value in name.values() if isinstance(value, str) and value]
+    return [name] if isinstance(name, str) and name else []
+
+
+class RealmCatalog:
+    """Реалмы регионов: разрешение имени сервера в slug"""
+
+    def __init__(self, regions: Dict[str, List[Dict[str, Any]]], fetched_at: Optional[str] = None):
+        """
+        Args:
+            regions: {"eu": [{"slug": "tarren-mill", "names": ["Tarren Mill", ...]}, ...], ...}
+        """
+        self.regions = regions
+        self.fetched_at = fetched_at
+        self._folded: Dict[Tuple[str, str], str] = {}
+        for region, realms in regions.items():
+            for realm in realms:
+                slug = realm["slug"]
+                for name in [slug, *realm.get("names", [])]:
+                    self._folded.setdefault((region, fold_realm_name(name)), slug)
+        # Точные имена серверов WCL, уже разрешенные (в том числе неизвестные - None)
+        self._exact: Dict[Tuple[str, str], Optional[str]] = {}
+
+    def covers(self, region: str) -> bool:
+        return bool(self.regions.get(region))
+
+    def resolve(self, region: str, server_name: str, fallback: Callable[[str], str]) -> Optional[str]:
+        """
+        Slug реалма сервера WCL
+
+        Returns:
+            slug; None - реалма нет в каталоге региона. Для региона без данных
+            каталога - fallback(server_name).
+        """
+        key = (region, server_name)
+        slug = self._exact.get(key, False)
+        if slug is False:
+            slug = self._exact[key] = self.lookup(region, server_name, fallback)
+        return slug
+
+    def lookup(self, region: str, name: str, fallback: Callable[[str], str]) -> Optional[str]:
+        """Как resolve, но без запоминания (для произвольного ввода, например из API)"""
+        if self.covers(region):
+            return self._folded.get((region, fold_realm_name(name)))
+        return fallback(name) or None
+
+    def __len__(self) -> int:
+        return sum(len(realms) for realms in self.regions.values())
+
+    def is_stale(self, max_age: timedelta) -> bool:
+        if not self.fetched_at:
+            return True
+        return datetime.fromisoformat(self.fetched_at) < datetime.now(timezone.utc) - max_age
+
+    @classmethod
+    def from_realm_index(cls, realms_by_region: Dict[str, Iterable[Dict[str, Any]]]) -> "RealmCatalog":
+        regions = {
+            region: [
+                {"slug": realm["slug"], "names": realm_names(realm)}
+                for realm in realms if realm.get("slug")
+            ]
+            for region, realms in realms_by_region.items()
+        }
+        return cls(regions, datetime.now(timezone.utc).isoformat())
+
+    @classmethod
+    def load(cls, path: str) -> Optional["RealmCatalog"]:
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return cls(data.get("regions", {}), data.get("fetched_at"))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"⚠️ Не удалось прочитать каталог реалмов {path}: {e}")
+            return None
+
+    def save(self, path: str) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"fetched_at": self.fetched_at, "regions": self.regions}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
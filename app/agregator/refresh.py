@@ -0,0 +1,128 @@
+"""
+Точечное обновление меты (одно подземелье / спек / тип ключа)
+
+Хранит прогресс фоновых задач обновления в памяти процесса:
+- CLI выводит прогресс в лог
+- API отдает прогресс по job_id
+"""
+
+import logging
+import time
+import uuid
+from typing import Optional, List, Dict, Any
+
+from app.agregator.constant import WOW_CLASS_SPECS, ENCOUNTERS, RAID
+
+logger = logging.getLogger(__name__)
+
+KEY_TYPES = ("low", "high", "raid")
+
+# Задачи обновления текущего процесса (job_id -> прогресс)
+_refresh_jobs: Dict[str, "RefreshProgress"] = {}
+_MAX_FINISHED_JOBS = 100
+
+
+def validate_refresh_filters(
+    encounter_ids: Optional[List[int]] = None,
+    class_name: Optional[str] = None,
+    spec_name: Optional[str] = None,
+    key_types: Optional[List[str]] = None,
+) -> None:
+    """
+    Проверка фильтров точечного обновления
+
+    Raises:
+        ValueError: Неизвестный encounter, класс, спек или тип ключа
+    """
+    for encounter_id in encounter_ids or []:
+        if encounter_id not in ENCOUNTERS and encounter_id not in RAID:
+            raise ValueError(f"Неизвестный encounter: {encounter_id}")
+
+    if class_name and class_name not in WOW_CLASS_SPECS:
+        raise ValueError(f"Неизвестный класс: {class_name}")
+
+    if spec_name:
+        allowed_specs = WOW_CLASS_SPECS[class_name] if class_name else [
+            spec for specs in WOW_CLASS_SPECS.values() for spec in specs
+        ]
+        if spec_name not in allowed_specs:
+            raise ValueError(f"Неизвестный спек: {spec_name}" + (f" для класса {class_name}" if class_name else ""))
+
+    for key_type in key_types or []:
+        if key_type not in KEY_TYPES:
+            raise ValueError(f"Неизвестный тип ключа: {key_type} (ожидается одно из {', '.join(KEY_TYPES)})")
+
+
+class RefreshProgress:
+    """Прогресс одной задачи точечного обновления"""
+
+    def __init__(self, filters: Dict[str, Any]):
+        self.job_id = uuid.uuid4().hex
+        self.filters = filters
+        self.status = "queued"  # queued -> running -> done / failed
+        self.total = 0
+        self.done = 0
+        self.with_data = 0
+        self.saved = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def start(self, total: int) -> None:
+        self.status = "running"
+        self.total = total
+        self.started_at = time.time()
+        logger.info(f"🎯 Refresh {self.job_id[:8]}: старт, {total} задач")
+
+    def job_done(self, has_data: bool) -> None:
+        self.done += 1
+        if has_data:
+            self.with_data += 1
+        # Логируем примерно каждые 10% и последнюю задачу
+        step = max(1, self.total // 10)
+        if self.done % step == 0 or self.done == self.total:
+            logger.info(f"🎯 Refresh {self.job_id[:8]}: {self.done}/{self.total} задач ({self.with_data} с данными)")
+
+    def finish(self, saved: int) -> None:
+        self.status = "done"
+        self.saved = saved
+        self.finished_at = time.time()
+        logger.info(f"✅ Refresh {self.job_id[:8]}: завершено, сохранено {saved} записей")
+
+    def fail(self, error: str) -> None:
+        self.status = "failed"
+        self.error = error
+        self.finished_at = time.time()
+        logger.error(f"❌ Refresh {self.job_id[:8]}: {error}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "filters": self.filters,
+            "total": self.total,
+            "done": self.done,
+            "with_data": self.with_data,
+            "saved": self.saved,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+def create_refresh_job(filters: Dict[str, Any]) -> RefreshProgress:
+    """Регистрация новой задачи обновления (старые завершенные задачи вытесняются)"""
+    finished = [job for job in _refresh_jobs.values() if job.status in ("done", "failed")]
+    if len(finished) >= _MAX_FINISHED_JOBS:
+        for job in sorted(finished, key=lambda j: j.created_at)[:len(finished) - _MAX_FINISHED_JOBS + 1]:
+            _refresh_jobs.pop(job.job_id, None)
+
+    progress = RefreshProgress(filters)
+    _refresh_jobs[progress.job_id] = progress
+    return progress
+
+
+def get_refresh_job(job_id: str) -> Optional[RefreshProgress]:
+    return _refresh_jobs.get(job_id)
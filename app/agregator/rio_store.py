@@ -0,0 +1,150 @@
+"""
+Общие для процессов кеш RIO score и ограничитель запросов к Raider.IO в Redis
+
+Без RIO_REDIS_URL у каждого процесса агрегатора свой кеш (_rio_cache) и свой
+интервал между запросами, поэтому несколько процессов вместе превышают
+лимит Raider.IO. С Redis:
+- score игрока хранится в ключе с TTL (отсутствие данных - пустая строка
+  с более коротким TTL), игроки leaderboard читаются пачками MGET в pipeline
+  до выборки и попадают в локальный кеш процесса;
+- перед каждым запросом к Raider.IO процесс резервирует токен в общем token
+  bucket (свой bucket у каждого ключа API из RIO_API_KEYS). Lua скрипт выполняется в Redis атомарно и возвращает, сколько
+  миллисекунд ждать до своего токена, поэтому процессы не опрашивают Redis
+  в цикле.
+"""
+
+import asyncio
+import logging
+from typing import Dict, Iterable, Optional
+
+import redis.asyncio as aioredis
+
+from app.agregator.constant import RIO_REDIS_URL, RIO_CACHE_TTL, RIO_CACHE_MISS_TTL, RIO_RATE_BURST
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "wow:rio:"
+BUCKET_KEY = "wow:rio-bucket"
+MGET_CHUNK = 500
+
+# Значение ключа для игрока без RIO (404, нет сезона): кешируется как None
+_MISS = ""
+
+# KEYS[1] - bucket, ARGV[1] - токенов в секунду, ARGV[2] - емкость.
+# Токен берется всегда: отрицательный остаток - очередь резервов, ответ - ожидание в мс.
+# Время - часы Redis (TIME), одинаковые для всех процессов.
+TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil or ts == nil then
+  tokens = capacity
+  ts = now
+end
+tokens = math.min(capacity, tokens + (now - ts) * rate / 1000) - 1
+local wait = 0
+if tokens < 0 then
+  wait = math.ceil(-tokens * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) * 1000 / rate) + 1000)
+return wait
+"""
+
+
+class RedisRioStore:
+    """Кеш RIO score и token bucket Raider.IO в одном Redis"""
+
+    def __init__(
+        self,
+        client: aioredis.Redis,
+        rate: float,
+        burst: int = RIO_RATE_BURST,
+        ttl: int = RIO_CACHE_TTL,
+        miss_ttl: int = RIO_CACHE_MISS_TTL,
+    ):
+        """
+        Args:
+            client: Клиент redis.asyncio (или совместимый fake в тестах)
+            rate: Запросов к Raider.IO в секунду на все процессы (0 - без ограничения)
+            burst: Емкость bucket - сколько запросов можно сделать подряд без ожидания
+        """
+        self._redis = client
+        self._rate = rate
+        self._burst = max(1, burst)
+        self._ttl = ttl
+        self._miss_ttl = miss_ttl
+        self._bucket = client.register_script(TOKEN_BUCKET_LUA)
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, Optional[float]]:
+        """
+        Score игроков из Redis (ключи как в _rio_cache)
+
+        Returns:
+            Только найденные ключи: score или None (игрок без RIO)
+        """
+        keys = list(keys)
+        if not keys:
+            return {}
+
+        pipe = self._redis.pipeline(transaction=False)
+        for i in range(0, len(keys), MGET_CHUNK):
+            pipe.mget([KEY_PREFIX + key for key in keys[i:i + MGET_CHUNK]])
+        chunks = await pipe.execute()
+
+        found: Dict[str, Optional[float]] = {}
+        values = (value for chunk in chunks for value in chunk)
+        for key, value in zip(keys, values):
+            if value is None:
+                continue
+            if isinstance(value, bytes):
+                value = value.decode()
+            found[key] = float(value) if value != _MISS else None
+        return found
+
+    async def set(self, key: str, score: Optional[float]) -> None:
+        if score is None:
+            await self._redis.set(KEY_PREFIX + key, _MISS, ex=self._miss_ttl)
+        else:
+            await self._redis.set(KEY_PREFIX + key, repr(float(score)), ex=self._ttl)
+
+    async def reserve(self, bucket: str = "") -> float:
+        """
+        Зарезервировать токен; возвращает ожидание в секундах до своего запроса
+
+        Args:
+            bucket: Лимит ключа API Raider.IO (пусто - анонимный доступ)
+        """
+        if self._rate <= 0:
+            return 0.0
+        key = f"{BUCKET_KEY}:{bucket}" if bucket else BUCKET_KEY
+        wait_ms = await self._bucket(keys=[key], args=[self._rate, self._burst])
+        return int(wait_ms) / 1000
+
+    async def acquire(self, bucket: str = "") -> None:
+        """Дождаться своего токена общего лимита Raider.IO"""
+        wait = await self.reserve(bucket)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+def create_rio_store(min_interval: float, url: str = RIO_REDIS_URL) -> Optional[RedisRioStore]:
+    """
+    Store по RIO_REDIS_URL (None - Redis не настроен, кеш и лимит в процессе)
+
+    Args:
+        min_interval: Минимальный интервал между запросами к Raider.IO на все процессы
+    """
+    if not url:
+        return None
+    rate = 1.0 / min_interval if min_interval > 0 else 0.0
+    logger.info(f"🗄️ Общий кеш и лимит RIO в Redis ({rate:.2f} запросов/сек на все процессы)")
+    return RedisRioStore(aioredis.from_url(url), rate)
+
@@ -0,0 +1,68 @@
+"""
+Устойчивые статистики значений спека (RIO / DPS / HPS) одного leaderboard
+
+Значения копятся в компактном array('d') в том же проходе, что и среднее,
+и передаются в NumPy без копирования (np.frombuffer). Все статистики
+считаются одним вызовом по одному отсортированному массиву: усеченное
+среднее, медиана, p25/p75/p90, стандартное отклонение и количество.
+"""
+
+from array import array
+from typing import Dict, Optional
+
+import numpy as np
+
+from app.agregator.constant import META_TRIM_FRACTION, META_STATISTICS
+
+# Поля MetaBySpec, которые заполняются из robust_stats
+STAT_FIELDS = ("trimmed_mean", "median", "p25", "p75", "p90", "std")
+
+_PERCENTILES = np.array([25.0, 50.0, 75.0, 90.0])
+
+
+def empty_stats() -> Dict[str, Optional[float]]:
+    return {field: None for field in STAT_FIELDS} | {"count": 0}
+
+
+def robust_stats(values: array, trim: float = META_TRIM_FRACTION) -> Dict[str, Optional[float]]:
+    """
+    Статистики по значениям leaderboard
+
+    Args:
+        values: Значения (array('d') или любой буфер float64)
+        trim: Доля значений, отбрасываемая с каждого края для усеченного среднего
+
+    Returns:
+        {"trimmed_mean", "median", "p25", "p75", "p90", "std", "count"}
+    """
+    data = np.frombuffer(values, dtype=np.float64) if len(values) else np.empty(0)
+    count = int(data.size)
+    if count == 0:
+        return empty_stats()
+
+    data = np.sort(data)
+    p25, median, p75, p90 = np.percentile(data, _PERCENTILES, method="linear")
+
+    cut = int(count * trim)
+    trimmed = data[cut:count - cut] if count - 2 * cut > 0 else data
+
+    return {
+        "trimmed_mean": float(trimmed.mean()),
+        "median": float(median),
+        "p25": float(p25),
+        "p75": float(p75),
+        "p90": float(p90),
+        "std": float(data.std(ddof=1)) if count > 1 else None,
+        "count": count,
+    }
+
+
+def meta_value(stats: Dict[str, Optional[float]], mean: float, statistic: str) -> float:
+    """Значение meta по выбранной статистике ("mean", "trimmed_mean" или "median")"""
+    # META_STATISTIC проверяется при загрузке настроек; здесь - для явно переданных значений
+    if statistic not in META_STATISTICS:
+        raise ValueError(f"Неизвестная статистика меты: {statistic} (ожидается {', '.join(META_STATISTICS)})")
+    if statistic == "mean":
+        return mean
+    value = stats.get(statistic)
+    return value if value is not None else mean
@@ -0,0 +1,169 @@
+"""
+Адаптивная выборка игроков для среднего RIO спека
+
+Вместо запроса RIO для каждого игрока leaderboard игроки опрашиваются
+в случайном порядке небольшими пачками. После каждой пачки считается
+доверительный интервал среднего, и выборка останавливается, когда его
+полуширина становится меньше заданной доли от среднего.
+"""
+
+import asyncio
+import math
+import random
+from statistics import NormalDist
+from typing import Awaitable, Callable, Iterable, Optional, Tuple, TypeVar, List, Dict, Any
+
+T = TypeVar("T")
+
+
+def z_for_confidence(confidence: float) -> float:
+    """z-значение нормального распределения для двустороннего интервала с уровнем доверия 0 < confidence < 1"""
+    if not 0 < confidence < 1:
+        raise ValueError(f"Уровень доверия должен быть в интервале (0, 1): {confidence}")
+    return NormalDist().inv_cdf((1 + confidence) / 2)
+
+
+class RunningMean:
+    """Среднее и дисперсия в один проход (алгоритм Welford)"""
+
+    __slots__ = ("count", "mean", "_m2")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    @classmethod
+    def from_sums(cls, count: int, total: float, total_sq: float) -> "RunningMean":
+        """Восстановление из достаточных статистик (количество, сумма, сумма квадратов)"""
+        acc = cls()
+        acc.count = count
+        if count:
+            acc.mean = total / count
+            acc._m2 = max(0.0, total_sq - total * total / count)
+        return acc
+
+    @property
+    def total(self) -> float:
+        return self.mean * self.count
+
+    @property
+    def total_sq(self) -> float:
+        return self._m2 + self.count * self.mean * self.mean
+
+    @property
+    def variance(self) -> float:
+        """Несмещенная выборочная дисперсия"""
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def half_width(self, z: float) -> Optional[float]:
+        """
+        Полуширина доверительного интервала среднего
+
+        Leaderboard сам по себе - выборка игроков спека, поэтому поправка
+        на конечную совокупность не применяется.
+        """
+        if self.count < 2:
+            return None
+        return z * math.sqrt(self.variance / self.count)
+
+
+def relative_confidence(value: Optional[float], half_width: Optional[float]) -> Optional[float]:
+    """
+    Уверенность в значении: 1 - полуширина интервала / значение, в пределах [0, 1]
+
+    0.98 означает интервал ±2% от значения. None - интервал не посчитан (меньше 2 значений).
+    """
+    if value is None or half_width is None or value <= 0:
+        return None
+    return max(0.0, 1.0 - half_width / value)
+
+
+def mean_with_interval(
+    values: Iterable[float],
+    confidence: float = 0.95,
+) -> Tuple[Optional[float], int, Optional[float]]:
+    """Среднее, размер выборки и полуширина доверительного интервала"""
+    acc = RunningMean()
+    for value in values:
+        acc.add(value)
+    if acc.count == 0:
+        return None, 0, None
+    return acc.mean, acc.count, acc.half_width(z_for_confidence(confidence))
+
+
+def sample_rng(run_id: Optional[str], label: str) -> Optional[random.Random]:
+    """
+    Генератор выборки одного leaderboard, засеянный run_id снимка и меткой leaderboard
+
+    Свой генератор у каждого leaderboard: выборка не зависит от порядка, в котором
+    задачи прогона (или шарды) доходят до запросов RIO, и повтор снимка выбирает
+    тех же игроков. None (прогон без снимка) - случайная выборка.
+    """
+    if run_id is None:
+        return None
+    return random.Random(f"{run_id}:{label}")
+
+
+async def sample_mean_adaptive(
+    items: List[T],
+    fetch: Callable[[T], Awaitable[Optional[float]]],
+    tolerance: float,
+    min_samples: int,
+    batch_size: int,
+    confidence: float = 0.95,
+    rng: Optional[random.Random] = None,
+) -> Dict[str, Any]:
+    """
+    Среднее значение по случайной подвыборке с ранней остановкой
+
+    Args:
+        items: Все элементы (игроки leaderboard)
+        fetch: Получение значения для элемента (None/0 - нет значения)
+        tolerance: Допустимая полуширина интервала как доля от среднего (0.02 = ±2%)
+        min_samples: Минимум значений до проверки критерия остановки
+        batch_size: Сколько элементов запрашивать параллельно за шаг
+        confidence: Уровень доверия интервала
+        rng: Генератор случайных чисел (для воспроизводимости - sample_rng, items в стабильном порядке)
+
+    Returns:
+        {"mean", "accumulator", "sample_size", "ci_half_width", "attempted", "population", "stopped_early"}
+    """
+    z = z_for_confidence(confidence)
+    order = list(items)
+    (rng or random).shuffle(order)
+    population = len(order)
+
+    acc = RunningMean()
+    attempted = 0
+    stopped_early = False
+
+    for start in range(0, population, batch_size):
+        batch = order[start:start + batch_size]
+        attempted += len(batch)
+        results = await asyncio.gather(*(fetch(item) for item in batch), return_exceptions=True)
+        for value in results:
+            if isinstance(value, (int, float)) and value > 0:
+                acc.add(float(value))
+
+        if acc.count >= min_samples and attempted < population:
+            half_width = acc.half_width(z)
+            if half_width is not None and acc.mean > 0 and half_width <= tolerance * acc.mean:
+                stopped_early = True
+                break
+
+    return {
+        "mean": acc.mean if acc.count else None,
+        "accumulator": acc,
+        "sample_size": acc.count,
+        "ci_half_width": acc.half_width(z),
+        "attempted": attempted,
+        "population": population,
+        "stopped_early": stopped_early,
+    }
@@ -0,0 +1,85 @@
+"""
+Разбиение прогона агрегатора на шарды по процессам (--workers / AGGREGATOR_WORKERS)
+
+В одном процессе разбор JSON, нормализация реалмов и расчет статистик
+конкурируют с сетевыми запросами за одно ядро. В многопроцессном режиме
+задачи делятся на N шардов, каждый шард собирается в своем процессе без
+записи в БД, а результаты возвращаются в основной процесс - единственный,
+кто пишет в БД (под advisory lock).
+
+Задачи одного спека (все подземелья и диапазоны ключей) попадают в один шард:
+на leaderboard одного спека в разных подземельях в основном одни и те же
+игроки, и их RIO запрашивается один раз, а не в каждом шарде.
+
+Лимиты внешних API делятся между шардами:
+- учетных данных не меньше, чем шардов - каждый шард получает свою часть
+  пула с полными лимитами;
+- иначе все шарды используют весь пул, а лимиты каждого ключа (конкурентность
+  WCL и RIO, интервал RIO) делятся на число шардов.
+"""
+
+from typing import Any, Dict, Hashable, List, Sequence, Tuple, TypeVar
+
+from app.agregator.planner import job_kind
+
+T = TypeVar("T")
+
+# Относительная стоимость задачи без истории: страницы leaderboard
+# (у RIO-меты M+ сверх страниц - запросы Raider.IO по игрокам)
+_MPLUS_RIO_WEIGHT = 2.0
+
+
+def job_weight(job: Dict[str, Any]) -> float:
+    """Оценка стоимости задачи для балансировки шардов"""
+    weight = float(job.get("pages", 1))
+    if job_kind(job).startswith("mplus_") and job.get("metric", "dps") != "playerscore":
+        weight *= _MPLUS_RIO_WEIGHT
+    return weight
+
+
+def shard_key(job: Dict[str, Any], index: int) -> Hashable:
+    """Группа задачи: спек (class_name, spec_name), а задача без спека - сама по себе"""
+    if job.get("class_name") and job.get("spec_name"):
+        return job["class_name"], job["spec_name"]
+    return index
+
+
+def split_jobs(jobs: Sequence[Dict[str, Any]], shards: int) -> List[List[Dict[str, Any]]]:
+    """
+    Разбиение задач на shards частей с близкой суммарной стоимостью
+
+    Задачи делятся группами shard_key (спек целиком - в одном шарде). Жадно:
+    группы по убыванию стоимости, каждая - в наименее загруженный шард.
+    Порядок задач внутри шарда сохраняется исходным.
+    """
+    groups: Dict[Hashable, List[Tuple[int, Dict[str, Any]]]] = {}
+    for index, job in enumerate(jobs):
+        groups.setdefault(shard_key(job, index), []).append((index, job))
+
+    def group_weight(items: List[Tuple[int, Dict[str, Any]]]) -> float:
+        return sum(job_weight(job) for _, job in items)
+
+    loads = [0.0] * shards
+    assigned: List[List[Tuple[int, Dict[str, Any]]]] = [[] for _ in range(shards)]
+    for items in sorted(groups.values(), key=lambda items: (-group_weight(items), items[0][0])):
+        shard = min(range(shards), key=lambda i: (loads[i], i))
+        loads[shard] += group_weight(items)
+        assigned[shard].extend(items)
+    return [[job for _, job in sorted(items, key=lambda item: item[0])] for items in assigned]
+
+
+def shard_groups(jobs: Sequence[Dict[str, Any]]) -> int:
+    """Число групп задач (шардов больше не имеет смысла)"""
+    return len({shard_key(job, index) for index, job in enumerate(jobs)})
+
+
+def split_credentials(items: Sequence[T], shard: int, shards: int) -> Tuple[List[T], int]:
+    """
+    Учетные данные шарда и во сколько раз делятся их лимиты
+
+    Returns:
+        (учетные данные шарда, делитель лимитов)
+    """
+    if len(items) >= shards:
+        return list(items[shard::shards]), 1
+    return list(items), shards
@@ -0,0 +1,360 @@
+"""
+Снимки сырых ответов WarcraftLogs / Raider.IO и повтор прогона без сети
+
+Запись (SNAPSHOT_ENABLED=true): каждый HTTP ответ прогона пишется в
+append-only хранилище snapshots/<run_id>/:
+- segment-00000.gz, segment-00001.gz, ... - тела ответов, каждый ответ -
+  отдельный gzip member (сегмент закрывается после SNAPSHOT_SEGMENT_BYTES);
+- index.jsonl - строка на ответ: ключ запроса, номер повтора, сегмент,
+  смещение, длина, статус и заголовки;
+- manifest.json - команда прогона и итоги.
+
+Тело пишется в момент чтения ответа (tee потока), поэтому потоковый разбор
+rankings не меняется. Ответ, который не дочитан до конца, не сохраняется.
+
+Повтор (--replay <run_id>): HTTP клиенты агрегатора получают транспорт,
+который отдает ответы из снимка (сегменты читаются через mmap), так что весь
+конвейер агрегации выполняется без сетевых запросов со скоростью диска.
+Ключ ответа - метод, URL и тело запроса; одинаковые запросы отдаются в
+порядке записи. Без --write повтор не пишет в БД: полученные строки
+сохраняются в snapshots/<run_id>/replay-<время>.json (write_replay_results).
+
+Формат - gzip из стандартной библиотеки (zstd потребовал бы новую зависимость).
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import mmap
+import os
+import zlib
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from app.agregator.constant import SNAPSHOT_DIR, SNAPSHOT_SEGMENT_BYTES, TOKEN_URL
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.jsonl"
+MANIFEST_FILE = "manifest.json"
+READ_CHUNK = 64 * 1024
+
+# Заголовки, которые не имеют смысла вне исходного соединения
+_SKIP_HEADERS = {"transfer-encoding", "connection", "keep-alive", "content-length"}
+
+# Ответ OAuth содержит действующий токен - в снимок он не пишется
+_REDACTED_TOKEN_BODY = b'{"access_token": "snapshot", "token_type": "Bearer", "expires_in": 82800}'
+
+
+def new_run_id() -> str:
+    """Идентификатор прогона: время UTC с миллисекундами (например 20261019T120000123Z)"""
+    now = datetime.now(timezone.utc)
+    return now.strftime("%Y%m%dT%H%M%S") + f"{now.microsecond // 1000:03d}Z"
+
+
+def request_key(request: httpx.Request) -> str:
+    """Ключ ответа: метод, URL (с параметрами, кроме ключа API Raider.IO) и тело запроса"""
+    digest = hashlib.sha1()
+    digest.update(request.method.encode())
+    digest.update(b" ")
+    # Запрос может уйти под любым ключом пула, а ответ от ключа не зависит
+    digest.update(str(request.url.copy_remove_param("access_key")).encode())
+    digest.update(b"\n")
+    digest.update(request.content)
+    return digest.hexdigest()
+
+
+class SnapshotWriter:
+    """Append-only запись ответов в сегменты и индекс"""
+
+    def __init__(self, root: str, run_id: str, command: str, segment_bytes: int = SNAPSHOT_SEGMENT_BYTES):
+        self.run_id = run_id
+        self.path = os.path.join(root, run_id)
+        os.makedirs(self.path, exist_ok=True)
+        self._segment_bytes = segment_bytes
+        self._segment = -1
+        self._file = None
+        self._offset = 0
+        self._seq: Dict[str, int] = {}
+        self._index = open(os.path.join(self.path, INDEX_FILE), "a", encoding="utf-8")
+        self.responses = 0
+        self.bytes = 0
+        self._manifest = {"run_id": run_id, "command": command, "started_at": datetime.now(timezone.utc).isoformat()}
+        self._write_manifest()
+        self._next_segment()
+
+    def _write_manifest(self) -> None:
+        with open(os.path.join(self.path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(self._manifest, f, indent=2, ensure_ascii=False)
+
+    def _next_segment(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        self._segment += 1
+        self._file = open(os.path.join(self.path, f"segment-{self._segment:05d}.gz"), "ab")
+        self._offset = self._file.tell()
+
+    def append(self, key: str, status: int, headers: List[List[str]], member: bytes) -> None:
+        """Записать один ответ (member - готовый gzip member тела)"""
+        if self._offset and self._offset + len(member) > self._segment_bytes:
+            self._next_segment()
+        self._file.write(member)
+        self._file.flush()
+
+        seq = self._seq.get(key, 0)
+        self._seq[key] = seq + 1
+        entry = {
+            "key": key,
+            "seq": seq,
+            "segment": self._segment,
+            "offset": self._offset,
+            "length": len(member),
+            "status": status,
+            "headers": headers,
+        }
+        # Строка индекса пишется после данных: оборванная запись не попадет в индекс
+        self._index.write(json.dumps(entry) + "\n")
+        self._index.flush()
+        self._offset += len(member)
+        self.responses += 1
+        self.bytes += len(member)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._index.close()
+        self._manifest.update({
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "responses": self.responses,
+            "compressed_bytes": self.bytes,
+            "segments": self._segment + 1,
+        })
+        self._write_manifest()
+        logger.info(f"📼 Снимок {self.run_id}: {self.responses} ответов, {self.bytes / 1024 / 1024:.1f} MB в {self.path}")
+
+
+class SnapshotReader:
+    """Чтение снимка: индекс в памяти, сегменты через mmap"""
+
+    def __init__(self, root: str, run_id: str):
+        self.run_id = run_id
+        self.path = os.path.join(root, run_id)
+        index_path = os.path.join(self.path, INDEX_FILE)
+        if not os.path.exists(index_path):
+            raise FileNotFoundError(f"Снимок {run_id} не найден: нет {index_path}")
+
+        self.entries: Dict[str, List[Dict[str, Any]]] = {}
+        with open(index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.entries.setdefault(entry["key"], []).append(entry)
+        for entries in self.entries.values():
+            entries.sort(key=lambda entry: entry["seq"])
+
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        self.manifest: Dict[str, Any] = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+
+        self._served: Dict[str, int] = {}
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._files = []
+
+    def next_entry(self, key: str) -> Optional[Dict[str, Any]]:
+        """Следующий по порядку ответ на запрос (последний повторяется, если запросов больше)"""
+        entries = self.entries.get(key)
+        if not entries:
+            return None
+        served = self._served.get(key, 0)
+        self._served[key] = served + 1
+        return entries[min(served, len(entries) - 1)]
+
+    def _segment(self, segment: int) -> mmap.mmap:
+        mapped = self._maps.get(segment)
+        if mapped is None:
+            f = open(os.path.join(self.path, f"segment-{segment:05d}.gz"), "rb")
+            self._files.append(f)
+            mapped = self._maps[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return mapped
+
+    def iter_body(self, entry: Dict[str, Any]):
+        """Тело ответа по частям (распаковка кусками прямо из mmap)"""
+        mapped = self._segment(entry["segment"])
+        start = entry["offset"]
+        end = start + entry["length"]
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        for position in range(start, end, READ_CHUNK):
+            data = decompressor.decompress(mapped[position:min(position + READ_CHUNK, end)])
+            if data:
+                yield data
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+    def close(self) -> None:
+        for mapped in self._maps.values():
+            mapped.close()
+        for f in self._files:
+            f.close()
+        self._maps.clear()
+        self._files.clear()
+
+
+class _TeeStream(httpx.AsyncByteStream):
+    """Поток ответа, который по мере чтения сжимает тело в gzip member для снимка"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, writer: SnapshotWriter, key: str, status: int, headers: List[List[str]]):
+        self._stream = stream
+        self._writer = writer
+        self._key = key
+        self._status = status
+        self._headers = headers
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        parts = []
+        async for chunk in self._stream:
+            parts.append(compressor.compress(chunk))
+            yield chunk
+        parts.append(compressor.flush())
+        self._writer.append(self._key, self._status, self._headers, b"".join(parts))
+
+    async def aclose(self) -> None:
+        await self._stream.aclose()
+
+
+class _ReplayStream(httpx.AsyncByteStream):
+    def __init__(self, reader: SnapshotReader, entry: Dict[str, Any]):
+        self._reader = reader
+        self._entry = entry
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        for chunk in self._reader.iter_body(self._entry):
+            yield chunk
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """Обычный HTTP транспорт, ответы которого копируются в снимок"""
+
+    def __init__(self, writer: SnapshotWriter, inner: Optional[httpx.AsyncBaseTransport] = None):
+        self._inner = inner or httpx.AsyncHTTPTransport()
+        self._writer = writer
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self._inner.handle_async_request(request)
+        key = request_key(request)
+        headers = [[name, value] for name, value in response.headers.items() if name.lower() not in _SKIP_HEADERS]
+
+        if str(request.url).startswith(TOKEN_URL):
+            # Клиенту - настоящий токен, в снимок - заглушка
+            body = await response.aread()
+            headers = [[name, value] for name, value in headers if name.lower() != "content-encoding"]
+            self._writer.append(key, response.status_code, headers, gzip.compress(_REDACTED_TOKEN_BODY))
+            return httpx.Response(
+                status_code=response.status_code,
+                headers=response.headers,
+                content=body,
+                extensions=response.extensions,
+            )
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_TeeStream(response.stream, self._writer, key, response.status_code, headers),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """Транспорт без сети: ответы из снимка"""
+
+    def __init__(self, reader: SnapshotReader):
+        self._reader = reader
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        entry = self._reader.next_entry(request_key(request))
+        if entry is None:
+            # Для агрегатора это обычная сетевая ошибка: запрос пропускается
+            raise httpx.ConnectError(f"Ответа нет в снимке {self._reader.run_id}: {request.method} {request.url}", request=request)
+        return httpx.Response(
+            status_code=entry["status"],
+            headers=entry["headers"],
+            stream=_ReplayStream(self._reader, entry),
+        )
+
+
+# Активный режим процесса: запись, повтор или ни то ни другое
+_writer: Optional[SnapshotWriter] = None
+_reader: Optional[SnapshotReader] = None
+
+
+def start_recording(command: str, root: str = SNAPSHOT_DIR) -> str:
+    global _writer
+    _writer = SnapshotWriter(root, new_run_id(), command)
+    logger.info(f"📼 Запись снимка {_writer.run_id} в {_writer.path}")
+    return _writer.run_id
+
+
+def start_replay(run_id: str, root: str = SNAPSHOT_DIR) -> SnapshotReader:
+    global _reader
+    _reader = SnapshotReader(root, run_id)
+    responses = sum(len(entries) for entries in _reader.entries.values())
+    logger.info(f"⏯️ Повтор снимка {run_id}: {responses} ответов ({_reader.manifest.get('command', '?')})")
+    return _reader
+
+
+def write_replay_results(results: Dict[str, Any]) -> Optional[str]:
+    """
+    Результаты повтора без записи в БД - в replay-<время>.json рядом со снимком
+
+    Returns:
+        Путь к файлу (None - повтор не запущен)
+    """
+    if _reader is None:
+        return None
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    path = os.path.join(_reader.path, f"replay-{stamp}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False, default=str)
+    return path
+
+
+def stop() -> None:
+    global _writer, _reader
+    if _writer is not None:
+        _writer.close()
+        _writer = None
+    if _reader is not None:
+        _reader.close()
+        _reader = None
+
+
+def is_replaying() -> bool:
+    return _reader is not None
+
+
+def current_run_id() -> Optional[str]:
+    """run_id записываемого или повторяемого снимка"""
+    if _writer is not None:
+        return _writer.run_id
+    if _reader is not None:
+        return _reader.run_id
+    return None
+
+
+def transport() -> Optional[httpx.AsyncBaseTransport]:
+    """Транспорт для нового HTTP клиента (None - обычный, без снимка)"""
+    if _reader is not None:
+        return ReplayTransport(_reader)
+    if _writer is not None:
+        return RecordingTransport(_writer)
+    return None
@@ -0,0 +1,167 @@
+"""
+Ограниченный кеш процесса: LRU вытеснение и TTL записей
+
+Заменяет словари-кеши без предела и срока (RIO score, токены OAuth,
+иконки Blizzard): если агрегатор работает как долгоживущий процесс, кеш не
+растет бесконечно и не отдает устаревшие значения.
+
+- maxsize - предел записей, при переполнении вытесняется давно не читанная;
+- ttl - срок найденного значения, negative_ttl - срок None (игрок без RIO,
+  иконка не найдена), обычно короче;
+- hits / misses / evictions / expirations - счетчики для логов прогона.
+
+get / set / contains не содержат await и в asyncio атомарны, поэтому кеш
+используется из конкурентных задач без блокировок. get_or_load объединяет
+одновременные загрузки одного ключа в одну. Результат загрузки, обернутый в
+Uncached (временная ошибка источника), отдается ожидающим, но не кешируется.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterator, Optional, Tuple
+
+# Значение "нет в кеше" (None - допустимое кешируемое значение)
+MISSING = object()
+
+
+class Uncached:
+    """Результат загрузки, который не нужно кешировать (таймаут, 429, ошибка сети)"""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any = None):
+        self.value = value
+
+
+class TTLCache:
+    """LRU кеш с TTL для найденных и отдельным TTL для None значений"""
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        negative_ttl: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if maxsize < 1:
+            raise ValueError(f"maxsize должен быть больше 0: {maxsize}")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._loading: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _live(self, key: Hashable) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return MISSING
+        value, expires_at = entry
+        if expires_at <= self._clock():
+            del self._data[key]
+            self.expirations += 1
+            return MISSING
+        return value
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """Значение ключа (default, если его нет или срок истек); чтение обновляет LRU"""
+        value = self._live(key)
+        if value is MISSING:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def contains(self, key: Hashable) -> bool:
+        """Есть ли живое значение (без счетчиков и без обновления LRU)"""
+        return self._live(key) is not MISSING
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Сохранить значение
+
+        Args:
+            ttl: Срок этой записи (по умолчанию ttl или negative_ttl для None)
+        """
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+        self._data[key] = (value, self._clock() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def setdefault(self, key: Hashable, value: Any) -> None:
+        """Сохранить значение, только если живого значения нет"""
+        if not self.contains(key):
+            self.set(key, value)
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Значение из кеша или из loader (одна загрузка на ключ для всех ожидающих)
+
+        Исключение loader не кешируется и передается всем ожидающим.
+        """
+        value = self.get(key)
+        if value is not MISSING:
+            return value
+        return await self.load(key, loader)
+
+    async def load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Загрузка ключа без чтения кеша (промах уже учтен вызывающим get)
+
+        Одновременные загрузки ключа объединяются в одну. Uncached от loader
+        возвращается ожидающим как его value, без записи в кеш.
+        """
+        pending = self._loading.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            value = await loader()
+        except BaseException as e:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим - без предупреждения "never retrieved"
+            future.exception()
+            raise
+        else:
+            if isinstance(value, Uncached):
+                value = value.value
+            else:
+                self.set(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            del self._loading[key]
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def values(self) -> Iterator[Any]:
+        """Живые значения (для статистики)"""
+        now = self._clock()
+        return (value for value, expires_at in list(self._data.values()) if expires_at > now)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -1,43 +1,61 @@
-from app.agregator.constant import TOKEN_URL, CLIENT_ID, CLIENT_SECRET, WOW_CLASS_SPECS, SPEC_ROLE_METRIC, API_URL, RIO_URL, ENCOUNTERS, RAID
+from app.agregator.constant import TOKEN_URL, CLIENT_ID, CLIENT_SECRET, WOW_CLASS_SPECS, SPEC_ROLE_METRIC, API_URL, RIO_URL, ENCOUNTERS, RAID, \
+    WCL_MAX_CONCURRENCY, RIO_MAX_CONCURRENCY, RIO_MIN_INTERVAL, \
+    WCL_PAGES_MPLUS_LOW, WCL_PAGES_MPLUS_HIGH, WCL_PAGES_RAID, WCL_PAGES_POPULARITY, \
+    RAID_DIFFICULTIES, RAID_DIFFICULTIES_ENABLED, RAID_GROUP_MAX_SPECS, ILVL_BUCKET_WIDTH, \
+    RIO_SAMPLING_ENABLED, RIO_SAMPLING_TOLERANCE, RIO_SAMPLING_MIN_SAMPLES, RIO_SAMPLING_BATCH_SIZE, META_CONFIDENCE_LEVEL, \
+    INCREMENTAL_WINDOW_DAYS, TIMEFRAME_SEASON, TIMEFRAME_RECENT, WCL_PARTITION, REGION_ALL, META_STATISTIC, \
+    LOADOUT_ENABLED, LOADOUT_TOP_K, WCL_PAGES_LOADOUT, COMPOSITION_ENABLED, COMPOSITION_MAX_REPORTS, RIO_SOURCE, MPLUS_META_SOURCE, \
+    PLAYER_INDEX_ENABLED, SNAPSHOT_ENABLED, RANKING_FACTS_ENABLED, RANKING_FACTS_KEEP_RUNS, META_TRIM_FRACTION, \
+    RIO_CACHE_MAXSIZE, RIO_CACHE_TTL, RIO_CACHE_MISS_TTL, REGIONS, REALM_CATALOG_ENABLED, REALM_CATALOG_PATH, REALM_CATALOG_MAX_AGE_DAYS, \
+    WCL_CLIENTS, RIO_API_KEYS, AGGREGATOR_WORKERS, WCL_RATE_LIMIT_REFRESH_SECONDS, RIO_REDIS_URL
 from app.agregator.quieres import q_with_gear_and_talent, q_balance, \
     QUERY_FOR_MYTHIC_PLUS_LOW_KEYS, QUERY_FOR_MYTHIC_PLUS_HIGH_KEYS, \
-    QUERY_FOR_RAID_DPS, QUERY_FOR_RAID_HPS
+    QUERY_FOR_POPULARITY_LOW_KEYS, QUERY_FOR_POPULARITY_HIGH_KEYS, build_raid_group_query, build_report_fights_query
+import argparse
+import sys
 import base64
+from array import array
+import time
 import httpx
 import json
 import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import re
 import unicodedata
+from functools import lru_cache
 import logging
-from app.models.model import MetaBySpec, Base
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from datetime import datetime, timedelta, timezone, date
+from app.models.model import MetaBySpec, SpecPopularity, MetaBucket, MetaRunningStats, LoadoutPopularity, \
+    ReportComposition, Player, PlayerBestKey, RankingEntry, Base
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import select
+from sqlalchemy import select, delete, tuple_, func, text
 from sqlalchemy.dialects.postgresql import insert
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple, AsyncIterator, Callable, Union
 from app.db.db import engine, AsyncSessionLocal
+from app.agregator.leader_lock import aggregator_leader_lock, LeaderLock
+from app.agregator.refresh import RefreshProgress, validate_refresh_filters
+from app.agregator.planner import plan_run, log_plan, record_run_costs, cost_model, load_cost_history
+from app.agregator.sampling import RunningMean, sample_mean_adaptive, sample_rng, z_for_confidence, relative_confidence
+from app.agregator.popularity import PopularityCounter
+from app.agregator.histogram import BucketHistogram, BUCKET_KEY_LEVEL, BUCKET_ITEM_LEVEL
+from app.agregator.rankings_stream import RankingsStreamDecoder
+from app.agregator.robust_stats import robust_stats, meta_value, empty_stats, STAT_FIELDS
+from app.agregator.loadout import LoadoutRecord, LoadoutCounter, LOADOUT_KINDS
+from app.agregator.composition import CompositionCollector, FightGroup, composition_from_player_details
+from app.agregator.mplus_score import ScoreEngine, score_job_key
+from app.agregator.players import PlayerIndex
+from app.agregator.facts import RankingFacts, DERIVE_META_SQL, LIST_PARTITIONS_SQL, PARTIAL_RUN_SUFFIX, \
+    partition_name, partitions_to_drop
+from app.agregator.rio_store import RedisRioStore, create_rio_store
+from app.agregator.ttl_cache import TTLCache, MISSING, Uncached
+from app.agregator.realm_catalog import RealmCatalog
+from app.agregator.credentials import WclCredential, WclPool, RioCredential, RioPool
+from app.agregator.sharding import split_jobs, split_credentials, shard_groups
+from app.agregator import blizzard_api
+from app.agregator import snapshot
 
-# Настройка логирования с ротацией файлов
-from logging.handlers import RotatingFileHandler
-
-# Создаем handler с ротацией (10 MB на файл, максимум 5 файлов)
-file_handler = RotatingFileHandler(
-    'wow_aggregator.log',
-    maxBytes=10*1024*1024,  # 10 MB
-    backupCount=5,
-    encoding='utf-8'
-)
-file_handler.setLevel(logging.INFO)
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        file_handler
-    ]
-)
 logger = logging.getLogger(__name__)
 
 # Отключаем HTTP Request логи от httpx (они логируются на INFO уровне)
@@ -45,21 +63,69 @@ logger = logging.getLogger(__name__)
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("httpcore").setLevel(logging.WARNING)
 
-# Глобальный кеш для access token
-_token_cache: Optional[Dict[str, Any]] = None
+
+def setup_logging(log_file: Optional[str] = "wow_aggregator.log") -> None:
+    """
+    Логирование процесса агрегатора: консоль и файл с ротацией (10 MB на файл, максимум 5 файлов)
+
+    Вызывается только точкой входа агрегатора - импорт модуля (API, процессы
+    шардов) настройки логирования не меняет.
+    """
+    handlers: List[logging.Handler] = [logging.StreamHandler()]
+    if log_file:
+        file_handler = RotatingFileHandler(
+            log_file,
+            maxBytes=10*1024*1024,  # 10 MB
+            backupCount=5,
+            encoding='utf-8'
+        )
+        file_handler.setLevel(logging.INFO)
+        handlers.append(file_handler)
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=handlers
+    )
+
+
+# Пулы учетных данных: у каждого клиента WarcraftLogs и ключа Raider.IO свой семафор и лимит
+# (без CLIENT_ID - клиент-заглушка, токен которого берется из снимка при повторе)
+_wcl_pool = WclPool.from_clients(
+    WCL_CLIENTS or [(CLIENT_ID, CLIENT_SECRET)], WCL_MAX_CONCURRENCY,
+    refresh=lambda: refresh_pool_rate_limits(), refresh_interval=WCL_RATE_LIMIT_REFRESH_SECONDS,
+)
+_rio_pool = RioPool.from_keys(RIO_API_KEYS, RIO_MAX_CONCURRENCY, RIO_MIN_INTERVAL)
+
+# Глобальный кеш для access token клиентов WarcraftLogs (срок записи - из ответа OAuth)
+_token_cache = TTLCache(maxsize=len(_wcl_pool), ttl=82800 - 3600)
 _token_lock = asyncio.Lock()
 
-# Семафоры для rate limiting
-_api_semaphore = asyncio.Semaphore(3)  # Макс 5 одновременных запросов к WarcraftLogs
-_rio_semaphore = asyncio.Semaphore(3)  # Макс 3 одновременных запроса к RaiderIO (строгий лимит)
+# Минимальный интервал между запросами к RaiderIO (на каждый ключ)
+_rio_min_interval = RIO_MIN_INTERVAL
+
+# Повтор снимка (--replay) пишет в БД только с --write: по умолчанию результаты - в файл рядом со снимком
+_replay_write = False
+
+# Кеш для RIO scores игроков (region-realm-name -> score; None - игрок без RIO)
+_rio_cache = TTLCache(maxsize=RIO_CACHE_MAXSIZE, ttl=RIO_CACHE_TTL, negative_ttl=RIO_CACHE_MISS_TTL)
+
+# Каталог реалмов Blizzard (None - slug угадывается normalize_realm)
+_realm_catalog: Optional[RealmCatalog] = None
+
+# Общий для процессов кеш и лимит RIO в Redis (RIO_REDIS_URL; None - только в процессе)
+_rio_store: Optional[RedisRioStore] = None
 
-# Глобальный rate limit для RaiderIO
-_rio_last_request_time = 0.0
-_rio_min_interval = 0.6 # Минимум 500мс между запросами
+# Группировка записей M+ leaderboard по report/fight для составов групп (None - не собираем)
+_composition_collector: Optional[CompositionCollector] = None
 
-# Кеш для RIO scores игроков (region-realm-name -> score)
-_rio_cache: Dict[str, Optional[float]] = {}
-_rio_cache_lock = asyncio.Lock()
+# Локальный рейтинг M+ вместо Raider.IO (RIO_SOURCE=local; None - запросы к Raider.IO)
+_score_engine: Optional[ScoreEngine] = None
+
+# Игроки M+ leaderboard прогона для таблицы players (None - не собираем)
+_player_index: Optional[PlayerIndex] = None
+
+# Сырые записи leaderboard прогона для ranking_entries (None - не собираем)
+_ranking_facts: Optional[RankingFacts] = None
 
 # Глобальная статистика сбора данных
 _stats = {
@@ -69,12 +135,16 @@ _stats = {
     "no_server_info": 0,                 # Игроки без server/region
     "invalid_region": 0,                 # Неподдерживаемый регион (CN и т.д.)
     "invalid_realm": 0,                  # Невалидный realm (пустой, слишком короткий)
+    "unknown_realm": 0,                  # Реалма нет в каталоге Blizzard (RIO не запрашивается)
     "unique_players_for_rio": 0,        # Уникальных игроков для запроса RIO
     "rio_requests_sent": 0,              # RIO запросов отправлено
     "rio_cache_hits": 0,                 # Попадания в кеш RIO
     "rio_success": 0,                    # Успешно получено RIO score
     "rio_not_found": 0,                  # Игроки не найдены в RIO (404/400)
     "rio_errors": 0,                     # Ошибки при запросе RIO (timeout, network)
+    "wcl_requests": 0,                   # Запросов leaderboard к WarcraftLogs
+    "wcl_request_seconds": 0.0,          # Суммарное время запросов к WarcraftLogs
+    "mplus_leaderboards": 0,             # M+ leaderboard, по которым собирались игроки для RIO
 }
 _stats_lock = asyncio.Lock()
 
@@ -91,6 +161,29 @@ async def init_models():
         raise
 
 
+def meta_row(obj: MetaBySpec) -> Dict[str, Any]:
+    """Строка meta_by_spec для upsert (и для результатов повтора снимка без записи в БД)"""
+    return {
+        "class_name": obj.class_name,
+        "spec": obj.spec,
+        "meta": obj.meta,
+        "spec_type": obj.spec_type,
+        "encounter_id": obj.encounter_id,
+        "key": obj.key,
+        "average_dps": obj.average_dps,
+        "max_key_level": obj.max_key_level,
+        "difficulty": obj.difficulty or 0,
+        "average_hps": obj.average_hps,
+        "sample_size": obj.sample_size,
+        "ci_half_width": obj.ci_half_width,
+        "confidence": relative_confidence(obj.meta, obj.ci_half_width),
+        "region": obj.region or REGION_ALL,
+        "source": obj.source,
+        "timeframe": obj.timeframe or TIMEFRAME_SEASON,
+        **{field: getattr(obj, field) for field in STAT_FIELDS},
+    }
+
+
 async def batch_add_meta_by_spec(objects: List[MetaBySpec]) -> List[MetaBySpec]:
     """
     Батчинг для вставки/обновления записей в БД (upsert) с использованием PostgreSQL ON CONFLICT.
@@ -105,32 +198,25 @@ async def batch_add_meta_by_spec(objects: List[MetaBySpec]) -> List[MetaBySpec]:
 
     async with AsyncSessionLocal() as session:
         try:
-            values = [
-                {
-                    "class_name": obj.class_name,
-                    "spec": obj.spec,
-                    "meta": obj.meta,
-                    "spec_type": obj.spec_type,
-                    "encounter_id": obj.encounter_id,
-                    "key": obj.key,
-                    "average_dps": obj.average_dps,
-                    "max_key_level": obj.max_key_level,
-                }
-                for obj in objects
-            ]
+            values = [meta_row(obj) for obj in objects]
 
             # PostgreSQL INSERT ... ON CONFLICT DO UPDATE
             stmt = insert(MetaBySpec).values(values)
 
-            # При конфликте по уникальному индексу (class_name, spec, encounter_id, key)
-            # обновляем все поля кроме id
+            # При конфликте по уникальному индексу uix_meta_by_spec_natural_key
+            # (class_name, spec, encounter_id, key, difficulty, region, timeframe, source) обновляем все поля кроме id
             stmt = stmt.on_conflict_do_update(
-                index_elements=['class_name', 'spec', 'encounter_id', 'key'],
+                index_elements=['class_name', 'spec', 'encounter_id', 'key', 'difficulty', 'region', 'timeframe', 'source'],
                 set_={
                     'meta': stmt.excluded.meta,
                     'spec_type': stmt.excluded.spec_type,
                     'average_dps': stmt.excluded.average_dps,
                     'max_key_level': stmt.excluded.max_key_level,
+                    'average_hps': stmt.excluded.average_hps,
+                    'sample_size': stmt.excluded.sample_size,
+                    'ci_half_width': stmt.excluded.ci_half_width,
+                    'confidence': stmt.excluded.confidence,
+                    **{field: stmt.excluded[field] for field in STAT_FIELDS},
                 }
             )
 
@@ -150,29 +236,512 @@ async def batch_add_meta_by_spec(objects: List[MetaBySpec]) -> List[MetaBySpec]:
             raise
 
 
-async def get_access_token() -> str:
-    """Получение access token с кешированием"""
-    global _token_cache
+async def batch_replace_meta_buckets(objects: List[MetaBySpec]) -> int:
+    """
+    Замена гистограмм (meta_buckets) для сохраненных объектов меты
+
+    Старые корзины спека удаляются целиком, чтобы не оставались корзины,
+    которых больше нет на leaderboard. Корзины других источников meta не
+    трогаются. Удаление и вставка - в одной транзакции.
+    """
+    rows = []
+    owners = set()
+    for obj in objects:
+        buckets = getattr(obj, "buckets", None)
+        if not buckets:
+            continue
+        owner = (obj.class_name, obj.spec, obj.encounter_id, obj.key, obj.difficulty or 0, obj.source)
+        owners.add(owner)
+        for bucket in buckets:
+            rows.append({
+                "class_name": obj.class_name,
+                "spec": obj.spec,
+                "spec_type": obj.spec_type,
+                "encounter_id": obj.encounter_id,
+                "key": obj.key,
+                "difficulty": obj.difficulty or 0,
+                "source": obj.source,
+                **bucket,
+            })
+
+    if not rows:
+        return 0
+
+    async with AsyncSessionLocal() as session:
+        try:
+            await session.execute(
+                delete(MetaBucket).where(
+                    tuple_(
+                        MetaBucket.class_name, MetaBucket.spec, MetaBucket.encounter_id,
+                        MetaBucket.key, MetaBucket.difficulty, MetaBucket.source
+                    ).in_(list(owners))
+                )
+            )
+            # Пачками, чтобы не упереться в лимит параметров запроса PostgreSQL
+            batch_size = 1000
+            for i in range(0, len(rows), batch_size):
+                await session.execute(insert(MetaBucket).values(rows[i:i + batch_size]))
+            await session.commit()
+            logger.info(f"✅ Сохранено {len(rows)} корзин гистограмм для {len(owners)} спеков")
+            return len(rows)
+
+        except SQLAlchemyError as e:
+            await session.rollback()
+            logger.error(f"❌ Ошибка базы данных при сохранении гистограмм: {e}", exc_info=True)
+            raise
+
+
+async def batch_upsert_running_stats(objects: List[MetaBySpec], day: date) -> int:
+    """
+    Upsert достаточных статистик за день (ON CONFLICT по спеку, encounter, ключу, метрике, региону и дню)
+
+    Рейтинги timeframe: Today накапливаются в течение дня, поэтому строка дня
+    перезаписывается целиком, а не суммируется - повторный прогон за тот же день
+    не учитывает одних и тех же игроков дважды.
+    """
+    rows = []
+    for obj in objects:
+        running_stats = getattr(obj, "running_stats", None)
+        if not running_stats:
+            continue
+        for (metric, region), (count, total, total_sq, samples, max_key) in running_stats.items():
+            if not count:
+                continue
+            rows.append({
+                "class_name": obj.class_name,
+                "spec": obj.spec,
+                "spec_type": obj.spec_type,
+                "encounter_id": obj.encounter_id,
+                "key": obj.key,
+                "metric": metric,
+                "region": region,
+                "day": day,
+                "count": count,
+                "total": total,
+                "total_sq": total_sq,
+                "max_key_level": max_key if obj.key == "high" else None,
+                "samples": list(samples) if samples is not None else None,
+            })
+
+    if not rows:
+        return 0
+
+    async with AsyncSessionLocal() as session:
+        try:
+            # Пачками: с региональными строками легко превысить лимит параметров запроса PostgreSQL
+            batch_size = 1000
+            for i in range(0, len(rows), batch_size):
+                stmt = insert(MetaRunningStats).values(rows[i:i + batch_size])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=['class_name', 'spec', 'encounter_id', 'key', 'metric', 'region', 'day'],
+                    set_={
+                        'spec_type': stmt.excluded.spec_type,
+                        'count': stmt.excluded.count,
+                        'total': stmt.excluded.total,
+                        'total_sq': stmt.excluded.total_sq,
+                        'max_key_level': stmt.excluded.max_key_level,
+                        'samples': stmt.excluded.samples,
+                    }
+                )
+                await session.execute(stmt)
+            await session.commit()
+            logger.info(f"✅ Сохранены статистики за {day.isoformat()}: {len(rows)} записей")
+            return len(rows)
+
+        except SQLAlchemyError as e:
+            await session.rollback()
+            logger.error(f"❌ Ошибка базы данных при сохранении статистик за день: {e}", exc_info=True)
+            raise
+
+
+# Источник меты для метрики статистик дня (рейтинг в инкрементальном сборе - всегда Raider.IO)
+RUNNING_STATS_SOURCE = {"rio": "raiderio"}
+
+
+async def load_running_meta(objects: List[MetaBySpec], since: date) -> List[MetaBySpec]:
+    """
+    Мета за окно дней из статистик дня (для спеков из objects), timeframe="recent"
+
+    Суммы count/total/total_sq по дням дают точные среднее и дисперсию всех
+    значений окна без повторного чтения рейтингов, значения дней (samples) -
+    устойчивые статистики и meta по META_STATISTIC. Строки - для всех регионов
+    вместе и для каждого региона, как в полном прогоне.
+    """
+    owners = {(obj.class_name, obj.spec, obj.encounter_id, obj.key) for obj in objects if obj.region == REGION_ALL}
+    if not owners:
+        return []
+
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(
+                MetaRunningStats.class_name,
+                MetaRunningStats.spec,
+                MetaRunningStats.encounter_id,
+                MetaRunningStats.key,
+                MetaRunningStats.region,
+                MetaRunningStats.metric,
+                MetaRunningStats.spec_type,
+                MetaRunningStats.count,
+                MetaRunningStats.total,
+                MetaRunningStats.total_sq,
+                MetaRunningStats.max_key_level,
+                MetaRunningStats.samples,
+            )
+            .where(
+                tuple_(
+                    MetaRunningStats.class_name, MetaRunningStats.spec,
+                    MetaRunningStats.encounter_id, MetaRunningStats.key
+                ).in_(list(owners)),
+                MetaRunningStats.day >= since,
+            )
+        )
+        rows = result.all()
+
+    # (class_name, spec, encounter_id, key, region) -> {metric: [count, total, total_sq, samples]}
+    grouped: Dict[Tuple[str, str, int, str, str], Dict[str, Any]] = {}
+    for class_name, spec, encounter_id, key, region, metric, spec_type, count, total, total_sq, max_key, samples in rows:
+        entry = grouped.setdefault(
+            (class_name, spec, encounter_id, key, region), {"spec_type": spec_type, "max_key": None, "metrics": {}}
+        )
+        sums = entry["metrics"].setdefault(metric, [0, 0.0, 0.0, array("d")])
+        sums[0] += count
+        sums[1] += total
+        sums[2] += total_sq
+        if samples:
+            sums[3].extend(samples)
+        if max_key is not None:
+            entry["max_key"] = max(entry["max_key"] or 0, max_key)
+
+    z = z_for_confidence(META_CONFIDENCE_LEVEL)
+    meta_objects = []
+    for (class_name, spec, encounter_id, key, region), entry in sorted(grouped.items()):
+        metrics = entry["metrics"]
+        # Как и в полном прогоне: meta - рейтинг (или очки забегов), без них меты нет
+        source_name = next((metric for metric in ("rio", "playerscore") if metric in metrics), None)
+        if source_name is None:
+            continue
+        count, total, total_sq, samples = metrics[source_name]
+        source = RunningMean.from_sums(int(count), float(total), float(total_sq))
+        if not source.count:
+            continue
+        dps = RunningMean.from_sums(*metrics["dps"][:3]) if "dps" in metrics else None
+        # Строки дней без samples (сохранены до появления колонки) в устойчивые статистики не входят
+        stats = robust_stats(samples) if len(samples) else empty_stats()
+        meta_objects.append(MetaBySpec(
+            class_name=class_name,
+            spec=spec,
+            meta=int(meta_value(stats, source.mean, META_STATISTIC)),
+            spec_type=entry["spec_type"],
+            encounter_id=encounter_id,
+            key=key,
+            difficulty=0,
+            average_dps=int(dps.mean) if dps is not None and dps.count else None,
+            max_key_level=entry["max_key"] if key == "high" else None,
+            sample_size=source.count,
+            ci_half_width=source.half_width(z),
+            region=region,
+            source=RUNNING_STATS_SOURCE.get(source_name, source_name),
+            timeframe=TIMEFRAME_RECENT,
+            **{field: stats[field] for field in STAT_FIELDS}
+        ))
+
+    logger.info(f"📈 Мета за окно с {since.isoformat()}: {len(meta_objects)} строк (timeframe={TIMEFRAME_RECENT})")
+    return meta_objects
+
+
+async def batch_add_spec_popularity(rows: List[Dict[str, Any]]) -> int:
+    """Upsert популярности спеков (ON CONFLICT по class_name, spec, encounter_id, key)"""
+    if not rows:
+        return 0
+
+    async with AsyncSessionLocal() as session:
+        try:
+            stmt = insert(SpecPopularity).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['class_name', 'spec', 'encounter_id', 'key'],
+                set_={
+                    'spec_type': stmt.excluded.spec_type,
+                    'players': stmt.excluded.players,
+                    'share': stmt.excluded.share,
+                    'rank': stmt.excluded.rank,
+                }
+            )
+            await session.execute(stmt)
+            await session.commit()
+            logger.info(f"✅ Сохранена популярность: {len(rows)} записей")
+            return len(rows)
+
+        except SQLAlchemyError as e:
+            await session.rollback()
+            logger.error(f"❌ Ошибка базы данных при сохранении популярности: {e}", exc_info=True)
+            raise
+
+
+async def batch_replace_loadout_popularity(rows: List[Dict[str, Any]]) -> int:
+    """
+    Замена top-K талантов и предметов спеков (loadout_popularity)
+
+    Набор top-K меняется между прогонами, поэтому строки спека на encounter
+    удаляются целиком и вставляются заново в одной транзакции.
+    """
+    if not rows:
+        return 0
+
+    owners = {(row["class_name"], row["spec"], row["encounter_id"]) for row in rows}
+
+    async with AsyncSessionLocal() as session:
+        try:
+            await session.execute(
+                delete(LoadoutPopularity).where(
+                    tuple_(
+                        LoadoutPopularity.class_name, LoadoutPopularity.spec, LoadoutPopularity.encounter_id
+                    ).in_(list(owners))
+                )
+            )
+            batch_size = 1000
+            for i in range(0, len(rows), batch_size):
+                await session.execute(insert(LoadoutPopularity).values(rows[i:i + batch_size]))
+            await session.commit()
+            logger.info(f"✅ Сохранена популярность талантов и предметов: {len(rows)} записей для {len(owners)} спеков")
+            return len(rows)
+
+        except SQLAlchemyError as e:
+            await session.rollback()
+            logger.error(f"❌ Ошибка базы данных при сохранении талантов и предметов: {e}", exc_info=True)
+            raise
+
+
+async def load_known_fights(keys: List[Tuple[str, int]]) -> set:
+    """Бои (report_code, fight_id), состав которых уже есть в report_compositions"""
+    known = set()
+    if not keys:
+        return known
+
+    async with AsyncSessionLocal() as session:
+        batch_size = 1000
+        for i in range(0, len(keys), batch_size):
+            result = await session.execute(
+                select(ReportComposition.report_code, ReportComposition.fight_id).where(
+                    tuple_(ReportComposition.report_code, ReportComposition.fight_id).in_(keys[i:i + batch_size])
+                )
+            )
+            known.update((code, fight_id) for code, fight_id in result.all())
+    return known
+
+
+async def batch_add_report_compositions(rows: List[Dict[str, Any]]) -> int:
+    """Вставка составов боев (ON CONFLICT DO NOTHING - состав боя не меняется)"""
+    if not rows:
+        return 0
+
+    async with AsyncSessionLocal() as session:
+        try:
+            batch_size = 1000
+            for i in range(0, len(rows), batch_size):
+                stmt = insert(ReportComposition).values(rows[i:i + batch_size])
+                stmt = stmt.on_conflict_do_nothing(index_elements=['report_code', 'fight_id'])
+                await session.execute(stmt)
+            await session.commit()
+            logger.info(f"✅ Сохранено составов групп: {len(rows)}")
+            return len(rows)
+
+        except SQLAlchemyError as e:
+            await session.rollback()
+            logger.error(f"❌ Ошибка базы данных при сохранении составов групп: {e}", exc_info=True)
+            raise
+
+
+async def batch_upsert_players(index: PlayerIndex) -> int:
+    """
+    Upsert игроков прогона в players и player_best_keys
+
+    Класс/спек и last_seen перезаписываются, лучший ключ и рейтинг не теряются:
+    max_key_level - GREATEST, рейтинг - последний полученный (COALESCE),
+    строка player_best_keys обновляется только более высоким или быстрым ключом.
+    """
+    if not len(index):
+        return 0
+
+    player_rows, best_key_rows = index.rows(datetime.now(timezone.utc))
+
+    async with AsyncSessionLocal() as session:
+        try:
+            batch_size = 1000
+            for i in range(0, len(player_rows), batch_size):
+                stmt = insert(Player).values(player_rows[i:i + batch_size])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=['region', 'realm_slug', 'name'],
+                    set_={
+                        'class_name': stmt.excluded.class_name,
+                        'spec': stmt.excluded.spec,
+                        'spec_type': stmt.excluded.spec_type,
+                        'max_key_level': func.greatest(Player.max_key_level, stmt.excluded.max_key_level),
+                        'rating': func.coalesce(stmt.excluded.rating, Player.rating),
+                        'rating_source': func.coalesce(stmt.excluded.rating_source, Player.rating_source),
+                        'last_seen': stmt.excluded.last_seen,
+                    }
+                )
+                await session.execute(stmt)
+
+            for i in range(0, len(best_key_rows), batch_size):
+                stmt = insert(PlayerBestKey).values(best_key_rows[i:i + batch_size])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=['region', 'realm_slug', 'name', 'encounter_id'],
+                    set_={
+                        'key_level': stmt.excluded.key_level,
+                        'duration_ms': stmt.excluded.duration_ms,
+                        'updated_at': stmt.excluded.updated_at,
+                    },
+                    where=(stmt.excluded.key_level > PlayerBestKey.key_level) | (
+                        (stmt.excluded.key_level == PlayerBestKey.key_level)
+                        & (stmt.excluded.duration_ms < func.coalesce(PlayerBestKey.duration_ms, stmt.excluded.duration_ms + 1))
+                    ),
+                )
+                await session.execute(stmt)
+
+            await session.commit()
+            logger.info(f"✅ Индекс игроков: {len(player_rows)} игроков, {len(best_key_rows)} лучших ключей")
+            return len(player_rows)
+
+        except SQLAlchemyError as e:
+            await session.rollback()
+            logger.error(f"❌ Ошибка базы данных при сохранении индекса игроков: {e}", exc_info=True)
+            raise
+
+
+async def batch_load_ranking_entries(facts: RankingFacts) -> int:
+    """
+    Загрузка записей прогона в его секцию ranking_entries
+
+    Секция создается при первой загрузке и очищается перед загрузкой,
+    поэтому повтор прогона (--replay) не дублирует строки.
+    """
+    partition = partition_name(facts.run_id)
+    rows = list(facts.rows())
+    if not rows:
+        return 0
+
+    logger.info(f"Загрузка {len(rows)} записей leaderboard в {partition}...")
+
+    async with AsyncSessionLocal() as session:
+        try:
+            # Имя и значение секции проверены partition_name: DDL не принимает параметры
+            await session.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {partition} PARTITION OF ranking_entries "
+                f"FOR VALUES IN ('{facts.run_id}')"
+            ))
+            await session.execute(text(f"TRUNCATE {partition}"))
+
+            chunk_size = 1000
+            for i in range(0, len(rows), chunk_size):
+                await session.execute(insert(RankingEntry), rows[i:i + chunk_size])
+
+            await session.commit()
+            logger.info(f"✅ ranking_entries: {len(rows)} записей прогона {facts.run_id}")
+            return len(rows)
+
+        except SQLAlchemyError as e:
+            await session.rollback()
+            logger.error(f"❌ Ошибка базы данных при загрузке ranking_entries: {e}", exc_info=True)
+            raise
+
+
+async def derive_meta_from_facts(run_id: str) -> int:
+    """Мета meta_by_spec (все регионы и "all") из ranking_entries прогона одним SQL запросом"""
+    async with AsyncSessionLocal() as session:
+        try:
+            result = await session.execute(text(DERIVE_META_SQL), {
+                "run_id": run_id,
+                "trim": META_TRIM_FRACTION,
+                "statistic": META_STATISTIC,
+                "z": z_for_confidence(META_CONFIDENCE_LEVEL),
+            })
+            await session.commit()
+            logger.info(f"✅ Мета из ranking_entries прогона {run_id}: {result.rowcount} записей meta_by_spec")
+            return result.rowcount
+
+        except SQLAlchemyError as e:
+            await session.rollback()
+            logger.error(f"❌ Ошибка расчета меты из ranking_entries: {e}", exc_info=True)
+            raise
+
+
+async def new_ranking_run_id(partial: bool = False) -> str:
+    """
+    run_id новой секции ranking_entries (время с миллисекундами)
+
+    Секция загружается с TRUNCATE, поэтому run_id, совпавший с существующей
+    секцией, не используется - иначе записи того прогона были бы потеряны.
+    """
+    async with AsyncSessionLocal() as session:
+        existing = set((await session.execute(text(LIST_PARTITIONS_SQL))).scalars().all())
+    while True:
+        run_id = snapshot.new_run_id() + (PARTIAL_RUN_SUFFIX if partial else "")
+        if partition_name(run_id) not in existing:
+            return run_id
+        await asyncio.sleep(0.001)
+
+
+async def prune_ranking_partitions(keep: int) -> List[str]:
+    """Удаление секций ranking_entries старше keep последних полных прогонов (partitions_to_drop)"""
+    async with AsyncSessionLocal() as session:
+        partitions = (await session.execute(text(LIST_PARTITIONS_SQL))).scalars().all()
+        dropped = partitions_to_drop(list(partitions), keep)
+        for partition in dropped:
+            await session.execute(text(f'DROP TABLE IF EXISTS "{partition}"'))
+        await session.commit()
+    if dropped:
+        logger.info(f"🗑️ Удалено {len(dropped)} старых секций ranking_entries")
+    return dropped
+
+
+def log_credential_usage() -> None:
+    """Распределение задач и запросов прогона по учетным данным пулов"""
+    for credential in _wcl_pool.credentials:
+        remaining = credential.remaining()
+        logger.info(
+            f"🔑 {credential.name}: {credential.jobs} задач, {credential.requests} запросов WCL"
+            + (f", осталось ~{remaining:.0f}/{credential.hourly_limit():.0f} поинтов" if remaining != float("inf") else "")
+        )
+    for credential in _rio_pool.credentials:
+        logger.info(f"🔑 {credential.name}: {credential.requests} запросов RIO, 429: {credential.throttled}")
+
 
+def http_client(**kwargs) -> httpx.AsyncClient:
+    """HTTP клиент агрегатора (с записью в снимок или повтором из снимка, если они включены)"""
+    return httpx.AsyncClient(transport=snapshot.transport(), **kwargs)
+
+
+async def get_access_token(credential: Optional[WclCredential] = None) -> str:
+    """
+    Получение access token с кешированием
+
+    Args:
+        credential: Клиент WarcraftLogs из пула (по умолчанию первый - CLIENT_ID)
+    """
+    credential = credential or _wcl_pool.primary
+    cache_key = (TOKEN_URL, credential.client_id)
     async with _token_lock:
         # Проверяем, есть ли действующий токен в кеше
-        if _token_cache and _token_cache.get("expires_at", 0) > asyncio.get_event_loop().time():
+        token = _token_cache.get(cache_key)
+        if token is not MISSING:
             logger.debug("Используется закешированный access token")
-            return _token_cache["token"]
+            return token
 
-        logger.info("Получение нового access token от WarcraftLogs API...")
+        logger.info(f"Получение нового access token от WarcraftLogs API ({credential.name})...")
 
-        if not CLIENT_ID or not CLIENT_SECRET:
+        # При повторе из снимка токен - заглушка из снимка
+        if (not credential.client_id or not credential.client_secret) and not snapshot.is_replaying():
             logger.error("❌ CLIENT_ID или CLIENT_SECRET не установлены в .env файле")
             raise ValueError("CLIENT_ID и CLIENT_SECRET должны быть установлены")
 
         # Получаем новый токен
         auth = base64.b64encode(
-            f"{CLIENT_ID}:{CLIENT_SECRET}".encode()
+            f"{credential.client_id}:{credential.client_secret}".encode()
         ).decode()
 
         try:
-            async with httpx.AsyncClient(timeout=30) as client:
+            async with http_client(timeout=30) as client:
                 r = await client.post(
                     TOKEN_URL,
                     headers={
@@ -186,13 +755,11 @@ async def get_access_token() -> str:
 
                 # Кешируем токен (обычно живет 24 часа, ставим 23 для безопасности)
                 expires_in = data.get("expires_in", 82800)
-                _token_cache = {
-                    "token": data["access_token"],
-                    "expires_at": asyncio.get_event_loop().time() + expires_in - 3600
-                }
+                _token_cache.set(cache_key, data["access_token"], ttl=expires_in - 3600)
+                _wcl_pool.bind_token(credential, data["access_token"])
 
                 logger.info(f"✅ Access token получен, истекает через {expires_in // 3600} часов")
-                return _token_cache["token"]
+                return data["access_token"]
 
         except httpx.HTTPStatusError as e:
             logger.error(f"❌ HTTP ошибка при получении токена: {e.response.status_code} - {e.response.text}")
@@ -205,13 +772,13 @@ async def get_access_token() -> str:
             raise
 
 
-async def balance():
-    """Проверка баланса API rate limit"""
+async def balance(credential: Optional[WclCredential] = None):
+    """Проверка баланса API rate limit (клиента credential, по умолчанию первого)"""
     logger.info("Проверка баланса WarcraftLogs API...")
 
     try:
-        token = await get_access_token()
-        async with httpx.AsyncClient(timeout=30) as client:
+        token = await get_access_token(credential)
+        async with http_client(timeout=30) as client:
             r = await client.post(
                 API_URL,
                 headers={
@@ -229,6 +796,35 @@ async def balance():
         raise
 
 
+async def get_rate_limit(credential: Optional[WclCredential] = None) -> Optional[Dict[str, Any]]:
+    """rateLimitData WarcraftLogs (None при ошибке - не должно ронять прогон)"""
+    try:
+        balance_data = await balance(credential)
+        return balance_data.get("data", {}).get("rateLimitData")
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось получить rateLimitData: {e}")
+        return None
+
+
+async def refresh_pool_rate_limits() -> Optional[Dict[str, Any]]:
+    """
+    rateLimitData каждого клиента пула WarcraftLogs
+
+    Обновляет остаток поинтов клиентов, по которому распределяются задачи.
+
+    Returns:
+        Суммарный rateLimitData пула (None - не получен хотя бы для одного клиента,
+        иначе разница замеров до и после прогона не сопоставима)
+    """
+    results = await asyncio.gather(*(get_rate_limit(credential) for credential in _wcl_pool.credentials))
+    for credential, data in zip(_wcl_pool.credentials, results):
+        if data:
+            credential.update_rate_limit(data)
+    if not all(results):
+        return None
+    return _wcl_pool.rate_limit()
+
+
 def normalize_region(region: str) -> Optional[str]:
     """
     Нормализация региона
@@ -258,6 +854,11 @@ def normalize_region(region: str) -> Optional[str]:
     return None  # Возвращаем None вместо исключения
 
 
+_REALM_INVALID_CHARS = re.compile(r"[^a-z0-9\s-]")
+_REALM_SEPARATORS = re.compile(r"[\s-]+")
+
+
+@lru_cache(maxsize=4096)
 def normalize_realm(realm: str) -> str:
     """
     Нормализация названия реалма
@@ -277,10 +878,10 @@ def normalize_realm(realm: str) -> str:
     realm = realm.encode("ascii", "ignore").decode("ascii")
 
     # Удаляем все символы кроме букв, цифр, пробелов и дефисов
-    realm = re.sub(r"[^a-z0-9\s-]", "", realm)
+    realm = _REALM_INVALID_CHARS.sub("", realm)
 
     # Заменяем множественные пробелы/дефисы на один дефис
-    realm = re.sub(r"[\s-]+", "-", realm)
+    realm = _REALM_SEPARATORS.sub("-", realm)
 
     # Убираем дефисы в начале и конце
     realm = realm.strip("-")
@@ -288,6 +889,116 @@ def normalize_realm(realm: str) -> str:
     return realm
 
 
+def resolve_realm(region: str, server_name: str) -> Optional[str]:
+    """Slug реалма сервера WCL: по каталогу Blizzard, если он загружен (None - реалма нет в каталоге)"""
+    if _realm_catalog is None:
+        return normalize_realm(server_name)
+    return _realm_catalog.resolve(region, server_name, normalize_realm)
+
+
+def realm_slug(region: str, realm: str) -> str:
+    """Slug реалма из запроса API: по каталогу реалмов, если он есть, иначе normalize_realm"""
+    global _realm_catalog
+    if _realm_catalog is None and REALM_CATALOG_ENABLED:
+        _realm_catalog = RealmCatalog.load(REALM_CATALOG_PATH)
+    slug = _realm_catalog.lookup(region, realm, normalize_realm) if _realm_catalog is not None else None
+    return slug or normalize_realm(realm)
+
+
+async def load_realm_catalog() -> Optional[RealmCatalog]:
+    """
+    Каталог реалмов из REALM_CATALOG_PATH
+
+    Отсутствующий или устаревший (старше REALM_CATALOG_MAX_AGE_DAYS) каталог
+    обновляется из Realm API Blizzard. Регион, который не удалось получить,
+    остается из предыдущего каталога. Без ключей Blizzard и при повторе из
+    снимка используется только локальный файл.
+    """
+    if not REALM_CATALOG_ENABLED:
+        return None
+    catalog = RealmCatalog.load(REALM_CATALOG_PATH)
+    if catalog is not None and not catalog.is_stale(timedelta(days=REALM_CATALOG_MAX_AGE_DAYS)):
+        return catalog
+    if snapshot.is_replaying() or not blizzard_api.has_credentials():
+        return catalog
+
+    realms = {}
+    for region in REGIONS:
+        try:
+            realms[region] = await blizzard_api.get_realm_index(region)
+        except Exception as e:
+            logger.warning(f"⚠️ Realm index {region} не получен: {e}")
+    fresh = RealmCatalog.from_realm_index(realms)
+    kept = {
+        region: catalog.regions[region]
+        for region in REGIONS
+        if not fresh.covers(region) and catalog is not None and catalog.covers(region)
+    }
+    if kept:
+        fresh = RealmCatalog({**fresh.regions, **kept}, fresh.fetched_at)
+    if not len(fresh):
+        return catalog
+
+    try:
+        fresh.save(REALM_CATALOG_PATH)
+    except OSError as e:
+        logger.warning(f"⚠️ Каталог реалмов не сохранен в {REALM_CATALOG_PATH}: {e}")
+    logger.info(f"🗺️ Каталог реалмов обновлен: {len(fresh)} реалмов ({', '.join(sorted(fresh.regions))})")
+    return fresh
+
+
+def rio_cache_key(region: str, realm: str, name: str) -> str:
+    """Ключ кеша RIO (нормализованный)"""
+    return f"{region.lower()}-{realm.lower()}-{name.lower()}"
+
+
+async def store_rio_score(cache_key: str, score: Optional[float]) -> None:
+    """Сохранить RIO score в общий кеш Redis, если он настроен (кеш процесса заполняет _rio_cache.load)"""
+    if _rio_store is not None:
+        try:
+            await _rio_store.set(cache_key, score)
+        except Exception as e:
+            logger.debug(f"Ошибка записи RIO в Redis для {cache_key}: {e}")
+
+
+async def prefetch_rio_scores(players: List[Tuple[str, str, str]]) -> int:
+    """
+    Загрузка RIO игроков leaderboard из общего кеша Redis в кеш процесса
+
+    Один pipeline MGET на leaderboard до выборки: игроки, уже запрошенные
+    другим процессом, становятся попаданиями в кеш без запроса к Raider.IO.
+    """
+    if _rio_store is None:
+        return 0
+    keys = [key for key in (rio_cache_key(*player) for player in players) if not _rio_cache.contains(key)]
+    try:
+        found = await _rio_store.get_many(keys)
+    except Exception as e:
+        logger.warning(f"⚠️ Общий кеш RIO в Redis недоступен: {e}")
+        return 0
+    for key, score in found.items():
+        _rio_cache.setdefault(key, score)
+    if found:
+        logger.debug(f"🗄️ Из Redis получено {len(found)}/{len(keys)} RIO score")
+    return len(found)
+
+
+async def wait_rio_interval(credential: RioCredential) -> None:
+    """Интервал перед запросом к Raider.IO под ключом credential: token bucket ключа в Redis или интервал процесса"""
+    if _rio_store is not None:
+        try:
+            await _rio_store.acquire(credential.bucket)
+            return
+        except Exception as e:
+            logger.warning(f"⚠️ Лимит RIO в Redis недоступен, используется интервал процесса: {e}")
+
+    # Rate limiting ключа - минимум _rio_min_interval между его запросами (интервал занимается сразу,
+    # поэтому одновременные запросы ждут каждый своего)
+    wait = credential.reserve_slot(asyncio.get_event_loop().time())
+    if wait > 0:
+        await asyncio.sleep(wait)
+
+
 async def fetch_rio_with_retry(
     client: httpx.AsyncClient,
     region: str,
@@ -295,8 +1006,6 @@ async def fetch_rio_with_retry(
     name: str
 ) -> Optional[float]:
     """Получение RIO score с кешированием и строгим rate limiting (без retry)"""
-    global _rio_last_request_time, _rio_cache, _stats
-
     # Валидация входных данных перед запросом
     if not region or not realm or not name:
         async with _stats_lock:
@@ -319,34 +1028,51 @@ async def fetch_rio_with_retry(
         return None
 
     # Создаем ключ для кеша (нормализованный)
-    cache_key = f"{region.lower()}-{realm.lower()}-{name.lower()}"
+    cache_key = rio_cache_key(region, realm, name)
 
     # Проверяем кеш
-    async with _rio_cache_lock:
-        if cache_key in _rio_cache:
-            cached_score = _rio_cache[cache_key]
-            async with _stats_lock:
-                _stats["rio_cache_hits"] += 1
-            logger.debug(f"💾 Cache hit для {name}: {cached_score}")
-            return cached_score
+    cached_score = _rio_cache.get(cache_key)
+    if cached_score is not MISSING:
+        async with _stats_lock:
+            _stats["rio_cache_hits"] += 1
+        logger.debug(f"💾 Cache hit для {name}: {cached_score}")
+        return cached_score
+
+    # Одновременные запросы одного игрока (он есть в нескольких leaderboard) - один запрос к Raider.IO
+    return await _rio_cache.load(cache_key, lambda: request_rio_score(client, region, realm, name, cache_key))
+
 
+async def request_rio_score(
+    client: httpx.AsyncClient,
+    region: str,
+    realm: str,
+    name: str,
+    cache_key: str
+) -> Union[Optional[float], Uncached]:
+    """
+    Запрос RIO score к Raider.IO (загрузчик кеша RIO для fetch_rio_with_retry)
+
+    Returns:
+        RIO score или None (нет данных, 404, 400 - кешируется);
+        Uncached(None) при временной ошибке (429, таймаут, сеть) - не кешируется
+    """
+    # Ключ Raider.IO из пула, интервал которого освобождается раньше
+    credential = _rio_pool.pick()
     params = {
         "region": region,
         "realm": realm,
         "name": name,
-        "fields": "mythic_plus_scores_by_season:current"
+        "fields": "mythic_plus_scores_by_season:current",
+        **credential.params(),
     }
 
     try:
-        async with _rio_semaphore:
-            # Глобальный rate limiting - минимум 500мс между запросами
-            current_time = asyncio.get_event_loop().time()
-            time_since_last = current_time - _rio_last_request_time
-            if time_since_last < _rio_min_interval:
-                sleep_time = _rio_min_interval - time_since_last
-                await asyncio.sleep(sleep_time)
+        async with credential.semaphore:
+            await wait_rio_interval(credential)
 
-            _rio_last_request_time = asyncio.get_event_loop().time()
+            credential.requests += 1
+            async with _stats_lock:
+                _stats["rio_requests_sent"] += 1
 
             r = await client.get(RIO_URL, params=params, timeout=5)
             r.raise_for_status()
@@ -356,23 +1082,20 @@ async def fetch_rio_with_retry(
             if not seasons:
                 logger.debug(f"Нет RIO данных для {name}-{realm}-{region}")
                 # Кешируем отсутствие данных
-                async with _rio_cache_lock:
-                    _rio_cache[cache_key] = None
+                await store_rio_score(cache_key, None)
                 return None
 
             scores = seasons[0].get("scores")
             if not scores:
                 logger.debug(f"Нет scores для {name}-{realm}-{region}")
-                async with _rio_cache_lock:
-                    _rio_cache[cache_key] = None
+                await store_rio_score(cache_key, None)
                 return None
 
             rio_score = scores.get("all")
             logger.debug(f"RIO score для {name}: {rio_score}")
 
             # Сохраняем в кеш
-            async with _rio_cache_lock:
-                _rio_cache[cache_key] = rio_score
+            await store_rio_score(cache_key, rio_score)
 
             return rio_score
 
@@ -380,12 +1103,12 @@ async def fetch_rio_with_retry(
         if e.response.status_code == 404:
             logger.debug(f"Игрок не найден в RIO: {name}-{realm}-{region}")
             # Кешируем 404 как None
-            async with _rio_cache_lock:
-                _rio_cache[cache_key] = None
+            await store_rio_score(cache_key, None)
             return None
         elif e.response.status_code == 429:
-            logger.warning(f"⚠️ Rate limit RIO API для {name}")
-            return None
+            logger.warning(f"⚠️ Rate limit RIO API для {name} ({credential.name})")
+            credential.throttle(asyncio.get_event_loop().time())
+            return Uncached()
         elif e.response.status_code == 400:
             # Анализируем детали 400 ошибки
             try:
@@ -399,52 +1122,150 @@ async def fetch_rio_with_retry(
             except:
                 logger.info(f"HTTP 400 для {name} (region={region}, realm={realm})")
             # Кешируем 400 как None, чтобы не повторять запрос
-            async with _rio_cache_lock:
-                _rio_cache[cache_key] = None
+            await store_rio_score(cache_key, None)
             return None
         else:
             logger.warning(f"HTTP {e.response.status_code} для {name}")
-            return None
+            return Uncached()
 
     except httpx.TimeoutException:
         logger.warning(f"Timeout при запросе RIO для {name}")
-        return None
+        return Uncached()
 
     except httpx.RequestError as e:
         logger.warning(f"Ошибка сети RIO для {name}: {e}")
-        return None
+        return Uncached()
 
     except Exception as e:
         logger.error(f"❌ Неожиданная ошибка RIO для {name}: {e}", exc_info=True)
-        return None
+        return Uncached()
 
 
-async def fetch_leaderboard_optimized(
-    client: httpx.AsyncClient,
-    token: str,
-    encounter_id: int,
-    class_name: str,
-    spec_name: str,
-    query: str = None,
-    key_type: str = "high",
-    is_raid: bool = False
-) -> Optional[Dict[str, Any]]:
-    """Оптимизированная версия fetch_leaderboard - возвращает среднее RIO, DPS и max_key"""
-    if query is None:
-        query = QUERY_FOR_MYTHIC_PLUS_HIGH_KEYS
+def player_region(server_region: Optional[str]) -> Optional[str]:
+    """Регион игрока по региону сервера из characterRankings (None - нет сервера или регион не поддерживается)"""
+    return normalize_region(server_region) if server_region else None
 
-    variables = {
-        "encounterID": encounter_id,
-        "className": class_name,
-        "specName": spec_name,
-    }
 
-    logger.debug(f"Запрос leaderboard для {class_name} {spec_name} на encounter {encounter_id}")
+def build_regional_meta(
+    template: MetaBySpec,
+    meta_by_region: Dict[str, RunningMean],
+    meta_values_by_region: Dict[str, array],
+    dps_by_region: Dict[str, RunningMean],
+    hps_by_region: Optional[Dict[str, RunningMean]] = None,
+    max_key_by_region: Optional[Dict[str, int]] = None,
+) -> List[MetaBySpec]:
+    """
+    Региональные копии объекта меты из накопителей, собранных в том же проходе
 
-    try:
-        async with _api_semaphore:
-            r = await client.post(
-                API_URL,
+    meta_by_region и meta_values_by_region должны быть из того же источника, что
+    и meta шаблона (RIO, DPS или HPS), чтобы значения регионов были сравнимы
+    с общим. meta и устойчивые статистики региона считаются так же, как общие.
+    """
+    z = z_for_confidence(META_CONFIDENCE_LEVEL)
+    regional = []
+    for region, meta_acc in sorted(meta_by_region.items()):
+        if not meta_acc.count:
+            continue
+        dps_acc = dps_by_region.get(region)
+        hps_acc = (hps_by_region or {}).get(region)
+        max_key = (max_key_by_region or {}).get(region)
+        values = meta_values_by_region.get(region)
+        stats = robust_stats(values) if values is not None else empty_stats()
+        regional.append(MetaBySpec(
+            class_name=template.class_name,
+            spec=template.spec,
+            meta=int(meta_value(stats, meta_acc.mean, META_STATISTIC)),
+            spec_type=template.spec_type,
+            encounter_id=template.encounter_id,
+            key=template.key,
+            difficulty=template.difficulty,
+            average_dps=int(dps_acc.mean) if dps_acc is not None and dps_acc.count else None,
+            average_hps=int(hps_acc.mean) if hps_acc is not None and hps_acc.count else None,
+            max_key_level=max_key if template.max_key_level is not None and max_key else None,
+            sample_size=meta_acc.count,
+            ci_half_width=meta_acc.half_width(z),
+            region=region,
+            source=template.source,
+            **{field: stats[field] for field in STAT_FIELDS},
+        ))
+    return regional
+
+
+def build_running_stats(result_data: Dict[str, Any]) -> Dict[Tuple[str, str], Tuple[int, float, float, array, Optional[int]]]:
+    """
+    Статистики дня leaderboard для meta_running_stats
+
+    Returns:
+        {(метрика, регион): (count, total, total_sq, значения, max_key)} - для всех
+        регионов вместе (REGION_ALL) и для каждого региона
+    """
+    # Очки забегов и рейтинг игроков - разные шкалы, в статистиках дня хранятся раздельно
+    rio_metric = "playerscore" if result_data.get("meta_source") == "playerscore" else "rio"
+    max_key_by_region = result_data.get("max_key_by_region", {})
+    running_stats = {}
+    for metric, prefix in (("dps", "dps"), (rio_metric, "rio")):
+        stats = result_data.get(f"{prefix}_stats")
+        if stats and stats[0]:
+            running_stats[(metric, REGION_ALL)] = (
+                *stats, result_data.get(f"{prefix}_values"), result_data.get("max_key_level")
+            )
+        values_by_region = result_data.get(f"{prefix}_values_by_region", {})
+        for region, acc in result_data.get(f"{prefix}_by_region", {}).items():
+            if acc.count:
+                running_stats[(metric, region)] = (
+                    acc.count, acc.total, acc.total_sq, values_by_region.get(region), max_key_by_region.get(region)
+                )
+    return running_stats
+
+
+class LeaderboardUnavailable(Exception):
+    """Первая страница leaderboard не получена"""
+
+
+async def post_wcl_query(
+    client: httpx.AsyncClient,
+    token: str,
+    query: str,
+    variables: Dict[str, Any],
+    label: str,
+) -> Optional[Dict[str, Any]]:
+    """
+    Один GraphQL запрос worldData.encounter к WarcraftLogs
+
+    Returns:
+        data.worldData.encounter или None при ошибке
+    """
+    data = await post_wcl_graphql(client, token, query, variables, label)
+    if data is None:
+        return None
+
+    encounter = (data.get("worldData") or {}).get("encounter")
+    if not encounter:
+        logger.warning(f"Нет encounter в ответе для {label}")
+        return None
+    return encounter
+
+
+async def post_wcl_graphql(
+    client: httpx.AsyncClient,
+    token: str,
+    query: str,
+    variables: Dict[str, Any],
+    label: str,
+) -> Optional[Dict[str, Any]]:
+    """
+    Один GraphQL запрос к WarcraftLogs под семафором клиента токена
+
+    Returns:
+        data ответа или None при ошибке
+    """
+    credential = _wcl_pool.for_token(token)
+    try:
+        async with credential.semaphore:
+            credential.requests += 1
+            request_start = asyncio.get_event_loop().time()
+            r = await client.post(
+                API_URL,
                 headers={"Authorization": f"Bearer {token}"},
                 json={
                     "query": query,
@@ -452,130 +1273,469 @@ async def fetch_leaderboard_optimized(
                 },
                 timeout=30
             )
+            async with _stats_lock:
+                _stats["wcl_requests"] += 1
+                _stats["wcl_request_seconds"] += asyncio.get_event_loop().time() - request_start
             r.raise_for_status()
             data = r.json()
 
         # Проверка на ошибки GraphQL
         if "errors" in data:
-            logger.error(f"❌ GraphQL ошибка для {class_name} {spec_name}: {data['errors']}")
+            logger.error(f"❌ GraphQL ошибка для {label}: {data['errors']}")
             return None
 
-        rankings_block = data.get("data", {}).get("worldData", {}).get("encounter", {}).get("characterRankings")
+        return data.get("data") or {}
 
-        if not rankings_block:
-            logger.warning(f"Нет characterRankings для {class_name} {spec_name} на encounter {encounter_id}")
-            return None
+    except asyncio.CancelledError:
+        raise
+    except httpx.HTTPStatusError as e:
+        logger.error(f"❌ HTTP ошибка для {label}: {e.response.status_code}")
+        return None
+    except httpx.TimeoutException:
+        logger.error(f"❌ Timeout для {label}")
+        return None
+    except Exception as e:
+        logger.error(f"❌ Ошибка запроса к WarcraftLogs для {label}: {e}", exc_info=True)
+        return None
+
+
+async def post_wcl_rankings(
+    client: httpx.AsyncClient,
+    token: str,
+    query: str,
+    variables: Dict[str, Any],
+    label: str,
+    factory: Optional[Callable[[Dict[str, Any]], Any]] = None,
+) -> Optional[Tuple[List[Any], bool]]:
+    """
+    GraphQL запрос characterRankings с потоковым разбором ответа
+
+    Ответ читается по частям, каждый элемент rankings сразу сворачивается
+    в запись factory (по умолчанию RankingRecord) - полный JSON страницы
+    в памяти не собирается. После каждого куска управление отдается event loop,
+    чтобы разбор больших ответов (includeCombatantInfo) не блокировал другие задачи.
+
+    Returns:
+        (записи, hasMorePages) или None при ошибке
+    """
+    credential = _wcl_pool.for_token(token)
+    try:
+        async with credential.semaphore:
+            credential.requests += 1
+            request_start = asyncio.get_event_loop().time()
+            decoder = RankingsStreamDecoder(factory)
+            records: List[Any] = []
+            async with client.stream(
+                "POST",
+                API_URL,
+                headers={"Authorization": f"Bearer {token}"},
+                json={
+                    "query": query,
+                    "variables": variables,
+                },
+                timeout=30
+            ) as r:
+                r.raise_for_status()
+                async for chunk in r.aiter_text():
+                    records.extend(decoder.feed(chunk))
+                    await asyncio.sleep(0)
+                decoder.finish()
+            async with _stats_lock:
+                _stats["wcl_requests"] += 1
+                _stats["wcl_request_seconds"] += asyncio.get_event_loop().time() - request_start
 
-        if "rankings" not in rankings_block:
-            logger.warning(f"Нет rankings для {class_name} {spec_name} на encounter {encounter_id}")
+        if decoder.found:
+            return records, decoder.has_more_pages
+
+        # Массива rankings нет - разбираем небольшой ответ целиком, чтобы понять причину
+        data = decoder.payload() or {}
+        if "errors" in data:
+            logger.error(f"❌ GraphQL ошибка для {label}: {data['errors']}")
             return None
 
-        rankings = rankings_block["rankings"]
-        logger.info(f"📥 Получено {len(rankings)} игроков для класса={class_name}, спека={spec_name}, encounter={encounter_id}")
+        encounter = (data.get("data") or {}).get("worldData", {}).get("encounter")
+        if not encounter:
+            logger.warning(f"Нет encounter в ответе для {label}")
+        elif not encounter.get("characterRankings"):
+            logger.warning(f"Нет characterRankings для {label}")
+        else:
+            logger.warning(f"Нет rankings для {label}")
+        return None
+
+    except asyncio.CancelledError:
+        raise
+    except httpx.HTTPStatusError as e:
+        logger.error(f"❌ HTTP ошибка для {label}: {e.response.status_code}")
+        return None
+    except httpx.TimeoutException:
+        logger.error(f"❌ Timeout для {label}")
+        return None
+    except Exception as e:
+        logger.error(f"❌ Ошибка запроса к WarcraftLogs для {label}: {e}", exc_info=True)
+        return None
 
-        # Подсчет DPS и max_key
-        total_dps = 0.0
-        valid_dps_entries = 0
-        max_key = 0
 
-        # Собираем уникальных игроков для RIO (только для M+, не для рейдов)
-        unique_players = set()  # set для хранения уникальных (region, realm, name)
+async def fetch_rankings_page(
+    client: httpx.AsyncClient,
+    token: str,
+    query: str,
+    variables: Dict[str, Any],
+    page: int,
+    label: str,
+    factory: Optional[Callable[[Dict[str, Any]], Any]] = None,
+) -> Optional[Tuple[List[Any], bool]]:
+    """
+    Одна страница characterRankings
+
+    Returns:
+        (rankings, hasMorePages) или None при ошибке
+    """
+    return await post_wcl_rankings(
+        client, token, query, {**variables, "page": page}, f"{label} (страница {page})", factory
+    )
+
+
+async def iter_leaderboard_pages(
+    client: httpx.AsyncClient,
+    token: str,
+    query: str,
+    variables: Dict[str, Any],
+    max_pages: int,
+    label: str,
+    factory: Optional[Callable[[Dict[str, Any]], Any]] = None,
+) -> AsyncIterator[List[Any]]:
+    """
+    Страницы leaderboard по мере получения (до max_pages)
+
+    Первая страница запрашивается отдельно: если hasMorePages=false, остальные
+    не запрашиваются вообще. Страницы 2..max_pages запрашиваются параллельно под
+    общим семафором WCL; как только какая-то страница сообщает hasMorePages=false,
+    задачи для страниц после нее отменяются (еще не начатые так и не уйдут в API).
+    Порядок выдачи страниц не гарантирован - агрегация от него не зависит.
+    """
+    first = await fetch_rankings_page(client, token, query, variables, 1, label, factory)
+    if first is None:
+        raise LeaderboardUnavailable(label)
+
+    rankings, has_more = first
+    yield rankings
+    if not has_more or not rankings or max_pages <= 1:
+        return
+
+    page_tasks = {
+        asyncio.create_task(fetch_rankings_page(client, token, query, variables, page, label, factory)): page
+        for page in range(2, max_pages + 1)
+    }
+    pending = set(page_tasks)
+    last_page = max_pages
+
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # Внутри пачки - по порядку страниц, чтобы конец leaderboard был замечен раньше следующих страниц
+            for task in sorted(done, key=page_tasks.get):
+                page = page_tasks[task]
+                if page > last_page or task.cancelled():
+                    continue
+                page_result = task.result()
+                if page_result is None:
+                    continue
+
+                rankings, has_more = page_result
+                if (not has_more or not rankings) and page < last_page:
+                    # Дальше страниц нет - отменяем лишние запросы
+                    last_page = page
+                    for other in pending:
+                        if page_tasks[other] > last_page:
+                            other.cancel()
+                    pending = {t for t in pending if page_tasks[t] <= last_page}
+
+                if rankings:
+                    yield rankings
+    finally:
+        for task in pending:
+            task.cancel()
 
-        for item in rankings:
-            # Извлекаем DPS
-            dps = item.get("amount")
-            if dps and dps > 0:
-                total_dps += dps
-                valid_dps_entries += 1
 
-            # Извлекаем bracket (key level) - только для M+
-            if not is_raid:
-                bracket_data = item.get("bracketData", 0)
+async def fetch_leaderboard_optimized(
+    client: httpx.AsyncClient,
+    token: str,
+    encounter_id: int,
+    class_name: str,
+    spec_name: str,
+    query: str = None,
+    key_type: str = "high",
+    pages: int = 1,
+    timeframe: Optional[str] = None,
+    metric: str = "dps"
+) -> Optional[Dict[str, Any]]:
+    """
+    Оптимизированная версия fetch_leaderboard - возвращает среднее RIO, DPS и max_key
+
+    Страницы leaderboard (до pages) агрегируются по мере получения.
+    timeframe="Today" - только рейтинги за сегодня (для инкрементального сбора).
+    metric="playerscore" (только M+) - leaderboard по очкам забегов: вместо среднего
+    рейтинга игроков (average_rio) возвращается среднее очков забегов, запросов
+    рейтинга нет, DPS не считается.
+    """
+    if query is None:
+        query = QUERY_FOR_MYTHIC_PLUS_HIGH_KEYS
+
+    variables = {
+        "encounterID": encounter_id,
+        "className": class_name,
+        "specName": spec_name,
+    }
+    if timeframe:
+        variables["timeframe"] = timeframe
+    if WCL_PARTITION is not None:
+        variables["partition"] = WCL_PARTITION
+    if metric != "dps":
+        variables["metric"] = metric
+    use_playerscore = metric == "playerscore"
+    label = f"{class_name} {spec_name} на encounter {encounter_id}"
+
+    logger.debug(f"Запрос leaderboard для {label} (до {pages} страниц)")
+
+    facts = None
+    if _ranking_facts is not None:
+        facts = _ranking_facts.leaderboard(
+            encounter_id, key_type, 0, class_name, spec_name, "playerscore" if use_playerscore else "dps",
+        )
+
+    try:
+        # Подсчет DPS и max_key
+        dps_acc = RunningMean()
+        max_key = 0
+        # Значения для устойчивых статистик (компактный буфер float64)
+        dps_values = array("d")
+        rio_values = array("d")
+
+        # Региональные накопители в том же проходе (без дополнительных запросов)
+        dps_by_region: Dict[str, RunningMean] = {}
+        rio_by_region: Dict[str, RunningMean] = {}
+        dps_values_by_region: Dict[str, array] = {}
+        rio_values_by_region: Dict[str, array] = {}
+        max_key_by_region: Dict[str, int] = {}
+        # Очки забегов (metric: playerscore) - в те же буферы, что и RIO
+        score_acc = RunningMean()
+
+        # Гистограмма throughput и meta по уровню ключа
+        histogram = BucketHistogram(BUCKET_KEY_LEVEL)
+
+        # Уникальные игроки для RIO: (region, realm, name) -> уровень ключа (корзина рейтинга игрока)
+        unique_players: Dict[Tuple[str, str, str], int] = {}
+
+        total_rankings = 0
+        pages_received = 0
+        unknown_realms = 0
+        score_engine = _score_engine
+        collector = _composition_collector
+        player_index = _player_index
+        async for rankings in iter_leaderboard_pages(client, token, query, variables, pages, label):
+            total_rankings += len(rankings)
+            pages_received += 1
+
+            for item in rankings:
+                region = player_region(item.server_region)
+                if collector is not None:
+                    collector.add(encounter_id, item)
+
+                if use_playerscore:
+                    if item.score > 0:
+                        score_acc.add(item.score)
+                        rio_values.append(item.score)
+                        histogram.add_meta(item.bracket, item.score)
+                        if region:
+                            rio_by_region.setdefault(region, RunningMean()).add(item.score)
+                            rio_values_by_region.setdefault(region, array("d")).append(item.score)
+
+                # Извлекаем DPS (в leaderboard по playerscore amount - не DPS)
+                dps = item.amount if not use_playerscore else None
+                if dps and dps > 0:
+                    dps_acc.add(dps)
+                    dps_values.append(dps)
+                    histogram.add(item.bracket, dps)
+                    if region:
+                        dps_by_region.setdefault(region, RunningMean()).add(dps)
+                        dps_values_by_region.setdefault(region, array("d")).append(dps)
+
+                # Извлекаем bracket (key level)
+                bracket_data = item.bracket
                 if bracket_data > max_key:
                     max_key = bracket_data
+                if region and bracket_data > max_key_by_region.get(region, 0):
+                    max_key_by_region[region] = bracket_data
 
-            # Собираем уникальных игроков для RIO (только для M+, не для рейдов)
-            if not is_raid:
-                hidden = item.get("hidden", False)
-                server_obj = item.get("server") or {}
-                server_name = server_obj.get("name", "")
-                server_region = server_obj.get("region", "")
-                player_name = item.get("name")
+                # Собираем уникальных игроков для RIO
+                player = None
+                hidden = item.hidden
+                server_name = item.server_name
+                player_name = item.name
 
-                if not hidden and server_name and server_region and player_name and player_name != "Anonymous":
+                if not hidden and server_name and region and player_name and player_name != "Anonymous":
                     try:
-                        server = normalize_realm(server_name)
-                        region = normalize_region(server_region) if server_region else None
-
-                        if region:
+                        server = resolve_realm(region, server_name)
+                        if not server:
+                            # Реалма нет в каталоге - запрос RIO закончился бы 400, игрок не учитывается
+                            unknown_realms += 1
+                        else:
                             # Добавляем уникальную комбинацию (region, realm, name)
-                            unique_players.add((region, server, player_name))
+                            player = (region, server, player_name)
+                            unique_players[player] = item.bracket
+                            if score_engine is not None:
+                                score_engine.add(player, encounter_id, item.bracket, item.duration)
+                            if player_index is not None and item.class_name and item.spec:
+                                player_index.add(
+                                    player, item.class_name, item.spec,
+                                    encounter_id, item.bracket, item.duration,
+                                )
                     except Exception as e:
-                        logger.debug(f"Ошибка нормализации для {player_name}/{server_name}/{server_region}: {e}")
-                        continue
+                        logger.debug(f"Ошибка нормализации для {player_name}/{server_name}/{region}: {e}")
+
+                if facts is not None:
+                    facts.add(region, player, item.score if use_playerscore else item.amount, item.bracket)
+
+        # Leaderboard получен: рейтинги считаются, когда отмечены все задачи M+ прогона
+        # (задачу, упавшую до этого места, отмечает run_one в collect_jobs)
+        if score_engine is not None:
+            score_engine.job_done(score_job_key(encounter_id, class_name, spec_name, key_type))
+
+        logger.info(f"📥 Получено {total_rankings} игроков ({pages_received} стр.) для класса={class_name}, спека={spec_name}, encounter={encounter_id}")
+
+        async with _stats_lock:
+            _stats["total_players_from_wcl"] += total_rankings
+            _stats["unknown_realm"] += unknown_realms
+            # Для стоимости прогона считаются только leaderboard с запросами рейтинга
+            if not use_playerscore:
+                _stats["mplus_leaderboards"] += 1
+                _stats["unique_players_for_rio"] += len(unique_players)
 
-        # Создаем задачи только для уникальных игроков
-        rio_tasks = [fetch_rio_with_retry(client, region, server, name) for region, server, name in unique_players]
         valid_players = len(unique_players)
+        z = z_for_confidence(META_CONFIDENCE_LEVEL)
 
         # Формируем результат
         result = {}
 
         # Средний DPS
-        if valid_dps_entries > 0:
-            result["average_dps"] = int(total_dps / valid_dps_entries)
+        if dps_acc.count > 0:
+            result["average_dps"] = int(dps_acc.mean)
         else:
             result["average_dps"] = None
-
-        # Максимальный ключ только для high keys M+
-        if not is_raid and key_type == "high":
+        result["dps_sample_size"] = dps_acc.count
+        # Достаточные статистики для инкрементального сбора
+        result["dps_stats"] = (dps_acc.count, dps_acc.total, dps_acc.total_sq)
+        result["rio_stats"] = None
+        result["dps_by_region"] = dps_by_region
+        result["rio_robust"] = empty_stats()
+        result["rio_by_region"] = rio_by_region
+        result["dps_values_by_region"] = dps_values_by_region
+        result["rio_values_by_region"] = rio_values_by_region
+        result["dps_values"] = dps_values
+        result["rio_values"] = rio_values
+        result["max_key_by_region"] = max_key_by_region
+
+        # Максимальный ключ только для high keys
+        if key_type == "high":
             result["max_key_level"] = max_key if max_key > 0 else None
         else:
             result["max_key_level"] = None
 
-        # Вычисляем RIO только для M+, не для рейдов
-        if not is_raid:
-            if not rio_tasks:
+        result["rio_sample_size"] = 0
+        result["rio_ci_half_width"] = None
+        result["meta_source"] = "local" if score_engine is not None else "raiderio"
+        if facts is not None:
+            facts.rating_source = result["meta_source"]
+        if use_playerscore:
+            # Мета из очков забегов того же leaderboard - без запросов рейтинга
+            result["meta_source"] = "playerscore"
+            result["rio_sample_size"] = score_acc.count
+            result["rio_ci_half_width"] = score_acc.half_width(z)
+            result["rio_stats"] = (score_acc.count, score_acc.total, score_acc.total_sq)
+            result["rio_robust"] = robust_stats(rio_values)
+            result["average_rio"] = score_acc.mean if score_acc.count else None
+            if score_acc.count:
+                logger.info(f"✅ Средние очки забега={score_acc.mean:.2f} для класса={class_name}, спека={spec_name}, encounter={encounter_id} ({score_acc.count} забегов)")
+            else:
+                logger.warning(f"Нет очков забегов (класс={class_name}, спек={spec_name}, encounter={encounter_id})")
+        else:
+            if not unique_players:
                 logger.warning(f"Нет валидных игроков для запроса RIO (класс={class_name}, спек={spec_name}, encounter={encounter_id})")
                 result["average_rio"] = None
             else:
-                logger.info(f"🔍 Запрос RIO для {valid_players} игроков (класс={class_name}, спек={spec_name}, encounter={encounter_id})")
-
-                # Параллельное выполнение всех RIO запросов
-                rio_results = await asyncio.gather(*rio_tasks, return_exceptions=True)
-
-                # Подсчет среднего
-                total_score = 0.0
-                counter_players_with_score = 0
+                # Стабильный порядок игроков: с генератором sample_rng повтор снимка выбирает тех же игроков
+                players = sorted(unique_players)
+
+                # Локальный рейтинг (RIO_SOURCE=local) - та же сигнатура, без запросов к Raider.IO
+                fetch_score = score_engine.rating if score_engine is not None else fetch_rio_with_retry
+                if score_engine is None:
+                    await prefetch_rio_scores(players)
+
+                async def fetch_player_rio(player):
+                    region, server, name = player
+                    score = await fetch_score(client, region, server, name)
+                    if score and score > 0:
+                        if player_index is not None:
+                            player_index.set_rating(player, score, result["meta_source"])
+                        if facts is not None:
+                            facts.set_rating(player, score)
+                        rio_by_region.setdefault(region, RunningMean()).add(score)
+                        rio_values_by_region.setdefault(region, array("d")).append(score)
+                        rio_values.append(score)
+                        histogram.add_meta(unique_players[player], score)
+                    return score
+
+                if RIO_SAMPLING_ENABLED:
+                    # Случайная подвыборка с остановкой по доверительному интервалу
+                    logger.info(f"🔍 Выборка RIO из {valid_players} игроков (±{RIO_SAMPLING_TOLERANCE:.0%}, класс={class_name}, спек={spec_name}, encounter={encounter_id})")
+                    sample = await sample_mean_adaptive(
+                        players, fetch_player_rio,
+                        tolerance=RIO_SAMPLING_TOLERANCE,
+                        min_samples=RIO_SAMPLING_MIN_SAMPLES,
+                        batch_size=RIO_SAMPLING_BATCH_SIZE,
+                        confidence=META_CONFIDENCE_LEVEL,
+                        rng=sample_rng(snapshot.current_run_id(), f"{encounter_id}:{key_type}:{class_name}:{spec_name}"),
+                    )
+                else:
+                    logger.info(f"🔍 Запрос RIO для {valid_players} игроков (класс={class_name}, спек={spec_name}, encounter={encounter_id})")
+                    # Все игроки без ранней остановки. Пачками, а не одним gather на всех:
+                    # запросы все равно упираются в глобальный интервал RIO, а тысячи
+                    # одновременно созданных задач по всем leaderboard только занимают память
+                    sample = await sample_mean_adaptive(
+                        players, fetch_player_rio,
+                        tolerance=0.0,
+                        min_samples=valid_players + 1,
+                        batch_size=RIO_SAMPLING_BATCH_SIZE,
+                        confidence=META_CONFIDENCE_LEVEL,
+                    )
 
-                for rio_result in rio_results:
-                    if isinstance(rio_result, (int, float)) and rio_result is not None and rio_result > 0:
-                        total_score += float(rio_result)
-                        counter_players_with_score += 1
-                    elif isinstance(rio_result, Exception):
-                        logger.debug(f"RIO задача вернула исключение: {rio_result}")
+                result["rio_sample_size"] = sample["sample_size"]
+                result["rio_ci_half_width"] = sample["ci_half_width"]
+                rio_acc = sample["accumulator"]
+                result["rio_stats"] = (rio_acc.count, rio_acc.total, rio_acc.total_sq)
+                result["rio_robust"] = robust_stats(rio_values)
 
-                if counter_players_with_score == 0:
+                if sample["mean"] is None:
                     logger.warning(f"Нет RIO scores (класс={class_name}, спек={spec_name}, encounter={encounter_id})")
                     result["average_rio"] = None
                 else:
-                    average_score = total_score / counter_players_with_score
-                    logger.info(f"✅ Средний RIO={average_score:.2f} для класса={class_name}, спека={spec_name}, encounter={encounter_id} ({counter_players_with_score}/{valid_players} игроков)")
+                    average_score = sample["mean"]
+                    ci = f" ±{sample['ci_half_width']:.1f}" if sample["ci_half_width"] is not None else ""
+                    early = f", остановка после {sample['attempted']} запросов" if sample["stopped_early"] else ""
+                    logger.info(f"✅ Средний RIO={average_score:.2f}{ci} для класса={class_name}, спека={spec_name}, encounter={encounter_id} ({sample['sample_size']}/{valid_players} игроков{early})")
                     result["average_rio"] = average_score
-        else:
-            # Для рейдов RIO не вычисляется
-            result["average_rio"] = None
 
+        # Корзины - после запросов рейтинга: в них и DPS, и meta игроков
+        result["buckets"] = histogram.rows()
         return result
 
-    except httpx.HTTPStatusError as e:
-        logger.error(f"❌ HTTP ошибка для {class_name} {spec_name}: {e.response.status_code}")
-        return None
-    except httpx.TimeoutException:
-        logger.error(f"❌ Timeout для {class_name} {spec_name} на encounter {encounter_id}")
+    except LeaderboardUnavailable:
         return None
     except Exception as e:
         logger.error(f"❌ Ошибка fetch_leaderboard для {class_name} {spec_name} на encounter {encounter_id}: {e}", exc_info=True)
+        # Частично полученный leaderboard не должен попасть в мету из ranking_entries
+        if facts is not None:
+            facts.clear()
         return None
 
 
@@ -587,34 +1747,24 @@ async def fetch_single_spec_meta(
     spec_name: str,
     key_type: str = "high",
     query: str = None,
-    is_raid: bool = False
+    pages: int = 1,
+    timeframe: Optional[str] = None,
+    metric: str = "dps"
 ) -> Optional[MetaBySpec]:
-    """Получение меты для одной спеки одного босса (M+ или Raid)"""
-    if is_raid:
-        logger.info(f"📊 Обработка рейда: класс={class_name}, спек={spec_name}, encounter={encounter_id}")
-    else:
-        logger.info(f"📊 Обработка: класс={class_name}, спек={spec_name}, encounter={encounter_id}, ключ={key_type}")
+    """Получение меты M+ для одной спеки одного подземелья (рейды - fetch_raid_group)"""
+    logger.info(f"📊 Обработка: класс={class_name}, спек={spec_name}, encounter={encounter_id}, ключ={key_type}")
 
-    # Автоматический выбор запроса на основе key_type и is_raid
     if query is None:
-        if is_raid:
-            # Для рейдов определяем роль спека
-            spec_role = SPEC_ROLE_METRIC.get(spec_name, ("dps", "playerscore"))[0]
-            if spec_role == "healer":
-                query = QUERY_FOR_RAID_HPS
-            else:
-                query = QUERY_FOR_RAID_DPS
-        elif key_type == "low":
-            query = QUERY_FOR_MYTHIC_PLUS_LOW_KEYS
-        else:
-            query = QUERY_FOR_MYTHIC_PLUS_HIGH_KEYS
+        query = QUERY_FOR_MYTHIC_PLUS_LOW_KEYS if key_type == "low" else QUERY_FOR_MYTHIC_PLUS_HIGH_KEYS
 
     try:
         result_data = await fetch_leaderboard_optimized(
             client, token, encounter_id, class_name, spec_name,
             query=query,
             key_type=key_type,
-            is_raid=is_raid
+            pages=pages,
+            timeframe=timeframe,
+            metric=metric
         )
 
         if result_data is None:
@@ -626,27 +1776,47 @@ async def fetch_single_spec_meta(
         average_dps = result_data.get("average_dps")
         max_key_level = result_data.get("max_key_level")
 
-        # Для M+ приоритет: RIO, затем DPS. Для рейдов используется DPS или HPS
+        # meta M+ - рейтинг (или очки забега); DPS - другая шкала, без рейтингов меты нет
         if average_rio:
-            meta_value = int(average_rio)
-        elif average_dps:
-            meta_value = int(average_dps)
+            stats = result_data.get("rio_robust") or empty_stats()
+            meta = int(meta_value(stats, average_rio, META_STATISTIC))
+            sample_size = result_data.get("rio_sample_size")
+            ci_half_width = result_data.get("rio_ci_half_width")
+            meta_by_region = result_data.get("rio_by_region", {})
+            meta_values_by_region = result_data.get("rio_values_by_region", {})
+            source = result_data.get("meta_source")
         else:
-            logger.debug(f"Нет meta данных (ни RIO, ни DPS/HPS) для {class_name} {spec_name} на encounter {encounter_id}")
+            logger.debug(f"Нет рейтингов для meta {class_name} {spec_name} на encounter {encounter_id}")
             return None
 
         meta_obj = MetaBySpec(
             class_name=class_name,
             spec=spec_name,
-            meta=meta_value,
+            meta=meta,
             spec_type=SPEC_ROLE_METRIC[spec_name][0],
             encounter_id=encounter_id,
-            key=key_type if not is_raid else "raid",
+            key=key_type,
+            difficulty=0,
             average_dps=average_dps,
-            max_key_level=max_key_level
+            max_key_level=max_key_level,
+            sample_size=sample_size,
+            ci_half_width=ci_half_width,
+            region=REGION_ALL,
+            source=source,
+            **{field: stats[field] for field in STAT_FIELDS}
         )
 
-        logger.debug(f"✅ Создан объект меты для {class_name} {spec_name}: meta={meta_value}, dps={average_dps}, max_key={max_key_level}")
+        # Не колонка модели: корзины сохраняются отдельно в meta_buckets
+        meta_obj.buckets = result_data.get("buckets", [])
+        if timeframe:
+            # Инкрементальный сбор: статистики дня для меты окна (timeframe="recent")
+            meta_obj.running_stats = build_running_stats(result_data)
+        meta_obj.regional = build_regional_meta(
+            meta_obj, meta_by_region, meta_values_by_region, result_data.get("dps_by_region", {}),
+            max_key_by_region=result_data.get("max_key_by_region"),
+        )
+
+        logger.debug(f"✅ Создан объект меты для {class_name} {spec_name}: meta={meta}, dps={average_dps}, max_key={max_key_level}")
         return meta_obj
 
     except KeyError as e:
@@ -657,55 +1827,551 @@ async def fetch_single_spec_meta(
         return None
 
 
-async def test_leaderboard():
-    """Основная функция сбора данных - ОПТИМИЗИРОВАННАЯ с поддержкой LOW/HIGH keys и RAID"""
-    logger.info("=" * 80)
-    logger.info("НАЧАЛО СБОРА ДАННЫХ WOW META")
-    logger.info("=" * 80)
+async def fetch_raid_group(
+    client: httpx.AsyncClient,
+    token: str,
+    encounter_id: int,
+    spec_group: str,
+    specs: List[Tuple[str, str]],
+    difficulties: List[int],
+    pages: int = 1,
+    raid_group: bool = True,
+) -> Optional[List[MetaBySpec]]:
+    """
+    Мета рейд босса для группы спеков одной роли и всех сложностей одним запросом на страницу
+
+    Каждый (класс и спек, сложность, метрика) - отдельный алиас characterRankings
+    в одном GraphQL запросе. DPS собирается для всех спеков, HPS - дополнительно
+    для хилов. Алиасы, у которых закончились страницы, в следующий запрос не попадают.
+
+    Args:
+        spec_group: Роль спеков группы (tank, healer, dps) - для логов
+        specs: [(class_name, spec_name), ...]
+    """
+    aliases = []
+    for spec_index, (class_name, spec_name) in enumerate(specs):
+        metrics = ("dps", "hps") if spec_group == "healer" else ("dps",)
+        for difficulty in difficulties:
+            for metric in metrics:
+                aliases.append((f"s{spec_index}_d{difficulty}_{metric}", class_name, spec_name, difficulty, metric))
+
+    accumulators = {alias[0]: RunningMean() for alias in aliases}
+    histograms = {alias[0]: BucketHistogram(BUCKET_ITEM_LEVEL, ILVL_BUCKET_WIDTH) for alias in aliases}
+    regional: Dict[str, Dict[str, RunningMean]] = {alias[0]: {} for alias in aliases}
+    regional_values: Dict[str, Dict[str, array]] = {alias[0]: {} for alias in aliases}
+    values = {alias[0]: array("d") for alias in aliases}
+    facts = {
+        alias: _ranking_facts.leaderboard(encounter_id, "raid", difficulty, class_name, spec_name, metric)
+        for alias, class_name, spec_name, difficulty, metric in aliases
+    } if _ranking_facts is not None else {}
+    active = list(aliases)
+    label = f"рейд {spec_group} ({len(specs)} спеков) на encounter {encounter_id}"
+
+    for page in range(1, pages + 1):
+        encounter = await post_wcl_query(
+            client, token, build_raid_group_query(active),
+            {"encounterID": encounter_id, "page": page},
+            f"{label} (страница {page})"
+        )
+        if encounter is None:
+            if page == 1:
+                return None
+            break
+
+        still_active = []
+        for alias_entry in active:
+            block = encounter.get(alias_entry[0]) or {}
+            rankings = block.get("rankings") or []
+            for item in rankings:
+                amount = item.get("amount")
+                server = item.get("server") or {}
+                region = player_region(server.get("region"))
+                if amount and amount > 0:
+                    accumulators[alias_entry[0]].add(amount)
+                    values[alias_entry[0]].append(amount)
+                    # bracketData в рейде - item level
+                    histograms[alias_entry[0]].add(item.get("bracketData"), amount)
+                    if region:
+                        regional[alias_entry[0]].setdefault(region, RunningMean()).add(amount)
+                        regional_values[alias_entry[0]].setdefault(region, array("d")).append(amount)
+                if facts:
+                    player = None
+                    if region and server.get("name") and item.get("name") and not item.get("hidden"):
+                        # Slug реалма - как у M+ (по каталогу); реалма нет в каталоге - запись без игрока
+                        realm = resolve_realm(region, server["name"])
+                        if realm:
+                            player = (region, realm, item["name"])
+                    facts[alias_entry[0]].add(region, player, amount, item.get("bracketData") or 0)
+            if block.get("hasMorePages") and rankings:
+                still_active.append(alias_entry)
+
+        active = still_active
+        if not active:
+            break
+
+    z = z_for_confidence(META_CONFIDENCE_LEVEL)
+    results = []
+    for spec_index, (class_name, spec_name) in enumerate(specs):
+        spec_type = SPEC_ROLE_METRIC[spec_name][0]
+        for difficulty in difficulties:
+            dps_alias = f"s{spec_index}_d{difficulty}_dps"
+            hps_alias = f"s{spec_index}_d{difficulty}_hps"
+            dps_acc = accumulators[dps_alias]
+            hps_acc = accumulators.get(hps_alias)
+
+            # Для хилов мета - HPS, для остальных - DPS
+            meta_alias = hps_alias if hps_acc is not None else dps_alias
+            meta_acc = accumulators[meta_alias]
+            if meta_acc.count == 0:
+                logger.debug(f"Нет данных рейда для {class_name} {spec_name} на encounter {encounter_id} (difficulty={difficulty})")
+                continue
+
+            stats = robust_stats(values[meta_alias])
+            meta_obj = MetaBySpec(
+                class_name=class_name,
+                spec=spec_name,
+                meta=int(meta_value(stats, meta_acc.mean, META_STATISTIC)),
+                spec_type=spec_type,
+                encounter_id=encounter_id,
+                key="raid",
+                difficulty=difficulty,
+                average_dps=int(dps_acc.mean) if dps_acc.count else None,
+                average_hps=int(hps_acc.mean) if hps_acc is not None and hps_acc.count else None,
+                max_key_level=None,
+                sample_size=meta_acc.count,
+                ci_half_width=meta_acc.half_width(z),
+                region=REGION_ALL,
+                source="hps" if hps_acc is not None else "dps",
+                **{field: stats[field] for field in STAT_FIELDS},
+            )
+            # Не колонка модели: корзины сохраняются отдельно в meta_buckets
+            meta_obj.buckets = histograms[meta_alias].rows()
+            results.append(meta_obj)
+            results.extend(build_regional_meta(
+                meta_obj, regional[meta_alias], regional_values[meta_alias], regional[dps_alias],
+                hps_by_region=regional[hps_alias] if hps_acc is not None else None,
+            ))
+
+    logger.info(f"📥 Рейд encounter={encounter_id}, группа={spec_group}: {len(results)} записей ({len(aliases)} алиасов в запросе)")
+    return results
+
+
+async def fetch_encounter_popularity(
+    client: httpx.AsyncClient,
+    token: str,
+    encounter_id: int,
+    key_type: str,
+    query: str,
+    pages: int = 1,
+    popularity: bool = True,
+) -> Optional[List[Dict[str, Any]]]:
+    """Популярность спеков на encounter по одному нефильтрованному leaderboard (все страницы)"""
+    label = f"популярности encounter {encounter_id} ({key_type})"
+    counter = PopularityCounter()
 
     try:
-        token = await get_access_token()
+        async for rankings in iter_leaderboard_pages(client, token, query, {"encounterID": encounter_id}, pages, label):
+            counter.add_rankings(rankings)
+    except LeaderboardUnavailable:
+        return None
     except Exception as e:
-        logger.error(f"❌ Не удалось получить access token: {e}")
+        logger.error(f"❌ Ошибка сбора {label}: {e}", exc_info=True)
+        return None
+
+    if counter.total == 0:
+        logger.warning(f"Нет игроков для {label}")
+        return None
+
+    logger.info(f"👥 Популярность encounter={encounter_id}, ключ={key_type}: {counter.total} игроков ({counter.unknown} без известного спека)")
+
+    rows = counter.results()
+    for row in rows:
+        row["encounter_id"] = encounter_id
+        row["key"] = key_type
+    return rows
+
+
+async def fetch_spec_loadout(
+    client: httpx.AsyncClient,
+    token: str,
+    encounter_id: int,
+    class_name: str,
+    spec_name: str,
+    pages: int = 1,
+    loadout: bool = True,
+) -> Optional[List[Dict[str, Any]]]:
+    """Top-K талантов и предметов спека на encounter (q_with_gear_and_talent, потоковый разбор)"""
+    label = f"талантов и предметов {class_name} {spec_name} на encounter {encounter_id}"
+    counter = LoadoutCounter()
+    variables = {"encounterID": encounter_id, "className": class_name, "specName": spec_name}
+
+    try:
+        async for records in iter_leaderboard_pages(
+            client, token, q_with_gear_and_talent, variables, pages, label, LoadoutRecord.from_item
+        ):
+            for record in records:
+                counter.add(record)
+    except LeaderboardUnavailable:
+        return None
+    except Exception as e:
+        logger.error(f"❌ Ошибка сбора {label}: {e}", exc_info=True)
+        return None
+
+    if counter.players == 0:
+        logger.warning(f"Нет игроков с талантами / экипировкой для {label}")
+        return None
+
+    rows = []
+    for kind in LOADOUT_KINDS:
+        for row in counter.top(kind, LOADOUT_TOP_K):
+            row.update({
+                "class_name": class_name,
+                "spec": spec_name,
+                "encounter_id": encounter_id,
+                "sample_players": counter.players,
+            })
+            rows.append(row)
+
+    logger.info(f"🧩 Таланты и предметы {class_name} {spec_name}, encounter={encounter_id}: {counter.players} игроков, {len(rows)} записей top-{LOADOUT_TOP_K}")
+    return rows
+
+
+def composition_row(report_code: str, fight_id: int, group: FightGroup, composition: str, source: str) -> Dict[str, Any]:
+    return {
+        "report_code": report_code,
+        "fight_id": fight_id,
+        "encounter_id": group.encounter_id,
+        "key_level": group.key_level,
+        "composition": composition,
+        "source": source,
+    }
+
+
+async def fetch_report_compositions(
+    client: httpx.AsyncClient,
+    token: str,
+    report_code: str,
+    fights: Dict[int, FightGroup],
+) -> List[Dict[str, Any]]:
+    """
+    Составы боев одного отчета одним запросом (playerDetails по алиасу на бой)
+
+    Бои, которые WarcraftLogs вернул без состава (нет отчета или боя, не 5 игроков),
+    сохраняются с пустым составом и source="missing", чтобы не запрашивать их снова.
+    Если запрос не удался (сеть, 429, ошибка GraphQL), ничего не сохраняется - отчет
+    будет запрошен в следующем прогоне.
+    """
+    fight_ids = sorted(fights)
+    label = f"отчета {report_code} ({len(fight_ids)} боев)"
+    data = await post_wcl_graphql(client, token, build_report_fights_query(fight_ids), {"code": report_code}, label)
+    if data is None:
+        logger.warning(f"Составы {label} не получены, повтор в следующем прогоне")
         return []
+    report = (data.get("reportData") or {}).get("report") or {}
 
-    logger.info(f"Обработка {len(ENCOUNTERS)} подземелий и {len(RAID)} рейд боссов...")
+    rows = []
+    for fight_id in fight_ids:
+        composition = composition_from_player_details(report.get(f"f{fight_id}"))
+        if composition:
+            rows.append(composition_row(report_code, fight_id, fights[fight_id], composition, "report"))
+        else:
+            rows.append(composition_row(report_code, fight_id, fights[fight_id], "", "missing"))
+    return rows
 
-    async with httpx.AsyncClient(timeout=60) as client:
-        # Создаем все задачи для параллельного выполнения
-        tasks = []
-
-        # M+ задачи
-        for encounter_id in ENCOUNTERS.keys():
-            for class_name, specs in WOW_CLASS_SPECS.items():
-                for spec_name in specs:
-                    # LOW KEYS задача
-                    task_low = fetch_single_spec_meta(
-                        client, token, encounter_id, class_name, spec_name,
-                        key_type="low",
-                        query=QUERY_FOR_MYTHIC_PLUS_LOW_KEYS,
-                        is_raid=False
-                    )
-                    tasks.append(task_low)
-
-                    # HIGH KEYS задача
-                    task_high = fetch_single_spec_meta(
-                        client, token, encounter_id, class_name, spec_name,
-                        key_type="high",
-                        query=QUERY_FOR_MYTHIC_PLUS_HIGH_KEYS,
-                        is_raid=False
-                    )
-                    tasks.append(task_high)
 
-        # RAID задачи
+async def analyse_compositions(
+    client: httpx.AsyncClient,
+    token: str,
+    collector: CompositionCollector,
+) -> List[Dict[str, Any]]:
+    """
+    Составы групп для боев, собранных с leaderboard спеков
+
+    Бои со всеми 5 участниками на leaderboard не требуют запросов. Для остальных
+    запрашиваются отчеты (каждый report code один раз, не больше COMPOSITION_MAX_REPORTS
+    за прогон); бои, уже сохраненные в report_compositions, пропускаются.
+
+    Returns:
+        Новые строки для report_compositions
+    """
+    known = await load_known_fights(list(collector.fights))
+
+    rows = [
+        composition_row(code, fight_id, group, group.composition(), "rankings")
+        for (code, fight_id), group in collector.complete().items()
+        if (code, fight_id) not in known
+    ]
+
+    missing_by_report: Dict[str, Dict[int, FightGroup]] = {}
+    for (code, fight_id), group in collector.incomplete().items():
+        if (code, fight_id) not in known:
+            missing_by_report.setdefault(code, {})[fight_id] = group
+
+    # Сначала отчеты, закрывающие больше боев
+    reports = sorted(missing_by_report.items(), key=lambda entry: len(entry[1]), reverse=True)
+    skipped = max(0, len(reports) - COMPOSITION_MAX_REPORTS)
+    reports = reports[:COMPOSITION_MAX_REPORTS]
+
+    logger.info(
+        f"👥 Составы групп: {len(collector)} боев, {len(known)} уже в кеше, "
+        f"{len(rows)} полных по leaderboard, {len(reports)} отчетов к запросу"
+        + (f" ({skipped} отложено до следующего прогона)" if skipped else "")
+    )
+
+    results = await asyncio.gather(
+        *(fetch_report_compositions(client, token, code, fights) for code, fights in reports),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, list):
+            rows.extend(result)
+        elif isinstance(result, Exception):
+            logger.error(f"Запрос отчета завершился с исключением: {result}")
+
+    return rows
+
+
+def build_loadout_jobs(
+    encounter_ids: Optional[List[int]] = None,
+    class_name: Optional[str] = None,
+    spec_name: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """Задачи талантов и предметов: по одной на подземелье и спек (аргументы fetch_spec_loadout)"""
+    jobs = []
+    for encounter_id in ENCOUNTERS.keys():
+        if encounter_ids and encounter_id not in encounter_ids:
+            continue
+        for cls, specs in WOW_CLASS_SPECS.items():
+            if class_name and cls != class_name:
+                continue
+            for spec in specs:
+                if spec_name and spec != spec_name:
+                    continue
+                jobs.append({
+                    "encounter_id": encounter_id,
+                    "class_name": cls,
+                    "spec_name": spec,
+                    "pages": WCL_PAGES_LOADOUT,
+                    "loadout": True,
+                })
+    return jobs
+
+
+def build_popularity_jobs(
+    encounter_ids: Optional[List[int]] = None,
+    key_types: Optional[List[str]] = None,
+) -> List[Dict[str, Any]]:
+    """Задачи популярности: по одной на подземелье и bracket (аргументы fetch_encounter_popularity)"""
+    jobs = []
+    for encounter_id in ENCOUNTERS.keys():
+        if encounter_ids and encounter_id not in encounter_ids:
+            continue
+        for key_type, query in (("low", QUERY_FOR_POPULARITY_LOW_KEYS), ("high", QUERY_FOR_POPULARITY_HIGH_KEYS)):
+            if key_types and key_type not in key_types:
+                continue
+            jobs.append({
+                "encounter_id": encounter_id,
+                "key_type": key_type,
+                "query": query,
+                "pages": WCL_PAGES_POPULARITY,
+                "popularity": True,
+            })
+    return jobs
+
+
+def build_jobs(
+    encounter_ids: Optional[List[int]] = None,
+    class_name: Optional[str] = None,
+    spec_name: Optional[str] = None,
+    key_types: Optional[List[str]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Построение списка задач сбора (по одной на leaderboard)
+
+    Без фильтров возвращает полный список задач, как для test_leaderboard.
+    Каждая задача - словарь с аргументами для fetch_single_spec_meta.
+
+    Args:
+        encounter_ids: Только эти encounter (M+ и/или рейд)
+        class_name: Только этот класс
+        spec_name: Только этот спек
+        key_types: Только эти типы ключа ("low", "high", "raid")
+    """
+    jobs = []
+
+    def specs_filtered():
+        for cls, specs in WOW_CLASS_SPECS.items():
+            if class_name and cls != class_name:
+                continue
+            for spec in specs:
+                if spec_name and spec != spec_name:
+                    continue
+                yield cls, spec
+
+    # M+ задачи
+    for encounter_id in ENCOUNTERS.keys():
+        if encounter_ids and encounter_id not in encounter_ids:
+            continue
+        for cls, spec in specs_filtered():
+            for key_type, query, pages in (
+                ("low", QUERY_FOR_MYTHIC_PLUS_LOW_KEYS, WCL_PAGES_MPLUS_LOW),
+                ("high", QUERY_FOR_MYTHIC_PLUS_HIGH_KEYS, WCL_PAGES_MPLUS_HIGH),
+            ):
+                if key_types and key_type not in key_types:
+                    continue
+                job = {
+                    "encounter_id": encounter_id,
+                    "class_name": cls,
+                    "spec_name": spec,
+                    "key_type": key_type,
+                    "query": query,
+                    "pages": pages,
+                }
+                meta_source = MPLUS_META_SOURCE.get(key_type, "rio")
+                if meta_source not in ("rio", "playerscore"):
+                    raise ValueError(f"Неизвестный источник меты M+ для ключей {key_type}: {meta_source} (ожидается rio или playerscore)")
+                if meta_source == "playerscore":
+                    job["metric"] = "playerscore"
+                jobs.append(job)
+
+    # RAID задачи: один запрос на босса и группу спеков одной роли (все спеки и сложности через алиасы)
+    difficulties = [RAID_DIFFICULTIES[name] for name in RAID_DIFFICULTIES_ENABLED]
+    if difficulties and (not key_types or "raid" in key_types):
         for raid_id in RAID.keys():
-            for class_name, specs in WOW_CLASS_SPECS.items():
-                for spec_name in specs:
-                    task_raid = fetch_single_spec_meta(
-                        client, token, raid_id, class_name, spec_name,
-                        is_raid=True
-                    )
-                    tasks.append(task_raid)
+            if encounter_ids and raid_id not in encounter_ids:
+                continue
+            specs_by_group: Dict[str, List[Tuple[str, str]]] = {}
+            for cls, spec in specs_filtered():
+                specs_by_group.setdefault(SPEC_ROLE_METRIC[spec][0], []).append((cls, spec))
+            for spec_group, specs in specs_by_group.items():
+                for start in range(0, len(specs), RAID_GROUP_MAX_SPECS):
+                    jobs.append({
+                        "encounter_id": raid_id,
+                        "spec_group": spec_group,
+                        "specs": specs[start:start + RAID_GROUP_MAX_SPECS],
+                        "difficulties": difficulties,
+                        "pages": WCL_PAGES_RAID,
+                        "raid_group": True,
+                    })
+
+    return jobs
+
+
+def build_score_engine(jobs: List[Dict[str, Any]], incremental: bool = False) -> Optional[ScoreEngine]:
+    """
+    Локальный расчет рейтинга M+ для прогона (RIO_SOURCE=local)
+
+    Рейтинг игрока - сумма лучших забегов по всем подземельям, поэтому локальный
+    расчет возможен, только если прогон скачивает leaderboard всех подземелий
+    за весь сезон. Иначе (инкрементальный сбор, точечное обновление части
+    подземелий) используется Raider.IO.
+    """
+    if RIO_SOURCE != "local":
+        return None
+
+    mplus_jobs = [job for job in jobs if not job.get("raid_group")]
+    if not mplus_jobs:
+        return None
+    if incremental:
+        logger.info("ℹ️ Инкрементальный сбор: рейтинг M+ берется из Raider.IO (локальному расчету нужны забеги за весь сезон)")
+        return None
+    missing = set(ENCOUNTERS) - {job["encounter_id"] for job in mplus_jobs}
+    if missing:
+        logger.info(f"ℹ️ Прогон не покрывает подземелья {sorted(missing)}: рейтинг M+ берется из Raider.IO")
+        return None
+
+    return ScoreEngine(expected_jobs=len(mplus_jobs))
+
+
+async def collect_compositions(
+    client: httpx.AsyncClient,
+    collector: Optional[CompositionCollector],
+    points_per_request: float,
+) -> List[Dict[str, Any]]:
+    """Строки report_compositions по боям прогона (ошибка анализа не роняет прогон)"""
+    if collector is None or not len(collector):
+        return []
+    try:
+        async with _wcl_pool.lease(COMPOSITION_MAX_REPORTS * points_per_request) as credential:
+            return await analyse_compositions(client, await get_access_token(credential), collector)
+    except Exception as e:
+        logger.error(f"❌ Ошибка анализа составов групп: {e}", exc_info=True)
+        return []
+
+
+async def collect_jobs(
+    jobs: List[Dict[str, Any]],
+    popularity_jobs: List[Dict[str, Any]],
+    loadout_jobs: List[Dict[str, Any]],
+    incremental: bool = False,
+    progress: Optional[RefreshProgress] = None,
+    run_id: Optional[str] = None,
+    shard: bool = False,
+) -> Dict[str, Any]:
+    """
+    Сбор по списку задач без записи в БД
+
+    Args:
+        run_id: Секция ranking_entries прогона (None - сырые записи leaderboard не собираются)
+        shard: Сбор в процессе шарда - составы групп не анализируются, а бои возвращаются
+            в composition_collector (участники боя могут найтись в разных шардах)
+
+    Returns:
+        Словарь результатов: valid_objects, popularity_rows, loadout_rows, composition_rows,
+        composition_collector (только для шарда), player_index, facts, failed, exceptions
+    """
+    # Оценка поинтов задачи для выбора клиента WarcraftLogs: страницы * поинтов на запрос по истории
+    points_per_request = cost_model(load_cost_history())["wcl_points_per_request"]
+
+    # Записи M+ leaderboard группируются по report/fight во время сбора
+    global _composition_collector, _score_engine, _player_index, _ranking_facts, _rio_store
+    _composition_collector = CompositionCollector() if COMPOSITION_ENABLED else None
+    _player_index = PlayerIndex() if PLAYER_INDEX_ENABLED else None
+    _ranking_facts = RankingFacts(run_id) if run_id else None
+
+    # Повтор из снимка не читает и не пишет общий кеш: ответы RIO берутся из снимка
+    _rio_store = create_rio_store(_rio_min_interval) if not snapshot.is_replaying() else None
+    _score_engine = build_score_engine(jobs, incremental)
+
+    # Задача выполняется целиком под одним клиентом WarcraftLogs - с наибольшим остатком поинтов
+    async def run_one(job: Dict[str, Any]) -> Optional[List[MetaBySpec]]:
+        try:
+            async with _wcl_pool.lease(job.get("pages", 1) * points_per_request) as credential:
+                token = await get_access_token(credential)
+                if job.get("raid_group"):
+                    result = await fetch_raid_group(client, token, **job)
+                else:
+                    meta_obj = await fetch_single_spec_meta(client, token, **job)
+                    result = [meta_obj] + meta_obj.regional if meta_obj is not None else None
+        finally:
+            # Задача, упавшая до получения leaderboard (токен, сеть), тоже отмечается -
+            # иначе остальные задачи ждали бы локальные рейтинги бесконечно
+            if _score_engine is not None and not job.get("raid_group"):
+                _score_engine.job_done(score_job_key(job["encounter_id"], job["class_name"], job["spec_name"], job["key_type"]))
+        if progress is not None:
+            progress.job_done(bool(result))
+        return result
+
+    async def run_popularity(job: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        async with _wcl_pool.lease(job.get("pages", 1) * points_per_request) as credential:
+            rows = await fetch_encounter_popularity(client, await get_access_token(credential), **job)
+        if progress is not None:
+            progress.job_done(rows is not None)
+        return rows
+
+    async def run_loadout(job: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        async with _wcl_pool.lease(job.get("pages", 1) * points_per_request) as credential:
+            rows = await fetch_spec_loadout(client, await get_access_token(credential), **job)
+        if progress is not None:
+            progress.job_done(rows is not None)
+        return rows
+
+    async with http_client(timeout=60) as client:
+        tasks = (
+            [run_one(job) for job in jobs]
+            + [run_popularity(job) for job in popularity_jobs]
+            + [run_loadout(job) for job in loadout_jobs]
+        )
 
         logger.info(f"Запускаем {len(tasks)} задач параллельно (с rate limiting)...")
 
@@ -714,12 +2380,21 @@ async def test_leaderboard():
 
         # Фильтруем успешные результаты
         valid_objects = []
+        popularity_rows = []
+        loadout_rows = []
         failed_count = 0
         exception_count = 0
 
-        for result in results:
-            if isinstance(result, MetaBySpec):
-                valid_objects.append(result)
+        # Результаты в порядке задач: мета, популярность, таланты и предметы
+        popularity_end = len(jobs) + len(popularity_jobs)
+        for index, result in enumerate(results):
+            if isinstance(result, list):
+                if index < len(jobs):
+                    valid_objects.extend(result)
+                elif index < popularity_end:
+                    popularity_rows.extend(result)
+                else:
+                    loadout_rows.extend(result)
             elif result is None:
                 failed_count += 1
             elif isinstance(result, Exception):
@@ -727,38 +2402,552 @@ async def test_leaderboard():
                 logger.error(f"Задача завершилась с исключением: {result}")
 
         logger.info(f"Результаты: {len(valid_objects)} успешных, {failed_count} без данных, {exception_count} ошибок")
+        score_engine, _score_engine = _score_engine, None
+        rio_store, _rio_store = _rio_store, None
+        if rio_store is not None:
+            await rio_store.close()
+
+        player_index, _player_index = _player_index, None
+        facts, _ranking_facts = _ranking_facts, None
+        if player_index is not None and score_engine is not None:
+            # Локальный рейтинг известен для всех игроков, а не только для опрошенных в выборке
+            for player in player_index.players:
+                rating = score_engine.get(player)
+                if rating is not None:
+                    player_index.set_rating(player, rating, "local")
+
+        composition_rows = []
+        collector, _composition_collector = _composition_collector, None
+        if not shard:
+            composition_rows = await collect_compositions(client, collector, points_per_request)
+
+    if len(_wcl_pool) > 1 or len(_rio_pool) > 1:
+        log_credential_usage()
+
+    # Статистика кеша RIO
+    cache_size = len(_rio_cache)
+    cache_with_scores = sum(1 for v in _rio_cache.values() if v is not None and v > 0)
+    cache_nulls = sum(1 for v in _rio_cache.values() if v is None)
+    cache_stats = _rio_cache.stats()
+    logger.info(
+        f"💾 Cache статистика: {cache_size}/{_rio_cache.maxsize} записей ({cache_with_scores} с RIO, {cache_nulls} без данных), "
+        f"попаданий {cache_stats['hits']}, промахов {cache_stats['misses']}, "
+        f"вытеснено {cache_stats['evictions']}, истекло {cache_stats['expirations']}"
+    )
+
+    return {
+        "valid_objects": valid_objects,
+        "popularity_rows": popularity_rows,
+        "loadout_rows": loadout_rows,
+        "composition_rows": composition_rows,
+        "composition_collector": collector if shard else None,
+        "player_index": player_index,
+        "facts": facts,
+        "failed": failed_count,
+        "exceptions": exception_count,
+    }
+
+
+def configure_shard(shard: int, shards: int, realm_catalog: Optional[RealmCatalog]) -> None:
+    """
+    Состояние процесса шарда: своя часть пулов учетных данных (или доля их лимитов)
+
+    Общий token bucket RIO в Redis (RIO_REDIS_URL) уже общий для всех процессов,
+    поэтому его скорость не делится.
+    """
+    global _wcl_pool, _rio_pool, _token_cache, _realm_catalog
+    clients, wcl_divisor = split_credentials(
+        [(credential.client_id, credential.client_secret) for credential in _wcl_pool.credentials], shard, shards
+    )
+    keys, rio_divisor = split_credentials(
+        [credential.api_key for credential in _rio_pool.credentials if credential.api_key], shard, shards
+    )
+    # Клиент, общий для нескольких шардов, дает каждому свою долю часового остатка поинтов
+    _wcl_pool = WclPool.from_clients(
+        clients, max(1, WCL_MAX_CONCURRENCY // wcl_divisor), limit_share=1 / wcl_divisor,
+        refresh=lambda: refresh_pool_rate_limits(), refresh_interval=WCL_RATE_LIMIT_REFRESH_SECONDS,
+    )
+    _rio_pool = RioPool.from_keys(keys, max(1, RIO_MAX_CONCURRENCY // rio_divisor), RIO_MIN_INTERVAL * rio_divisor)
+    _token_cache = TTLCache(maxsize=len(_wcl_pool), ttl=82800 - 3600)
+    _realm_catalog = realm_catalog
+
+    # Строки лога шарда отличаются от строк основного процесса (время и уровень добавляют обработчики основного)
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, QueueHandler):
+            handler.setFormatter(logging.Formatter(f'[шард {shard + 1}/{shards}] %(message)s'))
+
+
+def init_shard_logging(log_queue: Any) -> None:
+    """
+    Логирование процесса шарда: записи уходят в очередь основного процесса
+
+    Шард не открывает файл лога - в консоль и wow_aggregator.log пишут
+    обработчики основного процесса (QueueListener в collect_sharded), поэтому
+    ротация файла не конкурирует между процессами.
+    """
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(logging.INFO)
+
+
+def collect_shard(
+    shard: int,
+    shards: int,
+    jobs: List[Dict[str, Any]],
+    popularity_jobs: List[Dict[str, Any]],
+    loadout_jobs: List[Dict[str, Any]],
+    incremental: bool,
+    run_id: Optional[str],
+    realm_catalog: Optional[RealmCatalog],
+) -> Dict[str, Any]:
+    """Точка входа процесса шарда: результаты collect_jobs и прирост счетчиков _stats"""
+    configure_shard(shard, shards, realm_catalog)
+    stats_before = dict(_stats)
+    # Шард не обращается к БД: составы групп анализирует основной процесс по боям всех шардов
+    collected = asyncio.run(collect_jobs(jobs, popularity_jobs, loadout_jobs, incremental, run_id=run_id, shard=True))
+    collected["stats"] = {key: _stats[key] - stats_before[key] for key in _stats}
+    return collected
+
+
+async def collect_sharded(
+    shards: int,
+    jobs: List[Dict[str, Any]],
+    popularity_jobs: List[Dict[str, Any]],
+    loadout_jobs: List[Dict[str, Any]],
+    incremental: bool = False,
+    run_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Сбор по шардам в пуле процессов и объединение результатов
+
+    Счетчики шардов добавляются в _stats основного процесса. Шард, процесс
+    которого упал, считается ошибкой всех его задач.
+    """
+    job_shards = split_jobs(jobs, shards)
+    popularity_shards = split_jobs(popularity_jobs, shards)
+    loadout_shards = split_jobs(loadout_jobs, shards)
+    logger.info(
+        f"🧩 Сбор в {shards} процессах: задач по шардам "
+        f"{[len(a) + len(b) + len(c) for a, b, c in zip(job_shards, popularity_shards, loadout_shards)]}"
+    )
+
+    loop = asyncio.get_running_loop()
+    # spawn: процесс шарда не наследует event loop, соединения и блокировки основного процесса
+    context = multiprocessing.get_context("spawn")
+    # Записи лога шардов пишут обработчики основного процесса
+    log_queue = context.Queue()
+    listener = QueueListener(log_queue, *logging.getLogger().handlers, respect_handler_level=True)
+    listener.start()
+    try:
+        with ProcessPoolExecutor(
+            max_workers=shards, mp_context=context, initializer=init_shard_logging, initargs=(log_queue,)
+        ) as pool:
+            results = await asyncio.gather(
+                *(
+                    loop.run_in_executor(
+                        pool, collect_shard, shard, shards, job_shards[shard], popularity_shards[shard],
+                        loadout_shards[shard], incremental, run_id, _realm_catalog,
+                    )
+                    for shard in range(shards)
+                ),
+                return_exceptions=True,
+            )
+    finally:
+        # Дописывает записи, оставшиеся в очереди
+        listener.stop()
+
+    merged: Dict[str, Any] = {
+        "valid_objects": [],
+        "popularity_rows": [],
+        "loadout_rows": [],
+        "composition_rows": [],
+        "player_index": PlayerIndex() if PLAYER_INDEX_ENABLED else None,
+        "facts": RankingFacts(run_id) if run_id else None,
+        "failed": 0,
+        "exceptions": 0,
+    }
+    collector = CompositionCollector() if COMPOSITION_ENABLED else None
+    for shard, result in enumerate(results):
+        if isinstance(result, BaseException):
+            logger.error(f"❌ Шард {shard + 1}/{shards} завершился с ошибкой: {result}")
+            merged["exceptions"] += len(job_shards[shard]) + len(popularity_shards[shard]) + len(loadout_shards[shard])
+            continue
+        for key in ("valid_objects", "popularity_rows", "loadout_rows"):
+            merged[key].extend(result[key])
+        for key in ("failed", "exceptions"):
+            merged[key] += result[key]
+        for key, delta in result["stats"].items():
+            _stats[key] += delta
+        if merged["player_index"] is not None and result["player_index"] is not None:
+            merged["player_index"].merge(result["player_index"])
+        if merged["facts"] is not None and result["facts"] is not None:
+            merged["facts"].merge(result["facts"])
+        if collector is not None and result["composition_collector"] is not None:
+            collector.merge(result["composition_collector"])
+
+    logger.info(
+        f"Результаты шардов: {len(merged['valid_objects'])} успешных, "
+        f"{merged['failed']} без данных, {merged['exceptions']} ошибок"
+    )
+
+    # Составы анализируются один раз по боям всех шардов: бюджет COMPOSITION_MAX_REPORTS - на прогон
+    points_per_request = cost_model(load_cost_history())["wcl_points_per_request"]
+    async with http_client(timeout=60) as client:
+        merged["composition_rows"] = await collect_compositions(client, collector, points_per_request)
+    return merged
+
+
+def replay_dry_run() -> bool:
+    """Повтор снимка без --write: БД не меняется (ни схема, ни данные)"""
+    return snapshot.is_replaying() and not _replay_write
+
+
+def save_replay_results(
+    valid_objects: List[MetaBySpec],
+    popularity_rows: List[Dict[str, Any]],
+    loadout_rows: List[Dict[str, Any]],
+    composition_rows: List[Dict[str, Any]],
+    player_index: Optional[PlayerIndex],
+    facts: Optional[RankingFacts],
+) -> None:
+    """
+    Результаты повтора вместо записи в БД
+
+    Мета - значения прогона из Python: ranking_entries в БД не загружаются,
+    поэтому мета из SQL (DERIVE_META_SQL) не пересчитывается.
+    """
+    players, best_keys = player_index.rows(datetime.now(timezone.utc)) if player_index is not None else ([], [])
+    path = snapshot.write_replay_results({
+        "run_id": snapshot.current_run_id(),
+        "meta_by_spec": [meta_row(obj) for obj in valid_objects],
+        "spec_popularity": popularity_rows,
+        "loadout_popularity": loadout_rows,
+        "report_compositions": composition_rows,
+        "players": players,
+        "player_best_keys": best_keys,
+        "ranking_entries": len(facts) if facts is not None else 0,
+    })
+    logger.info(
+        f"🧪 Повтор без записи в БД (--write не указан): {len(valid_objects)} строк меты, "
+        f"{len(popularity_rows)} популярности, {len(loadout_rows)} талантов и предметов, "
+        f"{len(composition_rows)} составов, {len(players)} игроков -> {path}"
+    )
+
+
+def shard_count(
+    workers: int,
+    jobs: List[Dict[str, Any]],
+    popularity_jobs: List[Dict[str, Any]],
+    loadout_jobs: List[Dict[str, Any]],
+    incremental: bool,
+) -> int:
+    """Число шардов прогона (1 - сбор в основном процессе)"""
+    groups = max(shard_groups(jobs), shard_groups(popularity_jobs), shard_groups(loadout_jobs))
+    if workers <= 1 or groups <= 1:
+        return 1
+    # Снимок пишется и читается одним процессом по порядку запросов
+    if SNAPSHOT_ENABLED or snapshot.is_replaying():
+        logger.info("ℹ️ Снимок ответов: сбор в одном процессе")
+        return 1
+    # Локальному рейтингу M+ нужны leaderboard всех подземелий в одном процессе
+    if RIO_SOURCE == "local" and build_score_engine(jobs, incremental) is not None:
+        logger.info("ℹ️ Локальный рейтинг M+ (RIO_SOURCE=local): сбор в одном процессе")
+        return 1
+    # Без общего кеша и лимита в Redis каждый шард запрашивал бы RIO одних и тех же игроков
+    # и держал бы свой интервал Raider.IO
+    if not RIO_REDIS_URL:
+        logger.warning("⚠️ --workers без RIO_REDIS_URL: сбор в одном процессе")
+        return 1
+    return min(workers, groups)
+
+
+async def run_jobs(
+    jobs: List[Dict[str, Any]],
+    leader: Optional[LeaderLock] = None,
+    progress: Optional[RefreshProgress] = None,
+    popularity_jobs: Optional[List[Dict[str, Any]]] = None,
+    incremental: bool = False,
+    loadout_jobs: Optional[List[Dict[str, Any]]] = None,
+    workers: int = 1,
+    partial: bool = False,
+) -> List[MetaBySpec]:
+    """
+    Выполнение списка задач сбора и сохранение результатов в БД
+
+    Args:
+        jobs: Задачи из build_jobs
+        popularity_jobs: Задачи из build_popularity_jobs
+        loadout_jobs: Задачи из build_loadout_jobs
+        incremental: Результаты - рейтинги за сегодня: сохраняются как статистики дня,
+            а мета пересчитывается по окну INCREMENTAL_WINDOW_DAYS дней
+        leader: Удерживаемый advisory lock (если передан, запись в БД выполняется только пока lock наш)
+        progress: Трекер прогресса (для точечного обновления)
+        workers: Процессов сбора (больше 1 - задачи делятся на шарды, в БД пишет только этот процесс)
+        partial: Точечное обновление - секция ranking_entries помечается PARTIAL_RUN_SUFFIX
+            и не вытесняет полные прогоны из RANKING_FACTS_KEEP_RUNS
+    """
+    try:
+        # Токены всех клиентов пула WarcraftLogs
+        for credential in _wcl_pool.credentials:
+            await get_access_token(credential)
+    except Exception as e:
+        logger.error(f"❌ Не удалось получить access token: {e}")
+        if progress is not None:
+            progress.fail(f"Не удалось получить access token: {e}")
+        return []
+
+    popularity_jobs = popularity_jobs or []
+    loadout_jobs = loadout_jobs or []
 
-        # Статистика кеша RIO
-        cache_size = len(_rio_cache)
-        cache_with_scores = sum(1 for v in _rio_cache.values() if v is not None and v > 0)
-        cache_nulls = sum(1 for v in _rio_cache.values() if v is None)
-        logger.info(f"💾 Cache статистика: {cache_size} записей ({cache_with_scores} с RIO, {cache_nulls} без данных)")
-
-        # Батчинг для записи в БД
-        if valid_objects:
-            batch_size = 50
-            total_batches = (len(valid_objects) + batch_size - 1) // batch_size
-            logger.info(f"Сохранение в БД: {len(valid_objects)} записей в {total_batches} батчах...")
-
-            for i in range(0, len(valid_objects), batch_size):
-                batch = valid_objects[i:i + batch_size]
-                try:
-                    await batch_add_meta_by_spec(batch)
-                    logger.info(f"✅ Batch {i//batch_size + 1}/{total_batches}: сохранено {len(batch)} записей")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка сохранения batch {i//batch_size + 1}: {e}")
-
-        logger.info("=" * 80)
-        logger.info(f"ЗАВЕРШЕНО: Всего сохранено {len(valid_objects)} из {len(tasks)} записей")
-        logger.info("=" * 80)
+    global _realm_catalog
+    # Секция ranking_entries прогона: run_id снимка, если он записывается или повторяется
+    # (повтор перезаписывает секцию записанного прогона), иначе новый
+    run_id = None
+    if RANKING_FACTS_ENABLED and not incremental:
+        if snapshot.current_run_id():
+            run_id = snapshot.current_run_id() + (PARTIAL_RUN_SUFFIX if partial else "")
+        else:
+            run_id = await new_ranking_run_id(partial)
+    if _realm_catalog is None or _realm_catalog.is_stale(timedelta(days=REALM_CATALOG_MAX_AGE_DAYS)):
+        _realm_catalog = await load_realm_catalog() or _realm_catalog
+
+    if progress is not None:
+        progress.start(len(jobs) + len(popularity_jobs) + len(loadout_jobs))
+
+    # Замеры для истории стоимости (используется --plan)
+    run_start = time.perf_counter()
+    stats_before = dict(_stats)
+    rate_before = await refresh_pool_rate_limits()
+    if len(_wcl_pool) > 1 or len(_rio_pool) > 1:
+        logger.info(f"🔑 Пулы учетных данных: WarcraftLogs {len(_wcl_pool)}, Raider.IO {len(_rio_pool)}")
+
+    tasks_count = len(jobs) + len(popularity_jobs) + len(loadout_jobs)
+    shards = shard_count(workers, jobs, popularity_jobs, loadout_jobs, incremental)
+    if shards > 1:
+        collected = await collect_sharded(shards, jobs, popularity_jobs, loadout_jobs, incremental, run_id)
+    else:
+        collected = await collect_jobs(jobs, popularity_jobs, loadout_jobs, incremental, progress, run_id)
+
+    valid_objects = collected["valid_objects"]
+    popularity_rows = collected["popularity_rows"]
+    loadout_rows = collected["loadout_rows"]
+    composition_rows = collected["composition_rows"]
+    player_index = collected["player_index"]
+    facts = collected["facts"]
+
+    rate_after = await refresh_pool_rate_limits()
+    points_spent = None
+    if rate_before and rate_after:
+        spent = rate_after.get("pointsSpentThisHour", 0) - rate_before.get("pointsSpentThisHour", 0)
+        # Отрицательная разница - часовой счетчик сбросился во время прогона, замер невалиден
+        if spent >= 0:
+            points_spent = spent
+    # Повтор из снимка не отражает реальную стоимость прогона
+    if not snapshot.is_replaying():
+        record_run_costs(
+            jobs + popularity_jobs + loadout_jobs,
+            {key: _stats[key] - stats_before.get(key, 0) for key in _stats},
+            points_spent,
+            (rate_after or rate_before or {}).get("limitPerHour"),
+            time.perf_counter() - run_start,
+        )
+
+    if replay_dry_run():
+        save_replay_results(valid_objects, popularity_rows, loadout_rows, composition_rows, player_index, facts)
+        if progress is not None:
+            progress.finish(0)
+        return valid_objects
 
+    # Если lock потерян, другой экземпляр мог начать писать те же строки
+    if leader is not None and leader.lost:
+        logger.error("❌ Advisory lock потерян во время сбора, результаты не сохраняются в БД")
+        if progress is not None:
+            progress.fail("Advisory lock потерян во время сбора")
         return valid_objects
 
+    # Гистограммы за один день не заменяют гистограммы полного прогона
+    save_buckets = not incremental
+    if incremental and valid_objects:
+        today = datetime.now(timezone.utc).date()
+        try:
+            await batch_upsert_running_stats(valid_objects, today)
+            valid_objects = await load_running_meta(
+                valid_objects, today - timedelta(days=INCREMENTAL_WINDOW_DAYS - 1)
+            )
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения статистик за день: {e}")
+            valid_objects = []
+
+    # Мета из ranking_entries считается в PostgreSQL; при ошибке - значения прогона из Python
+    saved_count = 0
+    if facts is not None and len(facts) and valid_objects:
+        try:
+            await batch_load_ranking_entries(facts)
+            saved_count = await derive_meta_from_facts(facts.run_id)
+        except Exception as e:
+            logger.error(f"❌ Ошибка меты из ranking_entries, сохраняются значения прогона: {e}")
+            saved_count = 0
+        try:
+            await prune_ranking_partitions(RANKING_FACTS_KEEP_RUNS)
+        except Exception as e:
+            logger.error(f"❌ Ошибка удаления старых секций ranking_entries: {e}")
+
+    # Батчинг для записи в БД
+    if valid_objects and not saved_count:
+        batch_size = 50
+        total_batches = (len(valid_objects) + batch_size - 1) // batch_size
+        logger.info(f"Сохранение в БД: {len(valid_objects)} записей в {total_batches} батчах...")
+
+        for i in range(0, len(valid_objects), batch_size):
+            batch = valid_objects[i:i + batch_size]
+            try:
+                await batch_add_meta_by_spec(batch)
+                saved_count += len(batch)
+                logger.info(f"✅ Batch {i//batch_size + 1}/{total_batches}: сохранено {len(batch)} записей")
+            except Exception as e:
+                logger.error(f"❌ Ошибка сохранения batch {i//batch_size + 1}: {e}")
+
+    if saved_count and save_buckets:
+        try:
+            await batch_replace_meta_buckets(valid_objects)
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения гистограмм: {e}")
+
+    if popularity_rows:
+        try:
+            await batch_add_spec_popularity(popularity_rows)
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения популярности: {e}")
+
+    if loadout_rows:
+        try:
+            await batch_replace_loadout_popularity(loadout_rows)
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения талантов и предметов: {e}")
+
+    if composition_rows:
+        try:
+            await batch_add_report_compositions(composition_rows)
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения составов групп: {e}")
+
+    if player_index is not None and len(player_index):
+        try:
+            await batch_upsert_players(player_index)
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения индекса игроков: {e}")
+
+    if progress is not None:
+        progress.finish(saved_count)
+
+    logger.info("=" * 80)
+    logger.info(f"ЗАВЕРШЕНО: Всего сохранено {len(valid_objects)} записей по {tasks_count} задачам")
+    logger.info("=" * 80)
+
+    return valid_objects
+
 
-async def main():
+async def test_leaderboard(leader: Optional[LeaderLock] = None, workers: int = 1):
+    """
+    Основная функция сбора данных - ОПТИМИЗИРОВАННАЯ с поддержкой LOW/HIGH keys и RAID
+
+    Args:
+        leader: Удерживаемый advisory lock (если передан, запись в БД выполняется только пока lock наш)
+        workers: Процессов сбора (шарды задач)
+    """
+    logger.info("=" * 80)
+    logger.info("НАЧАЛО СБОРА ДАННЫХ WOW META")
+    logger.info("=" * 80)
+
+    logger.info(f"Обработка {len(ENCOUNTERS)} подземелий и {len(RAID)} рейд боссов...")
+
+    return await run_jobs(
+        build_jobs(), leader=leader, popularity_jobs=build_popularity_jobs(),
+        loadout_jobs=build_loadout_jobs() if LOADOUT_ENABLED else None, workers=workers,
+    )
+
+
+async def run_incremental(leader: Optional[LeaderLock] = None, workers: int = 1):
+    """
+    Инкрементальный сбор M+: только рейтинги за сегодня (timeframe: Today)
+
+    Рейды и популярность не обновляются - они собираются полным прогоном.
+    """
+    jobs = [dict(job, timeframe="Today") for job in build_jobs(key_types=["low", "high"])]
+    logger.info(f"📅 Инкрементальный сбор: {len(jobs)} задач, окно {INCREMENTAL_WINDOW_DAYS} дней")
+    return await run_jobs(jobs, leader=leader, incremental=True, workers=workers)
+
+
+async def refresh_targeted(
+    encounter_ids: Optional[List[int]] = None,
+    class_name: Optional[str] = None,
+    spec_name: Optional[str] = None,
+    key_types: Optional[List[str]] = None,
+    progress: Optional[RefreshProgress] = None,
+) -> List[MetaBySpec]:
+    """
+    Точечное обновление меты для выбранных encounter / класса / спека / типа ключа
+
+    Выполняется под тем же advisory lock что и полный сбор, чтобы не конкурировать
+    с ним за квоту WCL/RIO и ON CONFLICT upsert.
+    """
+    try:
+        jobs = build_jobs(encounter_ids, class_name, spec_name, key_types)
+        # Популярность считается по всему encounter, при фильтре по спеку ее не пересчитываем
+        popularity_jobs = [] if class_name or spec_name else build_popularity_jobs(encounter_ids, key_types)
+        # Таланты и предметы - по спеку на подземелье M+, от типа ключа не зависят
+        loadout_jobs = []
+        if LOADOUT_ENABLED and (not key_types or "low" in key_types or "high" in key_types):
+            loadout_jobs = build_loadout_jobs(encounter_ids, class_name, spec_name)
+        logger.info(
+            f"🎯 Точечное обновление: {len(jobs)} задач "
+            f"(encounters={encounter_ids or 'все'}, класс={class_name or 'все'}, "
+            f"спек={spec_name or 'все'}, ключи={key_types or 'все'})"
+        )
+
+        if not jobs and not popularity_jobs and not loadout_jobs:
+            logger.warning("Под фильтры не попала ни одна задача")
+            if progress is not None:
+                progress.start(0)
+                progress.finish(0)
+            return []
+
+        async with aggregator_leader_lock() as leader:
+            if leader is None:
+                if progress is not None:
+                    progress.fail("Агрегатор уже запущен другим экземпляром")
+                return []
+            return await run_jobs(
+                jobs, leader=leader, progress=progress,
+                popularity_jobs=popularity_jobs, loadout_jobs=loadout_jobs, partial=True,
+            )
+    except Exception as e:
+        # Фоновая задача API: без этого задача осталась бы в статусе running
+        if progress is not None and progress.status not in ("done", "failed"):
+            progress.fail(str(e))
+        raise
+
+
+async def main(incremental: bool = False, workers: int = AGGREGATOR_WORKERS):
     try:
+        if replay_dry_run():
+            # Повтор без --write: ни схема, ни advisory lock рабочей БД не нужны
+            if incremental:
+                await run_incremental(workers=workers)
+            else:
+                await test_leaderboard(workers=workers)
+            return
         await init_models()
-        await test_leaderboard()
+        # Только один экземпляр агрегатора может работать одновременно
+        async with aggregator_leader_lock() as leader:
+            if leader is None:
+                return
+            if incremental:
+                await run_incremental(leader=leader, workers=workers)
+            else:
+                await test_leaderboard(leader=leader, workers=workers)
         # await balance()
     except KeyboardInterrupt:
         logger.info("Прервано пользователем")
@@ -767,10 +2956,123 @@ async def main():
         raise
 
 
-import time
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Аргументы командной строки агрегатора"""
+    # --plan доступен и до, и после подкоманды
+    plan_parent = argparse.ArgumentParser(add_help=False)
+    plan_parent.add_argument("--plan", action="store_true", default=argparse.SUPPRESS,
+                             help="Только оценить стоимость прогона (запросы, поинты WCL, время) без сетевых запросов")
+    plan_parent.add_argument("--replay", metavar="RUN_ID", default=argparse.SUPPRESS,
+                             help="Повторить прогон по снимку ответов snapshots/RUN_ID без сетевых запросов; "
+                                  "результаты пишутся в snapshots/RUN_ID/replay-*.json, БД не меняется")
+    plan_parent.add_argument("--write", action="store_true", default=argparse.SUPPRESS,
+                             help="С --replay: записать результаты повтора в БД DATABASE_URL "
+                                  "(только для отдельной базы - старый снимок перезапишет текущую мету)")
+
+    # --workers - для полного и инкрементального сбора
+    workers_parent = argparse.ArgumentParser(add_help=False)
+    workers_parent.add_argument("--workers", type=int, default=argparse.SUPPRESS,
+                                help="Процессов сбора: задачи делятся на шарды по спекам, лимиты API - между ними; "
+                                     "нужен RIO_REDIS_URL, иначе сбор в одном процессе "
+                                     f"(по умолчанию AGGREGATOR_WORKERS={AGGREGATOR_WORKERS})")
+
+    parser = argparse.ArgumentParser(description="Сбор WoW meta из WarcraftLogs и Raider.IO",
+                                     parents=[plan_parent, workers_parent])
+    subparsers = parser.add_subparsers(dest="command")
+
+    subparsers.add_parser("run", help="Полный сбор данных (по умолчанию)", parents=[plan_parent, workers_parent])
+    subparsers.add_parser("incremental", help="Сбор M+ рейтингов за сегодня с пересчетом меты по окну дней",
+                          parents=[plan_parent, workers_parent])
+
+    refresh = subparsers.add_parser("refresh", help="Точечное обновление encounter / спека / типа ключа",
+                                    parents=[plan_parent])
+    refresh.add_argument("--encounter", type=int, action="append", dest="encounter_ids",
+                         help="Encounter ID (можно указать несколько раз)")
+    refresh.add_argument("--class", dest="class_name", help="Класс, например Mage")
+    refresh.add_argument("--spec", dest="spec_name", help="Спек, например Fire")
+    refresh.add_argument("--key", action="append", dest="key_types", choices=["low", "high", "raid"],
+                         help="Тип ключа (можно указать несколько раз)")
+
+    args = parser.parse_args(argv)
+    args.plan = getattr(args, "plan", False)
+    args.replay = getattr(args, "replay", None)
+    args.write = getattr(args, "write", False)
+    if args.write and not args.replay:
+        parser.error("--write используется только с --replay")
+    args.workers = getattr(args, "workers", AGGREGATOR_WORKERS)
+    if args.workers < 1:
+        parser.error(f"--workers должно быть не меньше 1: {args.workers}")
+
+    if args.command == "refresh":
+        try:
+            validate_refresh_filters(args.encounter_ids, args.class_name, args.spec_name, args.key_types)
+        except ValueError as e:
+            parser.error(str(e))
+
+    return args
+
+
+async def refresh_main(args: argparse.Namespace):
+    progress = RefreshProgress({
+        "encounter_ids": args.encounter_ids,
+        "class_name": args.class_name,
+        "spec_name": args.spec_name,
+        "key_types": args.key_types,
+    })
+    try:
+        if not replay_dry_run():
+            await init_models()
+        await refresh_targeted(
+            args.encounter_ids, args.class_name, args.spec_name, args.key_types,
+            progress=progress
+        )
+    except KeyboardInterrupt:
+        logger.info("Прервано пользователем")
+
+
 if __name__ == "__main__":
+    setup_logging()
+    args = parse_args()
     start = time.perf_counter()
-    asyncio.run(main())
-    asyncio.run(balance())
+    if args.plan:
+        if args.command == "refresh":
+            plan_jobs = build_jobs(args.encounter_ids, args.class_name, args.spec_name, args.key_types)
+            if not args.class_name and not args.spec_name:
+                plan_jobs += build_popularity_jobs(args.encounter_ids, args.key_types)
+            if LOADOUT_ENABLED and (not args.key_types or "low" in args.key_types or "high" in args.key_types):
+                plan_jobs += build_loadout_jobs(args.encounter_ids, args.class_name, args.spec_name)
+        elif args.command == "incremental":
+            plan_jobs = build_jobs(key_types=["low", "high"])
+        else:
+            plan_jobs = build_jobs() + build_popularity_jobs()
+            if LOADOUT_ENABLED:
+                plan_jobs += build_loadout_jobs()
+        log_plan(plan_run(plan_jobs))
+    else:
+        command = " ".join(sys.argv[1:]) or "run"
+        if args.replay:
+            reader = snapshot.start_replay(args.replay)
+            recorded = reader.manifest.get("command")
+            if recorded and recorded.split()[0:1] != (args.command or "run").split()[0:1]:
+                logger.warning(f"⚠️ Снимок {args.replay} записан командой '{recorded}', повтор - '{args.command or 'run'}'")
+            if args.write:
+                logger.warning(f"⚠️ Повтор {args.replay} с --write: результаты старого снимка будут записаны в БД")
+            _replay_write = args.write
+            # Ответы отдаются с диска: интервал Raider.IO не нужен
+            _rio_min_interval = 0.0
+            _rio_pool = RioPool.from_keys(RIO_API_KEYS, RIO_MAX_CONCURRENCY, 0.0)
+        elif SNAPSHOT_ENABLED:
+            # Выборка RIO каждого leaderboard засеяна run_id (sample_rng) - при повторе выбираются те же игроки
+            snapshot.start_recording(command)
+        try:
+            if args.command == "refresh":
+                asyncio.run(refresh_main(args))
+            elif args.command == "incremental":
+                asyncio.run(main(incremental=True, workers=args.workers))
+            else:
+                asyncio.run(main(workers=args.workers))
+                asyncio.run(balance())
+        finally:
+            snapshot.stop()
     end = time.perf_counter()
     logger.info(f"⏱️  Общее время выполнения: {end - start:.2f} сек")
@@ -0,0 +1,66 @@
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.model import ReportComposition
+from app.schemas.composition_schema import CompositionResponse
+from app.agregator.composition import parse_composition
+from typing import Optional
+
+
+async def get_compositions(
+    session: AsyncSession,
+    encounter_id: Optional[int] = None,
+    min_key: Optional[int] = None,
+    max_key: Optional[int] = None,
+    limit: int = 20,
+) -> list[CompositionResponse]:
+    """
+    Получить самые частые составы групп (tank / healer / dps)
+
+    Забеги группируются по составу в PostgreSQL, доля считается от всех
+    забегов с известным составом в выбранном подземелье и диапазоне ключей.
+
+    Args:
+        session: AsyncSession
+        encounter_id: ID подземелья (если не указан - все подземелья)
+        min_key: Минимальный уровень ключа (включительно)
+        max_key: Максимальный уровень ключа (включительно)
+        limit: Сколько составов вернуть
+    """
+    runs = func.count()
+
+    stmt = (
+        select(
+            ReportComposition.composition,
+            runs.label('runs'),
+            (runs * 1.0 / func.sum(runs).over()).label('share'),
+            func.rank().over(order_by=runs.desc()).label('rank'),
+        )
+        # Пустой состав - бои, для которых отчет не удалось получить
+        .where(ReportComposition.composition != "")
+        .group_by(ReportComposition.composition)
+        .order_by(runs.desc(), ReportComposition.composition)
+        .limit(limit)
+    )
+    if encounter_id is not None:
+        stmt = stmt.where(ReportComposition.encounter_id == encounter_id)
+    if min_key is not None:
+        stmt = stmt.where(ReportComposition.key_level >= min_key)
+    if max_key is not None:
+        stmt = stmt.where(ReportComposition.key_level <= max_key)
+
+    result = await session.execute(stmt)
+    responses = []
+    for row in result.all():
+        roles = parse_composition(row.composition)
+        responses.append(
+            CompositionResponse(
+                encounter_id=encounter_id,
+                tanks=roles["tank"],
+                healers=roles["healer"],
+                dps=roles["dps"],
+                runs=int(row.runs),
+                share=float(row.share or 0.0),
+                rank=row.rank,
+            )
+        )
+    return responses
@@ -0,0 +1,83 @@
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.model import LoadoutPopularity
+from app.schemas.loadout_schema import LoadoutPopularityResponse
+from typing import Optional
+
+
+async def get_loadout(
+    session: AsyncSession,
+    class_name: str,
+    spec: str,
+    kind: str,
+    encounter_id: Optional[int] = None,
+    limit: int = 20,
+) -> list[LoadoutPopularityResponse]:
+    """
+    Получить самые популярные таланты или предметы спека
+
+    Игроки и размер выборки суммируются по выбранным encounter, доля и место
+    пересчитываются в PostgreSQL. В сумме по подземельям учитываются только
+    сохраненные top-K записи каждого подземелья.
+
+    Args:
+        session: AsyncSession
+        class_name: Класс
+        spec: Спек
+        kind: "talent" или "item"
+        encounter_id: ID подземелья (если не указан - сумма по всем подземельям)
+        limit: Сколько записей вернуть
+    """
+    players = func.sum(LoadoutPopularity.players)
+
+    # Размер выборки спека по подземельям (одинаков у всех строк спека на encounter)
+    samples = (
+        select(
+            LoadoutPopularity.encounter_id,
+            func.max(LoadoutPopularity.sample_players).label('sample_players'),
+        )
+        .where(
+            LoadoutPopularity.class_name == class_name,
+            LoadoutPopularity.spec == spec,
+            LoadoutPopularity.kind == kind,
+        )
+        .group_by(LoadoutPopularity.encounter_id)
+    )
+    if encounter_id is not None:
+        samples = samples.where(LoadoutPopularity.encounter_id == encounter_id)
+    samples = samples.subquery()
+    sample_total = select(func.sum(samples.c.sample_players)).scalar_subquery()
+
+    stmt = (
+        select(
+            LoadoutPopularity.entity_id,
+            players.label('players'),
+            (players * 1.0 / func.nullif(sample_total, 0)).label('share'),
+            func.rank().over(order_by=players.desc()).label('rank'),
+        )
+        .where(
+            LoadoutPopularity.class_name == class_name,
+            LoadoutPopularity.spec == spec,
+            LoadoutPopularity.kind == kind,
+        )
+        .group_by(LoadoutPopularity.entity_id)
+        .order_by(players.desc(), LoadoutPopularity.entity_id)
+        .limit(limit)
+    )
+    if encounter_id is not None:
+        stmt = stmt.where(LoadoutPopularity.encounter_id == encounter_id)
+
+    result = await session.execute(stmt)
+    return [
+        LoadoutPopularityResponse(
+            class_name=class_name,
+            spec=spec,
+            encounter_id=encounter_id,
+            kind=kind,
+            entity_id=row.entity_id,
+            players=int(row.players or 0),
+            share=float(row.share or 0.0),
+            rank=row.rank,
+        )
+        for row in result.all()
+    ]
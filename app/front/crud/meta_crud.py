@@ -1,15 +1,49 @@
 from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.models.model import MetaBySpec
+from app.models.model import MetaBySpec, MetaBucket
 from app.schemas.meta_schema import MetaBySpecMythicPlusResponse, MetaBySpecRaidResponse
-from typing import Union
+from app.agregator.constant import RAID_DIFFICULTIES, META_SOURCES
+from app.agregator.robust_stats import STAT_FIELDS
+from typing import Union, Optional
+
+
+async def resolve_source(session: AsyncSession, conditions: list, source: Optional[str] = None, column=MetaBySpec.source) -> Optional[str]:
+    """
+    Источник meta для ответа: заданный или первый по приоритету META_SOURCES среди строк
+
+    Рейтинг, очки забегов и DPS - разные шкалы, поэтому в один ответ (и в одно
+    среднее) попадают строки только одного источника. column - колонка source
+    таблицы, по которой строится ответ (MetaBySpec или MetaBucket).
+    """
+    if source is not None:
+        return source
+    result = await session.execute(select(column).where(*conditions).distinct())
+    present = set(result.scalars().all())
+    return next((name for name in META_SOURCES if name in present), None)
+
+
+def quality_filters(min_samples: Optional[int] = None, min_confidence: Optional[float] = None) -> list:
+    """Условия WHERE по размеру выборки и уверенности (индекс ix_meta_by_spec_lookup_quality)"""
+    conditions = []
+    if min_samples is not None:
+        conditions.append(MetaBySpec.sample_size >= min_samples)
+    if min_confidence is not None:
+        conditions.append(MetaBySpec.confidence >= min_confidence)
+    return conditions
+
 
 async def get_meta_by_encounter(
     session: AsyncSession,
     encounter_id: int,
     spec_type: str,
     key_type: str = "all",
-    is_raid: bool = False
+    is_raid: bool = False,
+    difficulty: str = "mythic",
+    region: str = "all",
+    min_samples: Optional[int] = None,
+    min_confidence: Optional[float] = None,
+    timeframe: str = "season",
+    source: Optional[str] = None
 ) -> Union[list[MetaBySpecMythicPlusResponse], list[MetaBySpecRaidResponse]]:
     """
     Получить мету по конкретному encounter
@@ -20,16 +54,30 @@ async def get_meta_by_encounter(
         spec_type: Тип спека (dps/tank/healer)
         key_type: Тип ключа ("all", "low" или "high", по умолчанию "all", игнорируется для рейдов)
         is_raid: Является ли encounter рейдом
+        difficulty: Сложность рейда ("heroic" или "mythic", игнорируется для M+)
+        region: Регион игроков ("eu", "us", "kr", "tw" или "all" - все регионы)
+        min_samples: Минимальный размер выборки meta
+        min_confidence: Минимальная уверенность meta (0.98 = интервал не шире ±2%)
+        timeframe: Период меты ("season" - полный прогон, "recent" - окно инкрементального сбора M+)
+        source: Источник meta (по умолчанию - первый по приоритету META_SOURCES из имеющихся)
     """
+    quality = quality_filters(min_samples, min_confidence)
     if is_raid:
-        # Для рейдов key='raid'
+        # Для рейдов key='raid'; источник задан ролью спека (HPS для хилов, DPS для остальных)
+        conditions = [
+            MetaBySpec.encounter_id == encounter_id,
+            MetaBySpec.spec_type == spec_type,
+            MetaBySpec.key == "raid",
+            MetaBySpec.difficulty == RAID_DIFFICULTIES[difficulty],
+            MetaBySpec.region == region,
+            MetaBySpec.timeframe == timeframe,
+            *quality
+        ]
+        if source is not None:
+            conditions.append(MetaBySpec.source == source)
         stmt = (
             select(MetaBySpec)
-            .where(
-                MetaBySpec.encounter_id == encounter_id,
-                MetaBySpec.spec_type == spec_type,
-                MetaBySpec.key == "raid"
-            )
+            .where(*conditions)
             .order_by(MetaBySpec.meta.desc())
         )
         result = await session.execute(stmt)
@@ -42,78 +90,111 @@ async def get_meta_by_encounter(
                 meta=int(row.meta) if row.meta else None,
                 spec_type=row.spec_type,
                 encounter_id=row.encounter_id,
-                average_dps=row.average_dps
+                average_dps=row.average_dps,
+                difficulty=difficulty,
+                average_hps=row.average_hps,
+                region=region,
+                timeframe=timeframe,
+                sample_size=row.sample_size,
+                ci_half_width=row.ci_half_width,
+                confidence=row.confidence,
+                source=row.source,
+                **{field: getattr(row, field) for field in STAT_FIELDS}
             )
             for row in rows
         ]
-    else:
-        # Для M+ используем key_type
-        if key_type == "all":
-            # Агрегируем данные между low и high ключами
-            stmt = (
-                select(
-                    MetaBySpec.class_name,
-                    MetaBySpec.spec,
-                    MetaBySpec.spec_type,
-                    func.avg(MetaBySpec.meta).label('meta'),
-                    func.avg(MetaBySpec.average_dps).label('average_dps'),
-                    func.max(MetaBySpec.max_key_level).label('max_key')
-                )
-                .where(
-                    MetaBySpec.encounter_id == encounter_id,
-                    MetaBySpec.spec_type == spec_type,
-                    MetaBySpec.key.in_(["low", "high"])
-                )
-                .group_by(MetaBySpec.class_name, MetaBySpec.spec, MetaBySpec.spec_type)
-                .order_by(func.avg(MetaBySpec.meta).desc())
+
+    # Для M+ используем key_type
+    conditions = [
+        MetaBySpec.encounter_id == encounter_id,
+        MetaBySpec.spec_type == spec_type,
+        MetaBySpec.key.in_(["low", "high"]) if key_type == "all" else MetaBySpec.key == key_type,
+        MetaBySpec.region == region,
+        MetaBySpec.timeframe == timeframe,
+        *quality
+    ]
+    source = await resolve_source(session, conditions, source)
+    if source is None:
+        return []
+    conditions.append(MetaBySpec.source == source)
+
+    if key_type == "all":
+        # Агрегируем данные между low и high ключами
+        stmt = (
+            select(
+                MetaBySpec.class_name,
+                MetaBySpec.spec,
+                MetaBySpec.spec_type,
+                func.avg(MetaBySpec.meta).label('meta'),
+                func.avg(MetaBySpec.average_dps).label('average_dps'),
+                func.max(MetaBySpec.max_key_level).label('max_key'),
+                func.sum(MetaBySpec.sample_size).label('sample_size'),
+                func.min(MetaBySpec.confidence).label('confidence'),
             )
-            result = await session.execute(stmt)
-            rows = result.all()
-
-            return [
-                MetaBySpecMythicPlusResponse(
-                    class_name=row.class_name,
-                    spec=row.spec,
-                    meta=int(row.meta) if row.meta else None,
-                    spec_type=row.spec_type,
-                    encounter_id=encounter_id,
-                    average_dps=row.average_dps,
-                    max_key=row.max_key
-                )
-                for row in rows
-            ]
-        else:
-            # Для конкретного low или high
-            stmt = (
-                select(MetaBySpec)
-                .where(
-                    MetaBySpec.encounter_id == encounter_id,
-                    MetaBySpec.spec_type == spec_type,
-                    MetaBySpec.key == key_type
-                )
-                .order_by(MetaBySpec.meta.desc())
+            .where(*conditions)
+            .group_by(MetaBySpec.class_name, MetaBySpec.spec, MetaBySpec.spec_type)
+            .order_by(func.avg(MetaBySpec.meta).desc())
+        )
+        result = await session.execute(stmt)
+        rows = result.all()
+
+        return [
+            MetaBySpecMythicPlusResponse(
+                class_name=row.class_name,
+                spec=row.spec,
+                meta=int(row.meta) if row.meta else None,
+                spec_type=row.spec_type,
+                encounter_id=encounter_id,
+                average_dps=row.average_dps,
+                max_key=row.max_key,
+                region=region,
+                timeframe=timeframe,
+                sample_size=row.sample_size,
+                confidence=row.confidence,
+                source=source
             )
-            result = await session.execute(stmt)
-            rows = result.scalars().all()
-
-            return [
-                MetaBySpecMythicPlusResponse(
-                    class_name=row.class_name,
-                    spec=row.spec,
-                    meta=int(row.meta) if row.meta else None,
-                    spec_type=row.spec_type,
-                    encounter_id=row.encounter_id,
-                    average_dps=row.average_dps,
-                    max_key=row.max_key_level
-                )
-                for row in rows
-            ]
+            for row in rows
+        ]
+
+    # Для конкретного low или high
+    stmt = (
+        select(MetaBySpec)
+        .where(*conditions)
+        .order_by(MetaBySpec.meta.desc())
+    )
+    result = await session.execute(stmt)
+    rows = result.scalars().all()
+
+    return [
+        MetaBySpecMythicPlusResponse(
+            class_name=row.class_name,
+            spec=row.spec,
+            meta=int(row.meta) if row.meta else None,
+            spec_type=row.spec_type,
+            encounter_id=row.encounter_id,
+            average_dps=row.average_dps,
+            max_key=row.max_key_level,
+            region=region,
+            timeframe=timeframe,
+            sample_size=row.sample_size,
+            ci_half_width=row.ci_half_width,
+            confidence=row.confidence,
+            source=row.source,
+            **{field: getattr(row, field) for field in STAT_FIELDS}
+        )
+        for row in rows
+    ]
 
 
 async def get_meta_aggregated(
     session: AsyncSession,
     spec_type: str,
-    key_type: str = "all"
+    key_type: str = "all",
+    region: str = "all",
+    min_samples: Optional[int] = None,
+    min_confidence: Optional[float] = None,
+    timeframe: str = "season",
+    source: Optional[str] = None
 ):
     """
     Получить агрегированные данные по всем энкаунтерам.
@@ -124,42 +205,161 @@ async def get_meta_aggregated(
         session: AsyncSession
         spec_type: Тип спека (dps/tank/healer)
         key_type: Тип ключа ("all", "low" или "high", по умолчанию "all")
+        region: Регион игроков ("eu", "us", "kr", "tw" или "all" - все регионы)
+        min_samples: Минимальный размер выборки meta (фильтр до агрегации)
+        min_confidence: Минимальная уверенность meta (фильтр до агрегации)
+        timeframe: Период меты ("season" - полный прогон, "recent" - окно инкрементального сбора M+)
+        source: Источник meta (по умолчанию - первый по приоритету META_SOURCES из имеющихся)
+
+    Returns:
+        (строки, источник meta строк)
     """
-    if key_type == "all":
-        # Агрегируем данные между low и high ключами по всем подземельям
-        stmt = (
-            select(
-                MetaBySpec.class_name,
-                MetaBySpec.spec,
-                MetaBySpec.spec_type,
-                func.avg(MetaBySpec.meta).label('meta'),
-                func.avg(MetaBySpec.average_dps).label('average_dps'),
-                func.max(MetaBySpec.max_key_level).label('max_key')
-            )
-            .where(
-                MetaBySpec.spec_type == spec_type,
-                MetaBySpec.key.in_(["low", "high"])
-            )
-            .group_by(MetaBySpec.class_name, MetaBySpec.spec, MetaBySpec.spec_type)
-            .order_by(func.avg(MetaBySpec.meta).desc())
+    conditions = [
+        MetaBySpec.spec_type == spec_type,
+        MetaBySpec.key.in_(["low", "high"]) if key_type == "all" else MetaBySpec.key == key_type,
+        MetaBySpec.region == region,
+        MetaBySpec.timeframe == timeframe,
+        *quality_filters(min_samples, min_confidence)
+    ]
+    source = await resolve_source(session, conditions, source)
+    if source is None:
+        return [], None
+
+    # Агрегируем данные по всем подземельям (для key_type="all" - и между low и high ключами)
+    stmt = (
+        select(
+            MetaBySpec.class_name,
+            MetaBySpec.spec,
+            MetaBySpec.spec_type,
+            func.avg(MetaBySpec.meta).label('meta'),
+            func.avg(MetaBySpec.average_dps).label('average_dps'),
+            func.max(MetaBySpec.max_key_level).label('max_key'),
+            func.sum(MetaBySpec.sample_size).label('sample_size'),
+            func.min(MetaBySpec.confidence).label('confidence'),
         )
+        .where(*conditions, MetaBySpec.source == source)
+        .group_by(MetaBySpec.class_name, MetaBySpec.spec, MetaBySpec.spec_type)
+        .order_by(func.avg(MetaBySpec.meta).desc())
+    )
+    result = await session.execute(stmt)
+    return result.all(), source
+
+
+async def get_meta_by_bucket_range(
+    session: AsyncSession,
+    spec_type: str,
+    encounter_id: Optional[int] = None,
+    key_type: str = "all",
+    is_raid: bool = False,
+    difficulty: str = "mythic",
+    range_min: Optional[int] = None,
+    range_max: Optional[int] = None,
+    source: Optional[str] = None,
+) -> Union[list[MetaBySpecMythicPlusResponse], list[MetaBySpecRaidResponse]]:
+    """
+    Мета для диапазона уровней ключа (M+) или item level (рейд) по гистограммам meta_buckets
+
+    meta считается по той же метрике, что и meta_by_spec: для рейда - средний DPS/HPS
+    игроков в диапазоне, для M+ - средний рейтинг (или очки забега) игроков в диапазоне;
+    средние взвешены по числу игроков в корзинах. Границы диапазона сравниваются с нижней границей корзины (для ilvl ширина ILVL_BUCKET_WIDTH).
+    Дополнительных запросов к WarcraftLogs не требуется.
+
+    Args:
+        session: AsyncSession
+        spec_type: Тип спека (dps/tank/healer)
+        encounter_id: ID encounter (если не указан - по всем подземельям M+)
+        key_type: Тип ключа ("all", "low" или "high", игнорируется для рейдов)
+        is_raid: Является ли encounter рейдом
+        difficulty: Сложность рейда ("heroic" или "mythic", игнорируется для M+)
+        range_min: Нижняя граница уровня ключа / item level (включительно)
+        range_max: Верхняя граница уровня ключа / item level (включительно)
+        source: Источник meta (по умолчанию - первый по приоритету META_SOURCES из имеющихся)
+    """
+    players = func.sum(MetaBucket.players)
+    weighted_amount = func.sum(MetaBucket.players * MetaBucket.average_amount) / func.nullif(players, 0)
+    if is_raid:
+        # Корзины рейда строятся по метрике meta (HPS для хилов, DPS для остальных)
+        meta_players = players
+        weighted_meta = weighted_amount
     else:
-        # Для конкретного low или high
-        stmt = (
-            select(
-                MetaBySpec.class_name,
-                MetaBySpec.spec,
-                MetaBySpec.spec_type,
-                func.avg(MetaBySpec.meta).label('meta'),
-                func.avg(MetaBySpec.average_dps).label('average_dps'),
-                func.max(MetaBySpec.max_key_level).label('max_key')
-            )
-            .where(
-                MetaBySpec.spec_type == spec_type,
-                MetaBySpec.key == key_type
-            )
-            .group_by(MetaBySpec.class_name, MetaBySpec.spec, MetaBySpec.spec_type)
-            .order_by(func.avg(MetaBySpec.meta).desc())
+        meta_players = func.sum(MetaBucket.meta_players)
+        weighted_meta = func.sum(MetaBucket.meta_players * MetaBucket.average_meta) / func.nullif(meta_players, 0)
+
+    conditions = [MetaBucket.spec_type == spec_type]
+    if is_raid:
+        conditions += [
+            MetaBucket.key == "raid",
+            MetaBucket.bucket_type == "ilvl",
+            MetaBucket.difficulty == RAID_DIFFICULTIES[difficulty],
+        ]
+    else:
+        keys = ["low", "high"] if key_type == "all" else [key_type]
+        conditions += [MetaBucket.key.in_(keys), MetaBucket.bucket_type == "key"]
+
+    if encounter_id is not None:
+        conditions.append(MetaBucket.encounter_id == encounter_id)
+    if range_min is not None:
+        conditions.append(MetaBucket.bucket >= range_min)
+    if range_max is not None:
+        conditions.append(MetaBucket.bucket <= range_max)
+
+    if is_raid:
+        # Для рейдов источник задан ролью спека (HPS для хилов, DPS для остальных)
+        if source is not None:
+            conditions.append(MetaBucket.source == source)
+    else:
+        source = await resolve_source(session, conditions, source, MetaBucket.source)
+        if source is None:
+            return []
+        conditions.append(MetaBucket.source == source)
+
+    stmt = (
+        select(
+            MetaBucket.class_name,
+            MetaBucket.spec,
+            MetaBucket.spec_type,
+            MetaBucket.source,
+            weighted_meta.label('meta'),
+            weighted_amount.label('average_amount'),
+            meta_players.label('meta_players'),
+            func.max(MetaBucket.bucket).label('max_bucket'),
         )
+        .where(*conditions)
+        .group_by(MetaBucket.class_name, MetaBucket.spec, MetaBucket.spec_type, MetaBucket.source)
+        .order_by(weighted_meta.desc().nulls_last())
+    )
+
     result = await session.execute(stmt)
-    return result.all()
+    rows = result.all()
+
+    if is_raid:
+        # Корзины хилов хранят HPS, остальных - DPS
+        return [
+            MetaBySpecRaidResponse(
+                class_name=row.class_name,
+                spec=row.spec,
+                meta=int(row.meta) if row.meta else None,
+                spec_type=row.spec_type,
+                encounter_id=encounter_id,
+                average_dps=None if row.source == "hps" else row.average_amount,
+                average_hps=row.average_amount if row.source == "hps" else None,
+                difficulty=difficulty,
+                sample_size=row.meta_players,
+                source=row.source,
+            )
+            for row in rows
+        ]
+    return [
+        MetaBySpecMythicPlusResponse(
+            class_name=row.class_name,
+            spec=row.spec,
+            meta=int(row.meta) if row.meta else None,
+            spec_type=row.spec_type,
+            encounter_id=encounter_id,
+            average_dps=row.average_amount,
+            max_key=row.max_bucket,
+            sample_size=row.meta_players,
+            source=source,
+        )
+        for row in rows
+    ]
@@ -0,0 +1,84 @@
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.model import Player, PlayerBestKey
+from app.schemas.player_schema import PlayerRankResponse, PlayerBestKeyResponse
+from app.agregator.constant import ENCOUNTERS
+from typing import Optional
+
+
+async def count_rated(session: AsyncSession, player: Player, region: Optional[str] = None, above: bool = False) -> int:
+    """
+    Число игроков спека с рейтингом (above=True - только с рейтингом выше, чем у player)
+
+    Считаются только рейтинги того же источника, что у player: рейтинг Raider.IO
+    и локальный расчет - разные шкалы. COUNT по индексу ix_players_spec_rating /
+    ix_players_spec_region_rating.
+    """
+    stmt = select(func.count()).select_from(Player).where(
+        Player.class_name == player.class_name,
+        Player.spec == player.spec,
+        Player.rating_source == player.rating_source,
+        Player.rating.is_not(None),
+    )
+    if region is not None:
+        stmt = stmt.where(Player.region == region)
+    if above:
+        stmt = stmt.where(Player.rating > player.rating)
+    return (await session.execute(stmt)).scalar_one()
+
+
+async def get_player_rank(
+    session: AsyncSession,
+    region: str,
+    realm_slug: str,
+    name: str,
+) -> Optional[PlayerRankResponse]:
+    """
+    Игрок из индекса players и его место по рейтингу среди игроков того же спека и rating_source
+
+    Args:
+        session: AsyncSession
+        region: Регион ("eu", "us", "kr", "tw")
+        realm_slug: Сервер (как в normalize_realm, например tarren-mill)
+        name: Имя персонажа (без учета регистра)
+
+    Returns:
+        None, если игрок не встречался на leaderboard
+    """
+    result = await session.execute(
+        select(Player).where(
+            Player.region == region,
+            Player.realm_slug == realm_slug,
+            func.lower(Player.name) == name.lower(),
+        ).limit(1)
+    )
+    player = result.scalar_one_or_none()
+    if player is None:
+        return None
+
+    response = PlayerRankResponse.model_validate(player)
+    if player.rating is not None:
+        response.rank = await count_rated(session, player, above=True) + 1
+        response.total = await count_rated(session, player)
+        response.rank_region = await count_rated(session, player, region=player.region, above=True) + 1
+        response.total_region = await count_rated(session, player, region=player.region)
+
+    best_keys = await session.execute(
+        select(PlayerBestKey)
+        .where(
+            PlayerBestKey.region == player.region,
+            PlayerBestKey.realm_slug == player.realm_slug,
+            PlayerBestKey.name == player.name,
+        )
+        .order_by(PlayerBestKey.key_level.desc(), PlayerBestKey.encounter_id)
+    )
+    response.best_keys = [
+        PlayerBestKeyResponse(
+            encounter_id=row.encounter_id,
+            dungeon=ENCOUNTERS.get(row.encounter_id),
+            key_level=row.key_level,
+            duration_ms=row.duration_ms,
+        )
+        for row in best_keys.scalars().all()
+    ]
+    return response
@@ -0,0 +1,63 @@
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.model import SpecPopularity
+from app.schemas.popularity_schema import SpecPopularityResponse
+from typing import Optional
+
+
+async def get_popularity(
+    session: AsyncSession,
+    spec_type: Optional[str] = None,
+    encounter_id: Optional[int] = None,
+    key_type: str = "all",
+) -> list[SpecPopularityResponse]:
+    """
+    Получить популярность спеков
+
+    Игроки суммируются по выбранным encounter и типам ключа, затем доля и место
+    пересчитываются внутри роли оконными функциями прямо в PostgreSQL.
+
+    Args:
+        session: AsyncSession
+        spec_type: Тип спека (dps/tank/healer), если не указан - все роли
+        encounter_id: ID подземелья (если не указан - сумма по всем подземельям)
+        key_type: Тип ключа ("all", "low" или "high")
+    """
+    players = func.sum(SpecPopularity.players)
+    role_total = func.sum(players).over(partition_by=SpecPopularity.spec_type)
+
+    stmt = (
+        select(
+            SpecPopularity.class_name,
+            SpecPopularity.spec,
+            SpecPopularity.spec_type,
+            players.label('players'),
+            (players * 1.0 / func.nullif(role_total, 0)).label('share'),
+            func.rank().over(partition_by=SpecPopularity.spec_type, order_by=players.desc()).label('rank'),
+        )
+        .group_by(SpecPopularity.class_name, SpecPopularity.spec, SpecPopularity.spec_type)
+        .order_by(SpecPopularity.spec_type, players.desc())
+    )
+
+    if key_type == "all":
+        stmt = stmt.where(SpecPopularity.key.in_(["low", "high"]))
+    else:
+        stmt = stmt.where(SpecPopularity.key == key_type)
+    if encounter_id is not None:
+        stmt = stmt.where(SpecPopularity.encounter_id == encounter_id)
+    if spec_type is not None:
+        stmt = stmt.where(SpecPopularity.spec_type == spec_type)
+
+    result = await session.execute(stmt)
+    return [
+        SpecPopularityResponse(
+            class_name=row.class_name,
+            spec=row.spec,
+            spec_type=row.spec_type,
+            encounter_id=encounter_id,
+            players=int(row.players or 0),
+            share=float(row.share or 0.0),
+            rank=row.rank,
+        )
+        for row in result.all()
+    ]
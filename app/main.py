@@ -1,12 +1,26 @@
-from fastapi import FastAPI, Depends, Query
+from fastapi import FastAPI, Depends, Query, Header, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.schemas.meta_schema import MetaBySpecMythicPlusResponse, MetaBySpecRaidResponse
 from app.schemas.encounter_schema import EncountersListResponse
-from app.front.crud.meta_crud import get_meta_by_encounter, get_meta_aggregated
+from app.schemas.refresh_schema import RefreshRequest, RefreshJobResponse
+from app.schemas.popularity_schema import SpecPopularityResponse
+from app.schemas.loadout_schema import LoadoutPopularityResponse
+from app.schemas.composition_schema import CompositionResponse
+from app.schemas.player_schema import PlayerRankResponse
+from app.front.crud.meta_crud import get_meta_by_encounter, get_meta_aggregated, get_meta_by_bucket_range
+from app.front.crud.popularity_crud import get_popularity
+from app.front.crud.loadout_crud import get_loadout
+from app.front.crud.composition_crud import get_compositions
+from app.front.crud.player_crud import get_player_rank
 from app.db.db import get_db
-from app.agregator.constant import ENCOUNTERS, RAID
+from app.agregator.constant import ENCOUNTERS, RAID, ADMIN_API_TOKEN, RAID_DIFFICULTIES, REGIONS, REGION_ALL, WOW_CLASS_SPECS, \
+    TIMEFRAMES, TIMEFRAME_SEASON, META_SOURCES
+from app.agregator.loadout import LOADOUT_KINDS
+from app.agregator.refresh import validate_refresh_filters, create_refresh_job, get_refresh_job
+from app.agregator.view import refresh_targeted, realm_slug
 from typing import Optional, Union
+import secrets
 
 app = FastAPI(
     redirect_slashes=False  # Отключаем автоматический редирект для trailing slash
@@ -50,25 +64,72 @@ def is_mythic_plus_encounter(encounter_id: int) -> bool:
     "/meta/encounters/",
     response_model=Union[list[MetaBySpecMythicPlusResponse], list[MetaBySpecRaidResponse]],
     summary="Получить мету по энкаунтеру или агрегированную мету",
-    description="Если указан encounter - возвращает мету для конкретного подземелья/рейда. Если не указан - возвращает среднюю мету по всем подземельям для каждого спека. Обязательно указать spec_type (dps/tank/healer). Для M+ параметр key_type позволяет выбрать: 'all' (среднее между low и high, по умолчанию), 'low' или 'high'. Для рейдов key_type игнорируется."
+    description="Если указан encounter - возвращает мету для конкретного подземелья/рейда. Если не указан - возвращает среднюю мету по всем подземельям для каждого спека. Обязательно указать spec_type (dps/tank/healer). Для M+ параметр key_type позволяет выбрать: 'all' (среднее между low и high, по умолчанию), 'low' или 'high'. Для рейдов key_type игнорируется, а difficulty выбирает сложность: 'mythic' (по умолчанию) или 'heroic'. Если указан min_key/max_key (M+) или min_ilvl/max_ilvl (рейд, только вместе с encounter рейда) - meta считается по сохраненным гистограммам как средний рейтинг (M+) или DPS/HPS (рейд) игроков в этом диапазоне. region выбирает регион игроков: 'all' (по умолчанию), 'eu', 'us', 'kr' или 'tw'. timeframe выбирает период M+: 'season' (полный прогон, по умолчанию) или 'recent' (окно инкрементального сбора за последние дни). Ответ M+ содержит meta одного источника (рейтинг, очки забегов и DPS - разные шкалы): source задает его явно, по умолчанию берется первый из имеющихся в порядке raiderio, local, playerscore, dps. min_samples и min_confidence отбрасывают спеки с маленькой выборкой или широким доверительным интервалом (min_confidence=0.98 - интервал не шире ±2% от meta)."
 )
 async def get_meta(
     spec_type: str = Query(..., description="Тип спека: dps, tank или healer"),
     encounter: Optional[int] = Query(None, description="Encounter ID (необязательный)"),
     key_type: str = Query("all", description="Тип ключа: all (среднее между low и high), low или high (по умолчанию all, только для M+)"),
+    difficulty: str = Query("mythic", description="Сложность рейда: mythic или heroic (по умолчанию mythic, только для рейдов)"),
+    min_key: Optional[int] = Query(None, description="Минимальный уровень ключа (M+, включительно)"),
+    max_key: Optional[int] = Query(None, description="Максимальный уровень ключа (M+, включительно)"),
+    min_ilvl: Optional[int] = Query(None, description="Минимальный item level (рейд, включительно)"),
+    max_ilvl: Optional[int] = Query(None, description="Максимальный item level (рейд, включительно)"),
+    region: str = Query(REGION_ALL, description="Регион игроков: all, eu, us, kr или tw (по умолчанию all)"),
+    timeframe: str = Query(TIMEFRAME_SEASON, description="Период меты: season (полный прогон, по умолчанию) или recent (окно инкрементального сбора, только M+)"),
+    source: Optional[str] = Query(None, description="Источник meta: raiderio, local, playerscore, dps или hps (по умолчанию - первый из имеющихся по приоритету)"),
+    min_samples: Optional[int] = Query(None, ge=1, description="Минимальный размер выборки meta"),
+    min_confidence: Optional[float] = Query(None, ge=0, le=1, description="Минимальная уверенность meta: 1 - полуширина интервала / meta"),
     db: AsyncSession = Depends(get_db),
 ):
+    if difficulty not in RAID_DIFFICULTIES:
+        raise HTTPException(status_code=400, detail=f"Неизвестная сложность: {difficulty} (ожидается {', '.join(RAID_DIFFICULTIES)})")
+    if region != REGION_ALL and region not in REGIONS:
+        raise HTTPException(status_code=400, detail=f"Неизвестный регион: {region} (ожидается {REGION_ALL}, {', '.join(REGIONS)})")
+    if timeframe not in TIMEFRAMES:
+        raise HTTPException(status_code=400, detail=f"Неизвестный период: {timeframe} (ожидается {', '.join(TIMEFRAMES)})")
+    if source is not None and source not in META_SOURCES:
+        raise HTTPException(status_code=400, detail=f"Неизвестный источник: {source} (ожидается {', '.join(META_SOURCES)})")
+
+    is_raid = encounter is not None and is_raid_encounter(encounter)
+    # Диапазон другого типа контента не применялся бы молча
+    if is_raid and (min_key is not None or max_key is not None):
+        raise HTTPException(status_code=422, detail="min_key и max_key применяются только к M+ (для рейда - min_ilvl и max_ilvl)")
+    if not is_raid and (min_ilvl is not None or max_ilvl is not None):
+        raise HTTPException(status_code=422, detail="min_ilvl и max_ilvl применяются только к рейду: укажите encounter рейда")
+    # Инкрементальный сбор - только M+, в рейде мета всегда за полный прогон
+    if is_raid and timeframe != TIMEFRAME_SEASON:
+        raise HTTPException(status_code=422, detail=f"timeframe={timeframe} применяется только к M+")
+    range_min, range_max = (min_ilvl, max_ilvl) if is_raid else (min_key, max_key)
+    if range_min is not None or range_max is not None:
+        # Гистограммы хранятся только для всех регионов вместе
+        if region != REGION_ALL:
+            raise HTTPException(status_code=400, detail="Фильтр по диапазону ключей / item level доступен только для region=all")
+        # Гистограммы сохраняет только полный прогон
+        if timeframe != TIMEFRAME_SEASON:
+            raise HTTPException(status_code=400, detail=f"Фильтр по диапазону ключей / item level доступен только для timeframe={TIMEFRAME_SEASON}")
+        if min_samples is not None or min_confidence is not None:
+            raise HTTPException(status_code=400, detail="min_samples и min_confidence не применяются к диапазону ключей / item level")
+        # Мета для диапазона ключей / item level по гистограммам, без запросов к WarcraftLogs
+        return await get_meta_by_bucket_range(
+            db, spec_type, encounter, key_type, is_raid, difficulty, range_min, range_max, source
+        )
+
     if encounter is not None:
         # Определяем тип контента
         is_raid = is_raid_encounter(encounter)
 
         # Возвращаем данные по конкретному энкаунтеру
-        data = await get_meta_by_encounter(db, encounter, spec_type, key_type, is_raid)
+        data = await get_meta_by_encounter(
+            db, encounter, spec_type, key_type, is_raid, difficulty, region, min_samples, min_confidence, timeframe, source
+        )
         return data
     else:
         # Возвращаем агрегированные данные (среднее по всем энкаунтерам M+)
         # Для агрегации используем только M+ данные
-        rows = await get_meta_aggregated(db, spec_type, key_type)
+        rows, source = await get_meta_aggregated(
+            db, spec_type, key_type, region, min_samples, min_confidence, timeframe, source
+        )
         # Преобразуем результат в формат MetaBySpecMythicPlusResponse
         return [
             MetaBySpecMythicPlusResponse(
@@ -78,11 +139,93 @@ async def get_meta(
                 spec_type=row.spec_type,
                 average_dps=row.average_dps,
                 max_key=row.max_key,
+                region=region,
+                timeframe=timeframe,
+                sample_size=row.sample_size,
+                confidence=row.confidence,
+                source=source,
             )
             for row in rows
         ]
 
 
+@app.get(
+    "/meta/popularity/",
+    response_model=list[SpecPopularityResponse],
+    summary="Получить популярность спеков",
+    description="Количество игроков каждого спека на нефильтрованных leaderboard M+, доля и место среди спеков той же роли. Если encounter не указан - сумма по всем подземельям. key_type: 'all' (по умолчанию), 'low' или 'high'."
+)
+async def get_spec_popularity(
+    spec_type: Optional[str] = Query(None, description="Тип спека: dps, tank или healer (по умолчанию все)"),
+    encounter: Optional[int] = Query(None, description="Encounter ID (необязательный)"),
+    key_type: str = Query("all", description="Тип ключа: all, low или high"),
+    db: AsyncSession = Depends(get_db),
+):
+    return await get_popularity(db, spec_type, encounter, key_type)
+
+
+@app.get(
+    "/meta/loadout/",
+    response_model=list[LoadoutPopularityResponse],
+    summary="Получить популярные таланты или предметы спека",
+    description="Самые популярные таланты (kind=talent) или предметы (kind=item) у игроков спека на leaderboard M+ (по playerscore). Если encounter не указан - сумма по всем подземельям. share - доля игроков спека, у которых есть этот талант / предмет."
+)
+async def get_spec_loadout(
+    class_name: str = Query(..., description="Класс, например Mage"),
+    spec: str = Query(..., description="Спек, например Fire"),
+    kind: str = Query("talent", description="talent или item"),
+    encounter: Optional[int] = Query(None, description="Encounter ID (необязательный)"),
+    limit: int = Query(20, ge=1, le=100, description="Сколько записей вернуть"),
+    db: AsyncSession = Depends(get_db),
+):
+    if class_name not in WOW_CLASS_SPECS or spec not in WOW_CLASS_SPECS[class_name]:
+        raise HTTPException(status_code=400, detail=f"Неизвестный спек: {class_name} {spec}")
+    if kind not in LOADOUT_KINDS:
+        raise HTTPException(status_code=400, detail=f"Неизвестный тип: {kind} (ожидается {', '.join(LOADOUT_KINDS)})")
+    return await get_loadout(db, class_name, spec, kind, encounter, limit)
+
+
+@app.get(
+    "/meta/compositions/",
+    response_model=list[CompositionResponse],
+    summary="Получить популярные составы групп M+",
+    description="Самые частые составы групп (tank / healer / dps, каждый участник - Class:Spec) на leaderboard M+. Можно ограничить подземельем и диапазоном уровней ключа. share - доля забегов с этим составом среди всех забегов с известным составом."
+)
+async def get_group_compositions(
+    encounter: Optional[int] = Query(None, description="Encounter ID подземелья (необязательный)"),
+    min_key: Optional[int] = Query(None, ge=2, description="Минимальный уровень ключа"),
+    max_key: Optional[int] = Query(None, ge=2, description="Максимальный уровень ключа"),
+    limit: int = Query(20, ge=1, le=100, description="Сколько составов вернуть"),
+    db: AsyncSession = Depends(get_db),
+):
+    if encounter is not None and not is_mythic_plus_encounter(encounter):
+        raise HTTPException(status_code=400, detail=f"Encounter {encounter} не является подземельем M+")
+    if min_key is not None and max_key is not None and min_key > max_key:
+        raise HTTPException(status_code=400, detail="min_key не может быть больше max_key")
+    return await get_compositions(db, encounter, min_key, max_key, limit)
+
+
+@app.get(
+    "/players/rank/",
+    response_model=PlayerRankResponse,
+    summary="Получить место игрока среди игроков его спека",
+    description="Игрок из индекса leaderboard M+ (таблица players): класс и спек, лучший ключ на каждое подземелье, последний рейтинг и место по рейтингу среди игроков того же спека - во всех регионах (rank / total) и в регионе игрока (rank_region / total_region). 404, если игрок не встречался на leaderboard."
+)
+async def get_player(
+    region: str = Query(..., description="Регион: eu, us, kr или tw"),
+    realm: str = Query(..., description="Сервер, например Tarren Mill или tarren-mill"),
+    name: str = Query(..., min_length=2, max_length=64, description="Имя персонажа"),
+    db: AsyncSession = Depends(get_db),
+):
+    region = region.lower()
+    if region not in REGIONS:
+        raise HTTPException(status_code=400, detail=f"Неизвестный регион: {region} (ожидается {', '.join(REGIONS)})")
+    player = await get_player_rank(db, region, realm_slug(region, realm), name)
+    if player is None:
+        raise HTTPException(status_code=404, detail=f"Игрок {name} ({region}, {realm}) не найден на leaderboard")
+    return player
+
+
 @app.get(
     "/meta/encounters_id/",
     response_model=EncountersListResponse,
@@ -126,3 +269,48 @@ async def get_raids_list():
         ]
     }
 
+
+
+async def require_admin_token(x_admin_token: Optional[str] = Header(None)):
+    """Проверка токена для admin эндпоинтов (заголовок X-Admin-Token)"""
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=503, detail="Admin API отключен (ADMIN_API_TOKEN не задан)")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_API_TOKEN):
+        raise HTTPException(status_code=401, detail="Неверный admin токен")
+
+
+@app.post(
+    "/admin/refresh/",
+    response_model=RefreshJobResponse,
+    status_code=202,
+    summary="Точечное обновление меты",
+    description="Ставит в фон обновление меты для выбранных encounter, класса/спека и типа ключа (low/high/raid). Возвращает job_id для отслеживания прогресса. Требует заголовок X-Admin-Token.",
+    dependencies=[Depends(require_admin_token)],
+)
+async def start_refresh(request: RefreshRequest, background_tasks: BackgroundTasks):
+    try:
+        validate_refresh_filters(request.encounter_ids, request.class_name, request.spec_name, request.key_types)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    progress = create_refresh_job(request.model_dump())
+    background_tasks.add_task(
+        refresh_targeted,
+        request.encounter_ids, request.class_name, request.spec_name, request.key_types,
+        progress=progress,
+    )
+    return progress.to_dict()
+
+
+@app.get(
+    "/admin/refresh/{job_id}",
+    response_model=RefreshJobResponse,
+    summary="Прогресс точечного обновления",
+    description="Возвращает статус и прогресс фоновой задачи обновления. Требует заголовок X-Admin-Token.",
+    dependencies=[Depends(require_admin_token)],
+)
+async def get_refresh_status(job_id: str):
+    progress = get_refresh_job(job_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Задача обновления не найдена")
+    return progress.to_dict()
@@ -1,7 +1,9 @@
+from datetime import date
 from sqlalchemy import (
-    String, Integer, SmallInteger, Numeric, DateTime, func, Float, UniqueConstraint
+    String, Integer, SmallInteger, BigInteger, Numeric, DateTime, Date, func, text, Float, UniqueConstraint, Index, Identity
 )
 from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import DeclarativeBase
 
 class Base(DeclarativeBase):
@@ -10,7 +12,11 @@ class Base(DeclarativeBase):
 class MetaBySpec(Base):
     __tablename__ = "meta_by_spec"
     __table_args__ = (
-        UniqueConstraint('class_name', 'spec', 'encounter_id', 'key', name='uix_class_spec_encounter_key'),
+        # Источник - в ключе: рейтинг, очки забегов и DPS - разные шкалы и не перезаписывают друг друга
+        UniqueConstraint('class_name', 'spec', 'encounter_id', 'key', 'difficulty', 'region', 'timeframe', 'source', name='uix_meta_by_spec_natural_key'),
+        # Выборка API: роль + ключ + регион (+ encounter) с фильтрами min_samples / min_confidence;
+        # encounter не первый, чтобы индекс работал и для агрегата по всем подземельям
+        Index('ix_meta_by_spec_lookup_quality', 'spec_type', 'key', 'region', 'encounter_id', 'sample_size', 'confidence'),
     )
 
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -24,3 +30,228 @@ class MetaBySpec(Base):
     key: Mapped[str] = mapped_column(String(10), nullable=False)  # "low" или "high" или "raid" для рейдов
     average_dps: Mapped[float | None] = mapped_column(Float, nullable=True, default=None)  # Средний DPS
     max_key_level: Mapped[int | None] = mapped_column(Integer, nullable=True, default=None)  # Максимальный уровень ключа (только для high keys)
+
+    # Сложность рейда: 4 - heroic, 5 - mythic, 0 - не применимо (M+)
+    # NOT NULL, чтобы уникальный индекс работал (NULL != NULL в PostgreSQL)
+    difficulty: Mapped[int] = mapped_column(SmallInteger, nullable=False, default=0, server_default="0")
+    average_hps: Mapped[float | None] = mapped_column(Float, nullable=True, default=None)  # Средний HPS (рейды, хилы)
+
+    # Размер выборки и доверительный интервал значения meta
+    sample_size: Mapped[int | None] = mapped_column(Integer, nullable=True, default=None)  # Сколько игроков дали значение meta
+    ci_half_width: Mapped[float | None] = mapped_column(Float, nullable=True, default=None)  # Полуширина доверительного интервала meta
+    confidence: Mapped[float | None] = mapped_column(Float, nullable=True, default=None)  # 1 - ci_half_width / meta (0.98 = ±2%)
+
+    # Устойчивые статистики значений, из которых получена meta (RIO / DPS / HPS)
+    trimmed_mean: Mapped[float | None] = mapped_column(Float, nullable=True, default=None)  # Усеченное среднее
+    median: Mapped[float | None] = mapped_column(Float, nullable=True, default=None)
+    p25: Mapped[float | None] = mapped_column(Float, nullable=True, default=None)
+    p75: Mapped[float | None] = mapped_column(Float, nullable=True, default=None)
+    p90: Mapped[float | None] = mapped_column(Float, nullable=True, default=None)
+    std: Mapped[float | None] = mapped_column(Float, nullable=True, default=None)  # Стандартное отклонение
+
+    # Регион игроков: "eu", "us", "kr", "tw" или "all" - все регионы
+    region: Mapped[str] = mapped_column(String(4), nullable=False, default="all", server_default="all")
+
+    # Источник значения meta: "raiderio", "local" (рейтинг из забегов WCL), "playerscore", "dps" или "hps"
+    # NOT NULL, чтобы уникальный индекс работал (NULL != NULL в PostgreSQL)
+    source: Mapped[str] = mapped_column(String(16), nullable=False)
+
+    # Период: "season" - полный прогон, "recent" - окно инкрементального сбора M+ (INCREMENTAL_WINDOW_DAYS)
+    timeframe: Mapped[str] = mapped_column(String(10), nullable=False, default="season", server_default="season")
+
+
+class SpecPopularity(Base):
+    """Популярность спека на encounter: доля и место среди спеков той же роли"""
+    __tablename__ = "spec_popularity"
+    __table_args__ = (
+        UniqueConstraint('class_name', 'spec', 'encounter_id', 'key', name='uix_popularity_class_spec_encounter_key'),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    class_name: Mapped[str] = mapped_column(String(30))
+    spec: Mapped[str] = mapped_column(String(30))
+    spec_type: Mapped[str] = mapped_column(String(30))
+    encounter_id: Mapped[int] = mapped_column(Integer)
+    key: Mapped[str] = mapped_column(String(10), nullable=False)  # "low" или "high", как в MetaBySpec
+    players: Mapped[int] = mapped_column(Integer)  # Игроков спека на нефильтрованном leaderboard
+    share: Mapped[float] = mapped_column(Float)  # Доля среди игроков той же роли (0..1)
+    rank: Mapped[int] = mapped_column(Integer)  # Место по популярности среди спеков той же роли
+
+
+class MetaBucket(Base):
+    """Гистограмма throughput спека по уровню ключа (M+) или item level (рейд)"""
+    __tablename__ = "meta_buckets"
+    __table_args__ = (
+        UniqueConstraint(
+            'class_name', 'spec', 'encounter_id', 'key', 'difficulty', 'source', 'bucket_type', 'bucket',
+            name='uix_meta_bucket_natural_key'
+        ),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    class_name: Mapped[str] = mapped_column(String(30))
+    spec: Mapped[str] = mapped_column(String(30))
+    spec_type: Mapped[str] = mapped_column(String(30))
+    encounter_id: Mapped[int] = mapped_column(Integer)
+    key: Mapped[str] = mapped_column(String(10), nullable=False)  # "low", "high" или "raid", как в MetaBySpec
+    difficulty: Mapped[int] = mapped_column(SmallInteger, nullable=False, default=0, server_default="0")
+    source: Mapped[str] = mapped_column(String(16), nullable=False)  # Источник meta строки MetaBySpec, как в MetaBySpec.source
+    bucket_type: Mapped[str] = mapped_column(String(10))  # "key" - уровень ключа, "ilvl" - item level
+    bucket: Mapped[int] = mapped_column(SmallInteger)  # Нижняя граница корзины
+    players: Mapped[int] = mapped_column(Integer)
+    average_amount: Mapped[float] = mapped_column(Float)  # Средний DPS/HPS в корзине
+    # Только M+: игроков со значением meta и среднее meta (рейтинг или очки забега) в корзине
+    meta_players: Mapped[int | None] = mapped_column(Integer, nullable=True, default=None)
+    average_meta: Mapped[float | None] = mapped_column(Float, nullable=True, default=None)
+
+
+class MetaRunningStats(Base):
+    """
+    Достаточные статистики M+ leaderboard за один день (timeframe: Today)
+
+    Мета за окно дней считается суммированием count/total/total_sq,
+    поэтому новый день обновляет только свою строку. Строки - для всех
+    регионов вместе ("all") и для каждого региона; samples - значения дня
+    для устойчивых статистик окна.
+    """
+    __tablename__ = "meta_running_stats"
+    __table_args__ = (
+        UniqueConstraint('class_name', 'spec', 'encounter_id', 'key', 'metric', 'region', 'day', name='uix_running_class_spec_encounter_key_metric_region_day'),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    class_name: Mapped[str] = mapped_column(String(30))
+    spec: Mapped[str] = mapped_column(String(30))
+    spec_type: Mapped[str] = mapped_column(String(30))
+    encounter_id: Mapped[int] = mapped_column(Integer)
+    key: Mapped[str] = mapped_column(String(10), nullable=False)  # "low" или "high"
+    metric: Mapped[str] = mapped_column(String(10))  # "dps" или "rio"
+    day: Mapped[date] = mapped_column(Date)
+    count: Mapped[int] = mapped_column(Integer)
+    total: Mapped[float] = mapped_column(Float)  # Сумма значений
+    total_sq: Mapped[float] = mapped_column(Float)  # Сумма квадратов значений
+    max_key_level: Mapped[int | None] = mapped_column(Integer, nullable=True, default=None)
+    # Регион игроков: "eu", "us", "kr", "tw" или "all" - все регионы
+    region: Mapped[str] = mapped_column(String(4), nullable=False, default="all", server_default="all")
+    samples: Mapped[list[float] | None] = mapped_column(ARRAY(Float), nullable=True, default=None)  # Значения за день
+
+
+class LoadoutPopularity(Base):
+    """Top-K талантов или предметов спека на encounter (по игрокам leaderboard playerscore)"""
+    __tablename__ = "loadout_popularity"
+    __table_args__ = (
+        UniqueConstraint('class_name', 'spec', 'encounter_id', 'kind', 'entity_id', name='uix_loadout_class_spec_encounter_kind_entity'),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    class_name: Mapped[str] = mapped_column(String(30))
+    spec: Mapped[str] = mapped_column(String(30))
+    encounter_id: Mapped[int] = mapped_column(Integer)
+    kind: Mapped[str] = mapped_column(String(10))  # "talent" или "item"
+    entity_id: Mapped[int] = mapped_column(Integer)  # talentID или ID предмета
+    players: Mapped[int] = mapped_column(Integer)  # Игроков с этим талантом / предметом
+    sample_players: Mapped[int] = mapped_column(Integer)  # Всего игроков с данными о талантах / экипировке
+    share: Mapped[float] = mapped_column(Float)  # players / sample_players
+    rank: Mapped[int] = mapped_column(Integer)  # Место среди талантов / предметов спека
+
+
+class ReportComposition(Base):
+    """
+    Состав группы одного боя M+ (кеш отчетов: каждый бой запрашивается один раз)
+
+    composition - роли через "|" (tank|healer|dps), участники роли через ",",
+    участник - "Class:Spec"; участники внутри роли отсортированы.
+    """
+    __tablename__ = "report_compositions"
+    __table_args__ = (
+        UniqueConstraint('report_code', 'fight_id', name='uix_report_composition_code_fight'),
+        Index('ix_report_compositions_encounter_key', 'encounter_id', 'key_level'),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    report_code: Mapped[str] = mapped_column(String(32))
+    fight_id: Mapped[int] = mapped_column(Integer)
+    encounter_id: Mapped[int] = mapped_column(Integer)
+    key_level: Mapped[int] = mapped_column(Integer)
+    composition: Mapped[str] = mapped_column(String(400))
+    source: Mapped[str] = mapped_column(String(10))  # "rankings" - все 5 игроков на leaderboard, "report" - из отчета
+
+
+class Player(Base):
+    """
+    Игрок, найденный на leaderboard M+ (обновляется каждым прогоном)
+
+    rating - последний полученный рейтинг (Raider.IO или локальный расчет);
+    ранг игрока среди спека того же rating_source считается по индексам
+    ix_players_spec_rating*.
+    """
+    __tablename__ = "players"
+    __table_args__ = (
+        UniqueConstraint('region', 'realm_slug', 'name', name='uix_player_region_realm_name'),
+        Index('ix_players_spec_rating', 'class_name', 'spec', 'rating_source', 'rating'),
+        Index('ix_players_spec_region_rating', 'class_name', 'spec', 'region', 'rating_source', 'rating'),
+        # Поиск игрока API без учета регистра имени (lower(name))
+        Index('ix_players_region_realm_lower_name', 'region', 'realm_slug', func.lower(text('name'))),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    region: Mapped[str] = mapped_column(String(4))
+    realm_slug: Mapped[str] = mapped_column(String(64))  # Как в normalize_realm
+    name: Mapped[str] = mapped_column(String(64))
+    class_name: Mapped[str] = mapped_column(String(30))  # Последний класс / спек на leaderboard
+    spec: Mapped[str] = mapped_column(String(30))
+    spec_type: Mapped[str] = mapped_column(String(30))
+    max_key_level: Mapped[int | None] = mapped_column(Integer, nullable=True, default=None)  # Лучший ключ по всем подземельям
+    rating: Mapped[float | None] = mapped_column(Float, nullable=True, default=None)
+    rating_source: Mapped[str | None] = mapped_column(String(16), nullable=True, default=None)  # "raiderio" или "local"
+    last_seen = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+
+class PlayerBestKey(Base):
+    """Лучший ключ игрока на подземелье (выше ключ, при равном - быстрее)"""
+    __tablename__ = "player_best_keys"
+    __table_args__ = (
+        UniqueConstraint('region', 'realm_slug', 'name', 'encounter_id', name='uix_player_best_key_player_encounter'),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    region: Mapped[str] = mapped_column(String(4))
+    realm_slug: Mapped[str] = mapped_column(String(64))
+    name: Mapped[str] = mapped_column(String(64))
+    encounter_id: Mapped[int] = mapped_column(Integer)
+    key_level: Mapped[int] = mapped_column(Integer)
+    duration_ms: Mapped[int | None] = mapped_column(Integer, nullable=True, default=None)
+    updated_at = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+
+class RankingEntry(Base):
+    """
+    Запись leaderboard одного прогона (append-only, секции по run_id)
+
+    Мета в meta_by_spec считается из этих строк SQL запросом (DERIVE_META_SQL),
+    поэтому новая статистика не требует нового сбора. Секция прогона -
+    ranking_entries_<run_id>, создается и удаляется агрегатором.
+    """
+    __tablename__ = "ranking_entries"
+    __table_args__ = (
+        Index('ix_ranking_entries_leaderboard', 'run_id', 'encounter_id', 'key', 'difficulty', 'class_name', 'spec'),
+        {"postgresql_partition_by": "LIST (run_id)"},
+    )
+
+    # Первичный ключ секционированной таблицы должен включать ключ секционирования
+    run_id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    id: Mapped[int] = mapped_column(BigInteger, Identity(), primary_key=True)
+    encounter_id: Mapped[int] = mapped_column(Integer)
+    key: Mapped[str] = mapped_column(String(10))  # "low", "high" или "raid", как в MetaBySpec
+    difficulty: Mapped[int] = mapped_column(SmallInteger, default=0, server_default="0")
+    class_name: Mapped[str] = mapped_column(String(30))
+    spec: Mapped[str] = mapped_column(String(30))
+    spec_type: Mapped[str] = mapped_column(String(30))
+    metric: Mapped[str] = mapped_column(String(12))  # Что в amount: "dps", "hps" или "playerscore"
+    region: Mapped[str | None] = mapped_column(String(4), nullable=True, default=None)
+    realm_slug: Mapped[str | None] = mapped_column(String(64), nullable=True, default=None)  # None - скрытый / анонимный игрок
+    name: Mapped[str | None] = mapped_column(String(64), nullable=True, default=None)
+    amount: Mapped[float | None] = mapped_column(Float, nullable=True, default=None)
+    key_level: Mapped[int] = mapped_column(SmallInteger, default=0)  # Уровень ключа (M+) или item level (рейд)
+    rio: Mapped[float | None] = mapped_column(Float, nullable=True, default=None)  # Рейтинг игрока, если запрашивался
+    rio_source: Mapped[str | None] = mapped_column(String(16), nullable=True, default=None)  # "raiderio" или "local"
@@ -0,0 +1,16 @@
+from pydantic import BaseModel
+from typing import Optional
+
+
+class CompositionResponse(BaseModel):
+    """Состав группы M+ и его популярность"""
+    encounter_id: Optional[int] = None
+    tanks: list[str]  # ["Warrior:Protection"]
+    healers: list[str]
+    dps: list[str]
+    runs: int  # Число забегов с этим составом
+    share: float  # Доля от всех забегов с известным составом (0..1)
+    rank: int
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,17 @@
+from pydantic import BaseModel
+from typing import Optional
+
+
+class LoadoutPopularityResponse(BaseModel):
+    """Популярность таланта или предмета у игроков спека"""
+    class_name: str
+    spec: str
+    encounter_id: Optional[int] = None
+    kind: str  # "talent" или "item"
+    entity_id: int  # talentID или ID предмета
+    players: int
+    share: float  # Доля игроков спека с этим талантом / предметом (0..1)
+    rank: int
+
+    class Config:
+        from_attributes = True
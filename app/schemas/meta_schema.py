@@ -10,6 +10,20 @@ class MetaBySpecBaseResponse(BaseModel):
     spec_type: str
     encounter_id: Optional[int] = None
     average_dps: Optional[float] = None
+    region: Optional[str] = None  # "eu", "us", "kr", "tw" или "all"
+    timeframe: Optional[str] = None  # "season" - полный прогон, "recent" - окно инкрементального сбора M+
+    sample_size: Optional[int] = None  # Сколько игроков дали значение meta (для агрегатов - сумма)
+    ci_half_width: Optional[float] = None  # Полуширина доверительного интервала meta
+    confidence: Optional[float] = None  # 1 - ci_half_width / meta (для агрегатов - минимум)
+    # Источник meta: "raiderio", "local", "playerscore", "dps" или "hps" (в одном ответе M+ - один источник)
+    source: Optional[str] = None
+    # Устойчивые статистики значений meta (только для конкретного encounter и ключа)
+    trimmed_mean: Optional[float] = None
+    median: Optional[float] = None
+    p25: Optional[float] = None
+    p75: Optional[float] = None
+    p90: Optional[float] = None
+    std: Optional[float] = None
 
     class Config:
         from_attributes = True
@@ -22,5 +36,6 @@ class MetaBySpecMythicPlusResponse(MetaBySpecBaseResponse):
 
 class MetaBySpecRaidResponse(MetaBySpecBaseResponse):
     """Схема для Raid данных"""
-    pass
+    difficulty: Optional[str] = None  # "heroic" или "mythic"
+    average_hps: Optional[float] = None  # Средний HPS (для хилов)
 
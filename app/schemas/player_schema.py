@@ -0,0 +1,37 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Optional
+
+
+class PlayerBestKeyResponse(BaseModel):
+    """Лучший ключ игрока на подземелье"""
+    encounter_id: int
+    dungeon: Optional[str] = None
+    key_level: int
+    duration_ms: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+
+class PlayerRankResponse(BaseModel):
+    """Игрок из индекса leaderboard и его место среди игроков того же спека"""
+    region: str
+    realm_slug: str
+    name: str
+    class_name: str
+    spec: str
+    spec_type: str
+    max_key_level: Optional[int] = None
+    rating: Optional[float] = None
+    rating_source: Optional[str] = None  # "raiderio" или "local"
+    last_seen: Optional[datetime] = None
+    # Место по рейтингу среди игроков спека с тем же rating_source (None - рейтинг неизвестен)
+    rank: Optional[int] = None
+    total: int = 0  # Игроков спека с известным рейтингом того же источника
+    rank_region: Optional[int] = None
+    total_region: int = 0
+    best_keys: list[PlayerBestKeyResponse] = []
+
+    class Config:
+        from_attributes = True
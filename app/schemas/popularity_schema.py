@@ -0,0 +1,16 @@
+from pydantic import BaseModel
+from typing import Optional
+
+
+class SpecPopularityResponse(BaseModel):
+    """Популярность спека (доля и место среди спеков той же роли)"""
+    class_name: str
+    spec: str
+    spec_type: str
+    encounter_id: Optional[int] = None
+    players: int
+    share: float
+    rank: int
+
+    class Config:
+        from_attributes = True
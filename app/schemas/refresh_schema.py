@@ -0,0 +1,25 @@
+from pydantic import BaseModel
+from typing import List, Optional, Dict, Any
+
+
+class RefreshRequest(BaseModel):
+    """Фильтры точечного обновления меты (все необязательные, комбинируются через AND)"""
+    encounter_ids: Optional[List[int]] = None
+    class_name: Optional[str] = None
+    spec_name: Optional[str] = None
+    key_types: Optional[List[str]] = None  # "low", "high", "raid"
+
+
+class RefreshJobResponse(BaseModel):
+    """Прогресс фоновой задачи точечного обновления"""
+    job_id: str
+    status: str  # queued, running, done, failed
+    filters: Dict[str, Any]
+    total: int
+    done: int
+    with_data: int
+    saved: int
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
@@ -0,0 +1,105 @@
+"""
+Тест: потолок памяти агрегатора при полном прогоне M+ leaderboard
+
+Ответы WarcraftLogs подменяются через httpx.MockTransport: каждая запись
+rankings содержит тяжелые report/guild/talents/gear, как в реальном ответе.
+Тело ответа отдается по частям и генерируется на лету, поэтому в tracemalloc
+попадает только то, что держит сам агрегатор. RIO подменяется константой.
+
+Запуск: python -m pytest -q test_aggregator_memory.py  (или python test_aggregator_memory.py)
+"""
+import asyncio
+import json
+import tracemalloc
+
+import httpx
+
+import app.agregator.view as view
+
+JOBS = 30                # Leaderboard (спек × подземелье × ключ)
+PAGES = 4                # Страниц на leaderboard
+RANKINGS_PER_PAGE = 100  # Игроков на странице, как у WarcraftLogs
+CHUNK_SIZE = 16 * 1024   # Размер куска ответа
+
+# Потолок пиковой памяти за весь прогон
+MEMORY_CEILING_BYTES = 6 * 1024 * 1024
+
+
+def make_ranking(job: int, page: int, index: int) -> dict:
+    """Запись characterRankings с полями, которые агрегатор не использует"""
+    return {
+        "name": f"Player{job}x{page}x{index}",
+        "class": "Mage",
+        "spec": "Fire",
+        "amount": 1_000_000.0 + index * 1000,
+        "hardModeLevel": 12,
+        "duration": 1_800_000,
+        "startTime": 1_700_000_000_000,
+        "report": {"code": f"r{job}{page}{index:03d}abcdefgh", "fightID": index, "startTime": 1_700_000_000_000},
+        "guild": {"id": index, "name": "Some Long Guild Name", "faction": 1},
+        "server": {"id": 1, "name": "Silvermoon", "region": ("EU", "US", "KR", "TW")[index % 4]},
+        "bracketData": 10 + index % 8,
+        "faction": 1,
+        "affixes": [9, 10, 147, 148],
+        "medal": "gold",
+        "score": 412.5,
+        "hidden": False,
+        "talents": [{"talentID": i, "points": 1} for i in range(40)],
+        "gear": [{"id": 200_000 + i, "itemLevel": 639, "bonusIDs": [10_000 + i, 10_500, 11_000]} for i in range(16)],
+    }
+
+
+def response_chunks(job: int, page: int):
+    """Тело ответа одной страницы, сгенерированное по частям"""
+    has_more = page < PAGES
+
+    async def body():
+        head = (
+            '{"data":{"worldData":{"encounter":{"name":"Test","characterRankings":'
+            f'{{"page":{page},"hasMorePages":{json.dumps(has_more)},"count":{RANKINGS_PER_PAGE},"rankings":['
+        )
+        buffer = head
+        for index in range(RANKINGS_PER_PAGE):
+            buffer += ("," if index else "") + json.dumps(make_ranking(job, page, index))
+            if len(buffer) >= CHUNK_SIZE:
+                yield buffer.encode()
+                buffer = ""
+        yield (buffer + "]}}}}}").encode()
+
+    return body()
+
+
+def handler(request: httpx.Request) -> httpx.Response:
+    variables = json.loads(request.content)["variables"]
+    return httpx.Response(200, content=response_chunks(variables["encounterID"], variables["page"]))
+
+
+async def fake_rio(client, region, realm, name):
+    return 2500.0
+
+
+async def full_run():
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        return await asyncio.gather(*(
+            view.fetch_leaderboard_optimized(client, "token", job, "Mage", "Fire", pages=PAGES)
+            for job in range(JOBS)
+        ))
+
+
+def test_full_run_memory_ceiling(monkeypatch):
+    monkeypatch.setattr(view, "fetch_rio_with_retry", fake_rio)
+    tracemalloc.start()
+    try:
+        results = asyncio.run(full_run())
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert all(result is not None for result in results)
+    assert all(result["dps_sample_size"] == PAGES * RANKINGS_PER_PAGE for result in results)
+    print(f"Пиковая память: {peak / 1024 / 1024:.1f} MB (потолок {MEMORY_CEILING_BYTES / 1024 / 1024:.0f} MB)")
+    assert peak < MEMORY_CEILING_BYTES
+
+
+if __name__ == "__main__":
+    test_full_run_memory_ceiling()
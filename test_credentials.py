@@ -0,0 +1,113 @@
+"""
+Тест: выдача клиентов WarcraftLogs при исчерпанных поинтах (app/agregator/credentials.py)
+
+Если остатка поинтов не хватает ни у одного клиента пула, lease перечитывает
+rateLimitData и ждет сброса часового счетчика, а не выдает клиента под 429.
+
+Запуск: python -m pytest -q test_credentials.py
+"""
+import asyncio
+
+from app.agregator.credentials import WclPool
+
+
+class FakeClock:
+    """Часы пула: время двигает только sleep"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float) -> None:
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def make_pool(clock, spent_until_reset, reset_at=50.0, refresh_interval=30.0):
+    """Пул из двух клиентов по 100 поинтов; до reset_at потрачено spent_until_reset"""
+    refreshes = []
+
+    async def refresh():
+        refreshes.append(clock.now)
+        for credential in pool.credentials:
+            credential.update_rate_limit({
+                "limitPerHour": 100,
+                "pointsSpentThisHour": spent_until_reset if clock.now < reset_at else 0,
+                "pointsResetIn": max(0.0, reset_at - clock.now),
+            })
+
+    pool = WclPool.from_clients(
+        [("a", "x"), ("b", "y")], 2,
+        refresh=refresh, refresh_interval=refresh_interval, clock=clock, sleep=clock.sleep,
+    )
+    return pool, refresh, refreshes
+
+
+def test_lease_waits_for_reset_when_points_exhausted():
+    clock = FakeClock()
+    pool, refresh, refreshes = make_pool(clock, spent_until_reset=95)
+
+    async def run():
+        await refresh()
+        async with pool.lease(3):
+            pass
+        async with pool.lease(10) as credential:
+            return credential.remaining()
+
+    remaining = asyncio.run(run())
+    # Первая задача помещается в остаток, вторая ждет сброса (50 сек + запас)
+    assert clock.slept == [51.0]
+    assert remaining == 90.0
+    assert refreshes[-1] == 51.0
+
+
+def test_lease_refreshes_rate_limit_periodically():
+    clock = FakeClock()
+    pool, refresh, refreshes = make_pool(clock, spent_until_reset=0, reset_at=3600.0)
+
+    async def run():
+        await refresh()
+        async with pool.lease(1):
+            pass
+        clock.now += 31.0
+        async with pool.lease(1):
+            pass
+
+    asyncio.run(run())
+    # Без нехватки поинтов - не ждем, а rateLimitData перечитан по интервалу
+    assert clock.slept == []
+    assert refreshes == [0.0, 31.0]
+
+
+def test_lease_does_not_wait_without_known_reset():
+    clock = FakeClock()
+    pool = WclPool.from_clients([("a", "x")], 1, clock=clock, sleep=clock.sleep)
+    pool.primary.limit_per_hour = 100
+    pool.primary.points_spent = 100
+
+    async def run():
+        async with pool.lease(10) as credential:
+            return credential
+
+    assert asyncio.run(run()) is pool.primary
+    assert clock.slept == []
+
+
+def test_shared_client_gives_shard_its_share_of_points():
+    clock = FakeClock()
+    # Клиент общий для двух шардов: каждому - половина остатка часа
+    pool = WclPool.from_clients([("a", "x")], 1, limit_share=0.5, clock=clock, sleep=clock.sleep)
+    pool.primary.update_rate_limit({"limitPerHour": 100, "pointsSpentThisHour": 40, "pointsResetIn": 50})
+
+    async def run():
+        async with pool.lease(35) as credential:
+            return credential.remaining()
+
+    assert pool.primary.remaining() == 30.0
+    assert pool.primary.hourly_limit() == 50.0
+    # Задача дороже доли шарда (но не остатка клиента) ждет сброса счетчика
+    assert asyncio.run(run()) == 50.0 - 35.0
+    assert clock.slept == [51.0]
@@ -0,0 +1,148 @@
+"""
+Тест: локальный рейтинг M+ по забегам leaderboard (app/agregator/mplus_score.py)
+
+Ожидаемые очки посчитаны вручную по формуле модуля:
+125 + 15 * уровень + 15 за каждый порог аффиксов (4, 7, 10, 12)
++ 15 * clip((1 - длительность / таймер) / 0.4, -1, 1); дольше таймера на 40% - 0 очков.
+
+Запуск: python -m pytest -q test_mplus_score.py
+"""
+import asyncio
+import json
+
+import httpx
+import numpy as np
+
+import app.agregator.view as view
+from app.agregator.credentials import WclPool
+from app.agregator.mplus_score import ScoreEngine, run_scores
+
+TIMERS_MS = {1: 1000, 2: 2000}
+
+
+def test_run_scores_formula():
+    levels = np.array([10, 12, 7, 3, 5, 1])
+    limits = np.array([1000.0] * 6)
+    durations = np.array([800.0, 1200.0, 1000.0, 500.0, 1500.0, 500.0])
+
+    scores = run_scores(levels, durations, limits)
+
+    expected = [
+        125 + 150 + 3 * 15 + 7.5,   # 10: пороги 4, 7, 10; на 20% быстрее таймера
+        125 + 180 + 4 * 15 - 7.5,   # 12: все пороги; на 20% дольше таймера
+        125 + 105 + 2 * 15,         # 7: ровно по таймеру
+        125 + 45 + 15,              # 3: на 50% быстрее - бонус насыщен
+        0.0,                        # 5: на 50% дольше таймера
+        0.0,                        # 1: ключ ниже 2
+    ]
+    np.testing.assert_allclose(scores, expected)
+
+
+def make_engine(expected_jobs=2):
+    engine = ScoreEngine(expected_jobs, timers_ms=TIMERS_MS)
+    # Игрок A: лучший забег на подземелье 1 - 327.5 (забег 185 отбрасывается), на подземелье 2 - 260
+    engine.add(("eu", "silvermoon", "A"), 1, 10, 800)
+    engine.add(("eu", "silvermoon", "a"), 1, 3, 500)
+    engine.add(("eu", "silvermoon", "A"), 2, 7, 2000)
+    # Игрок B: 357.5 на подземелье 2; подземелье не из таймеров не учитывается
+    engine.add(("us", "stormrage", "B"), 2, 12, 2400)
+    engine.add(("us", "stormrage", "B"), 99, 20, 1000)
+    # Игрок C: единственный забег не дает очков
+    engine.add(("eu", "silvermoon", "C"), 1, 5, 1500)
+    return engine
+
+
+def test_compute_takes_best_run_per_dungeon():
+    engine = make_engine()
+
+    assert engine.runs == 5
+    np.testing.assert_allclose(engine.compute(), [327.5 + 260.0, 357.5, 0.0])
+
+
+def test_ratings_available_after_all_jobs_done():
+    engine = make_engine(expected_jobs=2)
+
+    async def run():
+        waiting = asyncio.ensure_future(engine.rating(None, "eu", "silvermoon", "a"))
+        engine.job_done((1, "Mage", "Fire", "high"))
+        # Повторная отметка той же задачи не считается
+        engine.job_done((1, "Mage", "Fire", "high"))
+        await asyncio.sleep(0)
+        # Один leaderboard из двух еще не получен - рейтинг не посчитан
+        assert not waiting.done()
+        assert engine.get(("eu", "silvermoon", "A")) is None
+        engine.job_done((2, "Mage", "Fire", "high"))
+        return await waiting
+
+    assert asyncio.run(run()) == 587.5
+    assert engine.get(("us", "stormrage", "b")) == 357.5
+    # Нет очков или нет забегов - None
+    assert engine.get(("eu", "silvermoon", "C")) is None
+    assert engine.get(("eu", "silvermoon", "Nobody")) is None
+    # После расчета буферы забегов освобождены
+    assert engine.runs == 0
+
+
+def test_no_expected_jobs_finalizes_immediately():
+    engine = ScoreEngine(0, timers_ms=TIMERS_MS)
+
+    assert asyncio.run(engine.rating(None, "eu", "silvermoon", "A")) is None
+
+
+def leaderboard_handler(request: httpx.Request) -> httpx.Response:
+    """Одна страница leaderboard: 5 игроков с забегом +12 по таймеру"""
+    variables = json.loads(request.content)["variables"]
+    rankings = [
+        {
+            "name": f"Player{index}",
+            "class": "Mage",
+            "spec": "Fire",
+            "amount": 1_000_000.0,
+            "duration": 1_500_000,
+            "report": {"code": f"r{variables['encounterID']}", "fightID": 1},
+            "server": {"name": "Silvermoon", "region": "EU"},
+            "bracketData": 12,
+            "score": 400.0,
+        }
+        for index in range(5)
+    ]
+    body = {"data": {"worldData": {"encounter": {"characterRankings": {
+        "page": 1, "hasMorePages": False, "count": len(rankings), "rankings": rankings,
+    }}}}}
+    return httpx.Response(200, json=body)
+
+
+def test_local_rating_run_finishes_when_job_fails_before_fetch(monkeypatch):
+    encounters = dict(list(view.ENCOUNTERS.items())[:2])
+    monkeypatch.setattr(view, "ENCOUNTERS", encounters)
+    monkeypatch.setattr(view, "RIO_SOURCE", "local")
+    monkeypatch.setattr(view, "RIO_SAMPLING_ENABLED", False)
+    monkeypatch.setattr(view, "COMPOSITION_ENABLED", False)
+    monkeypatch.setattr(view, "REALM_CATALOG_ENABLED", False)
+    monkeypatch.setattr(view, "_realm_catalog", None)
+    monkeypatch.setattr(view, "_wcl_pool", WclPool.from_clients([("id", "secret")], 3))
+    monkeypatch.setattr(view, "http_client", lambda **kwargs: httpx.AsyncClient(
+        transport=httpx.MockTransport(leaderboard_handler), **kwargs
+    ))
+
+    calls = []
+
+    async def flaky_token(credential=None):
+        # Первая задача падает до запроса leaderboard (например, неверный секрет клиента)
+        calls.append(1)
+        if len(calls) == 1:
+            raise httpx.ConnectError("token endpoint unreachable")
+        return "token"
+
+    monkeypatch.setattr(view, "get_access_token", flaky_token)
+    jobs = [
+        {"encounter_id": encounter_id, "class_name": "Mage", "spec_name": "Fire", "key_type": "high", "pages": 1}
+        for encounter_id in encounters
+    ]
+
+    collected = asyncio.run(asyncio.wait_for(view.collect_jobs(jobs, [], []), timeout=10))
+
+    # Прогон завершился: упавшая задача - ошибка, вторая получила локальный рейтинг
+    assert collected["exceptions"] == 1
+    assert {row.region for row in collected["valid_objects"]} >= {"all"}
+    assert all(row.source == "local" for row in collected["valid_objects"])
@@ -0,0 +1,126 @@
+"""
+Тест: общий кеш RIO и token bucket Raider.IO в Redis (app/agregator/rio_store.py)
+
+Redis - локальный сервер из RIO_REDIS_TEST_URL (используются только ключи
+агрегатора wow:rio*) или in-process fakeredis (token bucket требует lupa для Lua).
+Два "процесса" агрегатора - два клиента одного сервера со своими кешами процесса.
+
+Запуск: python -m pytest -q test_rio_store.py
+"""
+import asyncio
+import os
+
+import httpx
+import pytest
+
+import app.agregator.view as view
+from app.agregator.constant import RIO_CACHE_TTL
+from app.agregator.rio_store import RedisRioStore, KEY_PREFIX, BUCKET_KEY, MGET_CHUNK
+
+REDIS_URL = os.getenv("RIO_REDIS_TEST_URL")
+
+
+def make_redis(server):
+    if REDIS_URL:
+        import redis.asyncio as aioredis
+        return aioredis.from_url(REDIS_URL)
+    fakeredis = pytest.importorskip("fakeredis")
+    return fakeredis.FakeAsyncRedis(server=server)
+
+
+@pytest.fixture
+def server():
+    if REDIS_URL:
+        return None
+    fakeredis = pytest.importorskip("fakeredis")
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def lua():
+    if not REDIS_URL:
+        pytest.importorskip("lupa", reason="Lua скрипты в fakeredis требуют lupa")
+
+
+async def clean(client) -> None:
+    keys = [key async for key in client.scan_iter(match=KEY_PREFIX + "*")]
+    await client.delete(BUCKET_KEY, *keys)
+
+
+def test_cache_roundtrip(server):
+    async def run():
+        client = make_redis(server)
+        await clean(client)
+        store = RedisRioStore(client, rate=0)
+        await store.set("eu-silvermoon-alice", 2750.5)
+        await store.set("eu-silvermoon-bob", None)
+
+        # Ключей больше MGET_CHUNK - несколько MGET в одном pipeline
+        keys = [f"eu-silvermoon-p{i}" for i in range(MGET_CHUNK + 10)]
+        found = await store.get_many(["eu-silvermoon-alice", "eu-silvermoon-bob"] + keys)
+        ttl = await client.ttl(KEY_PREFIX + "eu-silvermoon-alice")
+        await store.close()
+        return found, ttl
+
+    found, ttl = asyncio.run(run())
+    assert found == {"eu-silvermoon-alice": 2750.5, "eu-silvermoon-bob": None}
+    assert 0 < ttl <= RIO_CACHE_TTL
+
+
+def test_token_bucket_shared_between_processes(server, lua):
+    async def run():
+        first = make_redis(server)
+        second = make_redis(server)
+        await clean(first)
+        # 10 запросов в секунду, два подряд без ожидания
+        stores = [RedisRioStore(first, rate=10, burst=2), RedisRioStore(second, rate=10, burst=2)]
+        waits = [await stores[i % 2].reserve() for i in range(6)]
+        for store in stores:
+            await store.close()
+        return waits
+
+    waits = asyncio.run(run())
+    assert waits[:2] == [0.0, 0.0]
+    # Каждый следующий резерв - на 100 мс позже, независимо от процесса
+    for previous, current in zip(waits[2:], waits[3:]):
+        assert 0.08 <= current - previous <= 0.12
+    assert 0.08 <= waits[2] <= 0.11
+
+
+def test_second_process_reuses_scores(server, lua):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request.url.params["name"])
+        if request.url.params["name"] == "Nobody":
+            return httpx.Response(404)
+        return httpx.Response(200, json={"mythic_plus_scores_by_season": [{"scores": {"all": 3000.0}}]})
+
+    players = [("eu", "silvermoon", f"Player{i}") for i in range(5)] + [("us", "stormrage", "Nobody")]
+
+    async def process():
+        """Прогон одного процесса: свой кеш процесса, общий Redis"""
+        view._rio_cache.clear()
+        view._rio_store = RedisRioStore(make_redis(server), rate=1000)
+        try:
+            await view.prefetch_rio_scores(players)
+            async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+                return [await view.fetch_rio_with_retry(client, *player) for player in players]
+        finally:
+            await view._rio_store.close()
+            view._rio_store = None
+
+    async def run():
+        client = make_redis(server)
+        await clean(client)
+        await client.aclose()
+        first = await process()
+        sent = len(requests)
+        second = await process()
+        return first, second, sent
+
+    first, second, sent = asyncio.run(run())
+    # Игрок без RIO тоже кешируется (как None)
+    assert first == second == [3000.0] * 5 + [None]
+    assert sent == 6
+    assert len(requests) == sent  # Второй процесс не обращается к Raider.IO
@@ -0,0 +1,55 @@
+"""
+Тест: воспроизводимая выборка RIO (app/agregator/sampling.py)
+
+Повтор снимка с тем же run_id должен запросить рейтинг тех же игроков, даже
+если игроки leaderboard пришли в другом порядке, а глобальный random изменен.
+
+Запуск: python -m pytest -q test_sampling.py
+"""
+import asyncio
+import random
+
+from app.agregator.sampling import sample_mean_adaptive, sample_rng
+
+RUN_ID = "20261019T120000Z"
+LABEL = "12660:high:Mage:Fire"
+
+
+def replay(players, run_id=RUN_ID, label=LABEL):
+    """Один прогон выборки: игроки, для которых запрошен рейтинг, в порядке запросов"""
+    fetched = []
+
+    async def fetch(player):
+        fetched.append(player)
+        # Почти одинаковые рейтинги: интервал сужается быстро, выборка останавливается рано
+        return 3000.0 + int(player[2][len("player"):]) % 7
+
+    sample = asyncio.run(sample_mean_adaptive(
+        sorted(players), fetch,
+        tolerance=0.05,
+        min_samples=10,
+        batch_size=10,
+        rng=sample_rng(run_id, label),
+    ))
+    assert sample["stopped_early"]
+    return fetched
+
+
+def test_replay_picks_same_sample():
+    players = {("eu", f"realm-{i % 5}", f"player{i}"): 10 + i % 8 for i in range(500)}
+    first = replay(players)
+
+    # Другой порядок игроков leaderboard и другое состояние глобального random
+    random.seed(12345)
+    shuffled = list(players)
+    random.shuffle(shuffled)
+    second = replay(dict.fromkeys(shuffled))
+
+    assert first == second
+    assert len(first) < len(players)
+
+
+def test_leaderboards_sampled_independently():
+    players = [("us", "stormrage", f"player{i}") for i in range(500)]
+    assert replay(players) != replay(players, label="12660:low:Mage:Fire")
+    assert replay(players) != replay(players, run_id="20261020T120000Z")
@@ -0,0 +1,39 @@
+"""
+Тест: разбиение задач прогона на шарды (app/agregator/sharding.py)
+
+Все задачи спека должны попасть в один шард, а шарды - получить близкую стоимость.
+
+Запуск: python -m pytest -q test_sharding.py
+"""
+from app.agregator.sharding import shard_groups, split_jobs
+
+
+def spec_jobs(class_name, spec_name, encounters=(1, 2, 3)):
+    return [
+        {"encounter_id": encounter_id, "class_name": class_name, "spec_name": spec_name, "key_type": key_type, "pages": 1}
+        for encounter_id in encounters
+        for key_type in ("low", "high")
+    ]
+
+
+def test_spec_jobs_stay_in_one_shard():
+    jobs = spec_jobs("Mage", "Fire") + spec_jobs("Mage", "Frost") + spec_jobs("Priest", "Shadow") + spec_jobs("Rogue", "Outlaw")
+
+    shards = split_jobs(jobs, 2)
+
+    specs_by_shard = [{(job["class_name"], job["spec_name"]) for job in shard} for shard in shards]
+    assert not specs_by_shard[0] & specs_by_shard[1]
+    # По два спека одинаковой стоимости на шард, порядок задач внутри шарда исходный
+    assert [len(shard) for shard in shards] == [12, 12]
+    for shard in shards:
+        assert shard == [job for job in jobs if job in shard]
+
+
+def test_jobs_without_spec_are_split_individually():
+    jobs = [{"encounter_id": encounter_id, "key_type": "low", "pages": 1, "popularity": True} for encounter_id in range(4)]
+
+    shards = split_jobs(jobs, 2)
+
+    assert shard_groups(jobs) == 4
+    assert [len(shard) for shard in shards] == [2, 2]
+    assert shard_groups(spec_jobs("Mage", "Fire")) == 1
@@ -0,0 +1,89 @@
+"""
+Тест: кеш процесса с LRU и TTL (app/agregator/ttl_cache.py)
+
+Часы кеша подменяются, поэтому срок записей проверяется без ожидания.
+
+Запуск: python -m pytest -q test_ttl_cache.py
+"""
+import asyncio
+
+from app.agregator.ttl_cache import MISSING, TTLCache, Uncached
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_lru_evicts_least_recently_read():
+    cache = TTLCache(maxsize=2, ttl=60, clock=FakeClock())
+    cache.set("a", 1)
+    cache.set("b", 2)
+    # Чтение "a" делает вытесняемым "b"
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_and_negative_ttl_expire():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, ttl=60, negative_ttl=10, clock=clock)
+    cache.set("found", 3000.0)
+    cache.set("missing", None)
+
+    clock.now = 9.9
+    assert cache.get("missing") is None
+    clock.now = 10.0
+    # None живет negative_ttl, найденное значение - ttl
+    assert cache.get("missing") is MISSING
+    assert cache.get("found") == 3000.0
+    clock.now = 60.0
+    assert cache.get("found") is MISSING
+    assert cache.stats()["expirations"] == 2
+
+
+def test_get_or_load_single_flight():
+    cache = TTLCache(maxsize=10, ttl=60, clock=FakeClock())
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 42
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_load("key", loader) for _ in range(5)))
+
+    assert asyncio.run(run()) == [42] * 5
+    # Одна загрузка на пять одновременных обращений, значение закешировано
+    assert calls == [1]
+    assert cache.get("key") == 42
+
+
+def test_uncached_result_is_shared_but_not_stored():
+    cache = TTLCache(maxsize=10, ttl=60, negative_ttl=3600, clock=FakeClock())
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return Uncached()
+
+    async def run():
+        first = await asyncio.gather(*(cache.get_or_load("icon", loader) for _ in range(3)))
+        second = await cache.get_or_load("icon", loader)
+        return first, second
+
+    first, second = asyncio.run(run())
+    # Временная ошибка отдается ожидающим как None, а следующее обращение загружает снова
+    assert first == [None] * 3
+    assert second is None
+    assert calls == [1, 1]
+    assert not cache.contains("icon")